@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Compares the disk usage and the time of a sweep with and without compression of the cache and of the outputs. A
+synthetic national-scale dataset is replayed twice for every compression: the first sweep fills the cache, the second
+one is served from it. Reports the size of the cache entries and of the database, the size of every output and the
+wall time of both sweeps.
+
+Usage: PYTHONPATH=src python benchmarks/bench_compression.py --centres 1200 --format csv --format json
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from vaccinare_covid_api.__main__ import AVAILABLE_SLOTS_FORMATS, BINARY_FORMATS, create_formatter
+from vaccinare_covid_api.cache import SQLITE_CACHE_FILE, create_cache
+from vaccinare_covid_api.client import VaccinareCovidApi
+from vaccinare_covid_api.compression import COMPRESSION_EXTENSIONS, open_file
+from vaccinare_covid_api.replay import ReplayTransport, generate_dataset
+
+EXTENSIONS = {compression: extension for extension, compression in COMPRESSION_EXTENSIONS.items()}
+
+
+def sweep(bundle, cache, months, formats, directory, compression):
+    client = VaccinareCovidApi(session_token="token", transport=ReplayTransport(bundle), cache=cache,
+                               cache_lifetime=3600, memo_lifetime=0, workers=8)
+    paths = [os.path.join(directory, output_format + (EXTENSIONS[compression] if compression else ""))
+             for output_format in formats]
+    files = [open_file(path, "wb" if output_format in BINARY_FORMATS else "w", compression)
+             for output_format, path in zip(formats, paths)]
+    writers = [create_formatter(output_format, file, AVAILABLE_SLOTS_FORMATS[output_format])
+               for output_format, file in zip(formats, files)]
+    started_at = time.perf_counter()
+    for writer in writers:
+        writer.start()
+    for centre, slot in client.get_available_slots_for_all_centres(months):
+        for writer in writers:
+            writer.write({"centre": centre, "slot": slot})
+    for writer, file in zip(writers, files):
+        writer.end()
+        file.close()
+    return time.perf_counter() - started_at, {path: os.path.getsize(path) for path in paths}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--centres", type=int, default=1200)
+    parser.add_argument("--months", type=int, default=2)
+    parser.add_argument("--compression", action="append", choices=["none", "gzip", "zstd"])
+    parser.add_argument("--format", action="append", choices=list(AVAILABLE_SLOTS_FORMATS.keys()))
+    args = parser.parse_args()
+
+    bundle = generate_dataset(centres=args.centres, months=args.months)
+    formats = args.format or ["csv", "csv_by_centre", "json", "ndjson", "compact"]
+    print(f"{'compression':12} {'entries MB':>10} {'database MB':>11} {'cold':>8} {'warm':>8}  outputs MB")
+    for compression in args.compression or ["none", "gzip", "zstd"]:
+        compression = None if compression == "none" else compression
+        with tempfile.TemporaryDirectory() as directory:
+            cache = create_cache("sqlite", directory, compression=compression)
+            cold, _sizes = sweep(bundle, cache, args.months, formats, directory, compression)
+            warm, sizes = sweep(bundle, cache, args.months, formats, directory, compression)
+            entries = cache._connection().execute("SELECT SUM(size) FROM responses").fetchone()[0]
+            cache._connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            cache.close()
+            database = os.path.getsize(os.path.join(directory, SQLITE_CACHE_FILE))
+            outputs = "  ".join(f"{os.path.basename(path)} {size / 1024 / 1024:.1f}" for path, size in sizes.items())
+            print(f"{compression or 'none':12} {entries / 1024 / 1024:>10.1f} {database / 1024 / 1024:>11.1f} "
+                  f"{cold:>7.2f}s {warm:>7.2f}s  {outputs}")
+
+
+if __name__ == "__main__":
+    main()
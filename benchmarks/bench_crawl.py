@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+End-to-end crawl benchmark: replays a synthetic national-scale dataset with a synthetic latency, crawls it with
+`VaccinareCovidApi` and writes every output format, each in its own process. Reports the crawl wall time, the
+requests per second, the formatter rows per second and the peak memory of every format (on Linux, not counting
+loading the dataset).
+
+Usage: PYTHONPATH=src python benchmarks/bench_crawl.py --centres 1200 --latency 0.005 --workers 16
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+from vaccinare_covid_api.__main__ import AVAILABLE_SLOTS_FORMATS, BINARY_FORMATS, create_formatter
+from vaccinare_covid_api.client import VaccinareCovidApi
+from vaccinare_covid_api.replay import ReplayTransport, generate_dataset, load_bundle, save_bundle
+
+
+def _reset_peak_memory():
+    # Linux only: resets the peak resident set size, so that loading the bundle is not counted
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_memory_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def crawl(bundle_path, output_format, months, latency, error_rate, workers, directory):
+    bundle = load_bundle(bundle_path)
+    transport = ReplayTransport(bundle, latency=latency, error_rate=error_rate)
+    del bundle
+    _reset_peak_memory()
+    client = VaccinareCovidApi(session_token="token", transport=transport, workers=workers, max_retries=5)
+
+    path = os.path.join(directory, output_format)
+    formatter_time = 0
+    rows = 0
+    started_at = time.perf_counter()
+    with open(path, "wb" if output_format in BINARY_FORMATS else "w") as file:
+        writer = create_formatter(output_format, file, AVAILABLE_SLOTS_FORMATS[output_format])
+        writer.start()
+        for centre, slot in client.get_available_slots_for_all_centres(months):
+            write_started_at = time.perf_counter()
+            writer.write({"centre": centre, "slot": slot})
+            formatter_time += time.perf_counter() - write_started_at
+            rows += 1
+        write_started_at = time.perf_counter()
+        writer.end()
+        formatter_time += time.perf_counter() - write_started_at
+    elapsed = time.perf_counter() - started_at
+
+    requests = sum(client.metrics.summary()["requests"].values())
+    return {"format": output_format, "rows": rows, "elapsed": elapsed, "requests": requests,
+            "formatter_time": formatter_time, "peak_memory": _peak_memory_mb(), "size": os.path.getsize(path)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--centres", type=int, default=1200)
+    parser.add_argument("--months", type=int, default=2)
+    parser.add_argument("--days-per-month", type=int, default=20)
+    parser.add_argument("--slots-per-day", type=int, default=12)
+    parser.add_argument("--latency", type=float, default=0.005, help="Mean synthetic latency of the API in seconds")
+    parser.add_argument("--error-rate", type=float, default=0, help="Share of the API requests failing with a 503")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--format", action="append", choices=list(AVAILABLE_SLOTS_FORMATS.keys()))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        started_at = time.perf_counter()
+        bundle = generate_dataset(centres=args.centres, months=args.months, days_per_month=args.days_per_month,
+                                  slots_per_day=args.slots_per_day)
+        bundle_path = os.path.join(directory, "bundle.json")
+        save_bundle(bundle, bundle_path)
+        print(f"Generated {len(bundle['responses'])} responses in {time.perf_counter() - started_at:.1f}s")
+        del bundle
+
+        print(f"{'format':15} {'rows':>9} {'wall':>8} {'requests/s':>11} {'rows/s':>12} {'peak MB':>8} "
+              f"{'output MB':>9}")
+        # Every format runs in a fresh process, so that the peak memory is its own
+        context = multiprocessing.get_context("spawn")
+        for output_format in args.format or AVAILABLE_SLOTS_FORMATS.keys():
+            with context.Pool(1) as pool:
+                result = pool.apply(crawl, (bundle_path, output_format, args.months, args.latency, args.error_rate,
+                                            args.workers, directory))
+            print(f"{result['format']:15} {result['rows']:>9} {result['elapsed']:>7.2f}s "
+                  f"{result['requests'] / result['elapsed']:>11,.0f} "
+                  f"{result['rows'] / result['formatter_time']:>12,.0f} "
+                  f"{result['peak_memory']:>8.1f} {result['size'] / 1024 / 1024:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
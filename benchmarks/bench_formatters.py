@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Measures how many records per second the output formatters write for a synthetic sweep.
+
+Usage: PYTHONPATH=src python benchmarks/bench_formatters.py --rows 2000000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from datetime import datetime, timedelta
+
+from vaccinare_covid_api.__main__ import AVAILABLE_SLOTS_FORMATS, BINARY_FORMATS, create_formatter
+
+
+def synthetic_records(rows, slots_per_centre=200):
+    # Slots are shared by all the centres so that generating the records takes a negligible part of the measured time
+    start = datetime(2021, 2, 1, 8)
+    slots = []
+    for idx in range(slots_per_centre):
+        slot_start = start + timedelta(hours=idx // 10 * 24 + idx % 10)
+        slots.append({"id": idx, "startTime": slot_start, "endTime": slot_start + timedelta(hours=1),
+                      "availablePlaces": 1})
+
+    centre = None
+    for idx in range(rows):
+        if idx % slots_per_centre == 0:
+            centre_id = idx // slots_per_centre
+            centre = {"id": centre_id, "name": f"Centru {centre_id}", "countyName": f"Județ {centre_id // 25}",
+                      "localityName": f"Localitate {centre_id // 5}", "address": f"Strada {centre_id}, nr. 1"}
+        yield {"centre": centre, "slot": slots[idx % slots_per_centre]}
+
+
+def bench(output_format, header, rows):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "output")
+        with open(path, "wb" if output_format in BINARY_FORMATS else "w") as file:
+            writer = create_formatter(output_format, file, header)
+            started_at = time.perf_counter()
+            writer.start()
+            for record in synthetic_records(rows):
+                writer.write(record)
+            writer.end()
+            elapsed = time.perf_counter() - started_at
+        print(f"{output_format:15} {rows:>10} records {elapsed:8.2f}s {rows / elapsed:>12,.0f} records/s "
+              f"{os.path.getsize(path) / 1024 / 1024:8.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2000000)
+    parser.add_argument("--format", action="append", choices=list(AVAILABLE_SLOTS_FORMATS.keys()))
+    args = parser.parse_args()
+
+    for output_format in args.format or AVAILABLE_SLOTS_FORMATS.keys():
+        bench(output_format, AVAILABLE_SLOTS_FORMATS[output_format], args.rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Measures how fast the availability history ingests sweeps and answers its queries once it holds millions of rows.
+
+Usage: PYTHONPATH=src python benchmarks/bench_history.py --crawls 20 --centres 1000 --slots-per-centre 100
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from datetime import datetime, timedelta
+
+from vaccinare_covid_api.history import AvailabilityHistory
+
+
+def synthetic_sweep(centres, slots_per_centre, rng):
+    # Every sweep books about 10% of the slots of the previous one and opens as many new ones
+    start = datetime(2021, 5, 1, 8)
+    for centre_id in range(centres):
+        centre = {"id": centre_id, "name": f"Centru {centre_id}", "countyName": f"Județ {centre_id // 25}",
+                  "localityName": f"Localitate {centre_id // 5}"}
+        for idx in range(slots_per_centre):
+            if rng.random() < 0.1:
+                idx += slots_per_centre
+            slot_start = start + timedelta(minutes=15 * idx)
+            yield centre, {"startTime": slot_start, "endTime": slot_start + timedelta(minutes=15),
+                           "availablePlaces": 1}
+
+
+def timed(name, query):
+    started_at = time.perf_counter()
+    result = query()
+    print(f"{name:30} {time.perf_counter() - started_at:8.3f}s {len(result):>10} rows")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--crawls", type=int, default=20)
+    parser.add_argument("--centres", type=int, default=1000)
+    parser.add_argument("--slots-per-centre", type=int, default=100)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "history.sqlite")
+        history = AvailabilityHistory(path)
+
+        rows = 0
+        started_at = time.perf_counter()
+        since = time.time()
+        for _ in range(args.crawls):
+            for _pair in history.record(synthetic_sweep(args.centres, args.slots_per_centre, rng)):
+                rows += 1
+        elapsed = time.perf_counter() - started_at
+        print(f"{'ingest':30} {elapsed:8.2f}s {rows:>10} rows {rows / elapsed:>12,.0f} rows/s "
+              f"{os.path.getsize(path) / 1024 / 1024:8.1f} MB")
+
+        timed("appeared since", lambda: history.appeared_since(since))
+        timed("diff of the last two crawls", lambda: history.diff()["appeared"])
+        timed("availability by county", lambda: history.availability_by_county(since))
+        timed("availability of a centre", lambda: history.centre_availability(args.centres // 2))
+        history.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Simulates a day of sweeps with the same request budget per sweep, either spent on the centres crawled least recently
+(round robin, the budget-limited equivalent of full sweeps) or by `CrawlScheduler`. A few centres change every few
+minutes, some every few hours and most never have any slots. Reports the share of the centres whose published slots
+are out of date, sampled at every sweep, and the requests sent.
+
+Usage: PYTHONPATH=src python benchmarks/bench_scheduler.py --centres 1200 --budget 300 --interval 300
+"""
+import argparse
+import logging
+import os
+import random
+import tempfile
+
+from datetime import datetime
+
+from vaccinare_covid_api.scheduler import CrawlScheduler
+
+KINDS = [("hot", 0.05, 300), ("warm", 0.25, 3 * 3600), ("quiet", 0.7, None)]
+
+
+class SimulatedApi:
+    def __init__(self, centres, seed=0):
+        rng = random.Random(seed)
+        self.rng = rng
+        self.mean_time_between_changes = {}
+        for centre in centres:
+            draw = rng.random()
+            for _kind, share, mean_time in KINDS:
+                if draw < share:
+                    break
+                draw -= share
+            self.mean_time_between_changes[centre["id"]] = mean_time
+        self.versions = {centre["id"]: 0 for centre in centres}
+        self.requests = 0
+
+    def advance(self, seconds):
+        for centre_id, mean_time in self.mean_time_between_changes.items():
+            if mean_time and self.rng.random() < 1 - 2.718281828 ** (-seconds / mean_time):
+                self.versions[centre_id] += 1
+
+    def slots(self, centre_id):
+        if not self.mean_time_between_changes[centre_id]:
+            return []
+        return [{"startTime": datetime(2021, 5, 1, 9), "availablePlaces": self.versions[centre_id]}]
+
+    def crawl_centres(self, centres, months_to_check):
+        for centre in centres:
+            slots = self.slots(centre["id"])
+            self.requests += months_to_check + len(slots)
+            for slot in slots:
+                yield centre, slot
+
+
+def round_robin(api, centres, budget, published, now, last_crawled):
+    spent = 0
+    for centre in sorted(centres, key=lambda centre: last_crawled.get(centre["id"], -1)):
+        if spent >= budget and centre["id"] in last_crawled:
+            break
+        last_crawled[centre["id"]] = now
+        published[centre["id"]] = api.slots(centre["id"])
+        spent += 1 + len(published[centre["id"]])
+        api.requests += 1 + len(published[centre["id"]])
+
+
+def simulate(centres, budget, interval, max_staleness, use_scheduler, directory):
+    api = SimulatedApi(centres)
+    scheduler = CrawlScheduler(os.path.join(directory, f"{use_scheduler}.sqlite"), budget, max_staleness=max_staleness,
+                               interval=interval)
+    published = {}
+    last_crawled = {}
+    out_of_date = []
+    for sweep in range(int(24 * 3600 / interval)):
+        now = sweep * interval
+        api.advance(interval)
+        if use_scheduler:
+            published = {}
+            for centre, slot in scheduler.crawl(api, centres, 1, now=now):
+                published.setdefault(centre["id"], []).append(slot)
+        else:
+            round_robin(api, centres, budget, published, now, last_crawled)
+        out_of_date.append(sum(published.get(centre["id"], []) != api.slots(centre["id"]) for centre in centres))
+    return sum(out_of_date) / len(out_of_date) / len(centres), api.requests
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--centres", type=int, default=1200)
+    parser.add_argument("--budget", type=int, default=300, help="Requests per sweep")
+    parser.add_argument("--interval", type=int, default=300, help="Seconds between sweeps")
+    parser.add_argument("--max-staleness", type=int, default=6 * 3600)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    centres = [{"id": idx} for idx in range(args.centres)]
+    with tempfile.TemporaryDirectory() as directory:
+        for name, use_scheduler in (("round robin", False), ("scheduler", True)):
+            stale, requests = simulate(centres, args.budget, args.interval, args.max_staleness, use_scheduler,
+                                       directory)
+            print(f"{name:12} {stale * 100:6.2f}% of the centres out of date {requests:>9} requests")
+
+
+if __name__ == "__main__":
+    main()
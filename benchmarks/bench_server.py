@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Load-tests the serve-api HTTP server locally: several clients poll a few queries over keep-alive connections, either
+downloading the responses or revalidating them with If-None-Match.
+
+Usage: PYTHONPATH=src python benchmarks/bench_server.py --rows 100000 --clients 8 --requests 500
+"""
+import argparse
+import http.client
+import threading
+import time
+
+from bench_formatters import synthetic_records
+from vaccinare_covid_api.__main__ import AVAILABLE_SLOTS_FORMATS, create_formatter
+from vaccinare_covid_api.server import AvailabilityServer
+
+QUERIES = ["/slots", "/slots?county=Jude%C8%9B%203", "/slots?date=2021-02-02&format=csv",
+           "/slots?locality=Localitate%2010&format=csv_by_centre", "/slots?page=5&size=500&format=ndjson"]
+
+
+def client(server, requests, revalidate, latencies):
+    connection = http.client.HTTPConnection(*server.server_address)
+    etags = {}
+    for idx in range(requests):
+        path = QUERIES[idx % len(QUERIES)]
+        headers = {"Accept-Encoding": "gzip"}
+        if revalidate and path in etags:
+            headers["If-None-Match"] = etags[path]
+        started_at = time.perf_counter()
+        connection.request("GET", path, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - started_at)
+        etags[path] = response.headers["ETag"]
+    connection.close()
+
+
+def bench(server, clients, requests, revalidate):
+    latencies = []
+    threads = [threading.Thread(target=client, args=(server, requests, revalidate, latencies))
+               for _ in range(clients)]
+    started_at = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started_at
+    latencies.sort()
+    print(f"{'revalidate' if revalidate else 'download':12} {len(latencies):>8} requests {elapsed:8.2f}s "
+          f"{len(latencies) / elapsed:>10,.0f} requests/s  p50 {latencies[len(latencies) // 2] * 1000:7.2f} ms  "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=500, help="Requests sent by every client")
+    args = parser.parse_args()
+
+    server = AvailabilityServer(("127.0.0.1", 0), AVAILABLE_SLOTS_FORMATS, create_formatter)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    started_at = time.perf_counter()
+    server.update(list(synthetic_records(args.rows)))
+    print(f"{'index':12} {args.rows:>8} records {time.perf_counter() - started_at:8.2f}s")
+
+    for revalidate in (False, True):
+        bench(server, args.clients, args.requests, revalidate)
+    server.shutdown()
+    server.server_close()
+
+
+if __name__ == "__main__":
+    main()
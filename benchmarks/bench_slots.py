@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Benchmarks parsing the day slots returned by the API: `datetime.strptime` into dict copies (the previous parser),
+`parse_date` into dict copies (the default) and `parse_date` into compact `Slot` records (--compact-slots). Reports the
+CPU time and the memory held by the parsed slots, not counting the decoded JSON payloads they are parsed from.
+
+Usage: PYTHONPATH=src python benchmarks/bench_slots.py --centres 1200 --days 40 --slots-per-day 12
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+from datetime import datetime, timedelta
+
+from vaccinare_covid_api.client import DATE_FORMAT, _parse_slot
+
+
+def synthetic_payloads(centres, days, slots_per_day):
+    start = datetime(2021, 2, 1, 8, 30)
+    for centre_id in range(centres):
+        for day in range(days):
+            slots = []
+            for idx in range(slots_per_day):
+                slot_start = start + timedelta(days=day, minutes=30 * idx)
+                slots.append({"startTime": slot_start.strftime(DATE_FORMAT),
+                              "endTime": (slot_start + timedelta(minutes=30)).strftime(DATE_FORMAT),
+                              "availablePlaces": (centre_id + idx) % 3})
+            yield centre_id, json.dumps(slots)
+
+
+def parse_with_strptime(centre_id, slot):
+    return dict(slot,
+                startTime=datetime.strptime(slot["startTime"], DATE_FORMAT),
+                endTime=datetime.strptime(slot["endTime"], DATE_FORMAT))
+
+
+PARSERS = {
+    "strptime": parse_with_strptime,
+    "parse_date": lambda centre_id, slot: _parse_slot(slot, centre_id),
+    "compact": lambda centre_id, slot: _parse_slot(slot, centre_id, compact=True),
+}
+
+
+def bench(name, payloads):
+    parse = PARSERS[name]
+    # Tracing allocations slows the parsers down, so the CPU time and the memory are measured in separate passes
+    started_at = time.process_time()
+    parsed = [parse(centre_id, slot) for centre_id, slots in payloads for slot in slots]
+    elapsed = time.process_time() - started_at
+    del parsed
+    tracemalloc.start()
+    parsed = [parse(centre_id, slot) for centre_id, slots in payloads for slot in slots]
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"{name:12} {len(parsed):>10} slots {elapsed:8.2f}s CPU {len(parsed) / elapsed:>12,.0f} slots/s "
+          f"{memory / 1024 / 1024:>8.1f} MB {memory / len(parsed):>6.0f} B/slot")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--centres", type=int, default=1200)
+    parser.add_argument("--days", type=int, default=40)
+    parser.add_argument("--slots-per-day", type=int, default=12)
+    args = parser.parse_args()
+
+    payloads = [(centre_id, json.loads(body))
+                for centre_id, body in synthetic_payloads(args.centres, args.days, args.slots_per_day)]
+    for name in PARSERS:
+        bench(name, payloads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Measures how long importing the CLI takes, using `python -X importtime`, and fails if it takes longer than the budget.
+
+Usage: PYTHONPATH=src python benchmarks/bench_startup.py --budget-ms 150
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+MODULE = "vaccinare_covid_api.__main__"
+
+
+def import_times(module):
+    """
+    :return: the cumulative import time in microseconds of every module imported by `module`, by module name
+    """
+    # The modules imported by the interpreter at startup are reported before "site", and are left out
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], env=os.environ,
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _self_time, cumulative, name = line[len("import time:"):].split("|")
+        if name.strip() == "site":
+            times = {}
+            continue
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget-ms", type=float, default=150, help="Max import time of the CLI in milliseconds")
+    parser.add_argument("--runs", type=int, default=5, help="The best of this many runs is compared to the budget")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to show")
+    args = parser.parse_args()
+
+    runs = [import_times(MODULE) for _ in range(args.runs)]
+    best = min(runs, key=lambda times: times[MODULE])
+    elapsed_ms = best[MODULE] / 1000
+
+    for name, cumulative in sorted(best.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{cumulative / 1000:8.1f} ms  {name}")
+    print(f"{MODULE} imports in {elapsed_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+
+    if elapsed_ms > args.budget_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,54 +1,146 @@
 import argparse
+import functools
 import json
 import logging
 import os
+import random
 import sys
+import tempfile
+import threading
+import time
 
+from datetime import datetime
+
+from .cache import CACHE_BACKENDS, create_cache, max_cache_age
+from .catalogue import CATALOGUE_FILE, CentreCatalogue
 from .client import VaccinareCovidApi
-from .storage import GoogleDriveUploader
-from .formatters import CsvFormatter, JsonFormatter
+from .compression import COMPRESSIONS, compression_for_path, open_file
+from .formatters import CompactFormatter, CsvFormatter, JsonFormatter, MultiFormatter, NdjsonFormatter
+from .history import HISTORY_FILE, AvailabilityHistory
+from .incremental import SNAPSHOT_FILE, AvailabilitySnapshot
+from .ratelimit import CircuitBreaker, RateLimiter
+from .scheduler import SCHEDULE_FILE, CrawlScheduler
+
+
+@functools.lru_cache(maxsize=None)
+def get_gdrive_uploader():
+    # The Drive service is built once per process and reused by every upload, including across `watch` iterations.
+    # The Google API client libraries are slow to import, so they are only imported when uploading.
+    from .storage import GoogleDriveUploader
+
+    return GoogleDriveUploader()
+
 
+@functools.lru_cache(maxsize=None)
+def get_history(path):
+    # Kept open for the whole process, so that `watch` appends every sweep through the same connection
+    return AvailabilityHistory(path)
 
-def maybe_upload_gdrive(args):
+
+@functools.lru_cache(maxsize=None)
+def get_scheduler(path, budget, max_staleness, interval):
+    # Kept for the whole process, so that `watch` keeps the statistics of the centres in memory between sweeps
+    return CrawlScheduler(path, budget, max_staleness=max_staleness, interval=interval)
+
+
+def maybe_upload_gdrive(args, outputs):
     if args.upload_to_gdrive:
-        src_mimetype = None
-        dest_mimetype = None
+        uploads = []
+        for output_format, file, title in outputs:
+            src_mimetype = None
+            dest_mimetype = None
+
+            if output_format[0:3] == "csv":
+                src_mimetype = "text/csv"
+                dest_mimetype = "application/vnd.google-apps.spreadsheet"
+            elif output_format in BINARY_FORMATS:
+                src_mimetype = "application/octet-stream"
+
+            uploads.append((file, title, src_mimetype, dest_mimetype))
 
-        if args.format[0:3] == "csv":
-            src_mimetype = "text/csv"
-            dest_mimetype = "application/vnd.google-apps.spreadsheet"
+        get_gdrive_uploader().upload_many(uploads)
 
-        gdrive_uploader = GoogleDriveUploader()
-        gdrive_uploader.upload(args.file, args.gdrive_document_title, src_mimetype=src_mimetype,
-                               dest_mimetype=dest_mimetype)
 
+def get_outputs(args):
+    """
+    Pairs every --format with the --file and --gdrive-document-title given in the same position
+    :return: a list of (format, file, gdrive document title) tuples
+    """
+    formats = args.format or [args.default_format]
+    files = args.file or [None]
+    titles = args.gdrive_document_title or [args.default_gdrive_document_title]
 
-def process_output(args, header, data):
-    if args.upload_to_gdrive and not args.file:
+    if len(formats) != len(files):
+        raise Exception("You need to specify an output file for each format")
+    if args.upload_to_gdrive and None in files:
         raise Exception("You need to specify and output file when uploading to Google Drive")
-    file = sys.stdout
-    if args.file:
-        file = open(args.file, "w")
-    if args.format[0:3] == "csv":
-        writer = CsvFormatter(file, header)
-    elif args.format == "json":
-        writer = JsonFormatter(file)
-    else:
-        raise Exception(f"Invalid format: {args.format}")
+    if args.upload_to_gdrive and len(titles) != len(files):
+        raise Exception("You need to specify a Google Drive document title for each output file")
 
-    writer.start()
-    for record in data:
-        writer.write(record)
-    writer.end()
+    return list(zip(formats, files, titles if args.upload_to_gdrive else [None] * len(files)))
 
-    if file is not sys.stdout:
-        file.close()
 
-    maybe_upload_gdrive(args)
+def create_formatter(output_format, file, header, **csv_options):
+    if output_format[0:3] == "csv":
+        return CsvFormatter(file, header, **csv_options)
+    elif output_format == "ndjson":
+        return NdjsonFormatter(file)
+    elif output_format == "compact":
+        return CompactFormatter(file)
+    return JsonFormatter(file)
 
 
-def get_centres(client, args):
-    process_output(args, {
+def process_output(args, formats, data):
+    """
+    Writes the records to every output. Output files are written to a temporary file next to them and renamed once
+    complete, so readers never see a partially written file. Files ending with .gz or .zst are compressed.
+    """
+    outputs = get_outputs(args)
+
+    files = []
+    writers = []
+    try:
+        for output_format, path, _title in outputs:
+            if output_format not in formats:
+                raise Exception(f"Invalid format: {output_format}")
+
+            binary = output_format in BINARY_FORMATS
+            if path:
+                fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-")
+                os.close(fd)
+                os.chmod(temp_path, 0o644)
+                # Paths ending with .gz or .zst are compressed while they are written
+                file = open_file(temp_path, "wb" if binary else "w", compression_for_path(path))
+            else:
+                temp_path = None
+                file = sys.stdout.buffer if binary else sys.stdout
+            files.append((file, temp_path, path))
+            writers.append(create_formatter(output_format, file, formats[output_format], grouped=args.grouped,
+                                            max_groups=args.max_groups))
+
+        writer = writers[0] if len(writers) == 1 else MultiFormatter(writers)
+        writer.start()
+        for record in data:
+            writer.write(record)
+        writer.end()
+
+        for file, temp_path, path in files:
+            if temp_path:
+                file.close()
+                os.replace(temp_path, path)
+    finally:
+        for file, temp_path, _path in files:
+            if temp_path and os.path.exists(temp_path):
+                file.close()
+                os.remove(temp_path)
+
+    maybe_upload_gdrive(args, outputs)
+
+
+BINARY_FORMATS = ["compact"]
+
+CENTRES_FORMATS = {
+    "csv": {
         "id": "ID",
         "name": "Denumire",
         "code": "Code",
@@ -58,7 +150,44 @@ def get_centres(client, args):
         "localityName": "Localitate",
         "address": "Adresă",
         "availableSlots": "Locuri disponibile",
-    }, client.get_centres())
+    },
+    "json": None,
+    "ndjson": None,
+    "compact": None
+}
+
+AVAILABLE_SLOTS_FORMATS = {
+    "csv": {
+        "centre.countyName": "Județ",
+        "centre.localityName": "Localitate",
+        "centre.name": "Centru",
+        "centre.address": "Adresă centru",
+        "slot.startTime": "Dată și oră",
+    },
+    "csv_by_centre": {
+        "centre.countyName": "Județ",
+        "centre.localityName": "Localitate",
+        "centre.name": "Centru",
+        "centre.address": "Adresă centru",
+        "slot.startTime.date[]": "Date disponibile"
+    },
+    "csv_by_date": {
+        "centre.countyName": "Județ",
+        "centre.localityName": "Localitate",
+        "centre.name": "Centru",
+        "centre.address": "Adresă centru",
+        "slot.startTime.date": "Dată"
+    },
+    "json": None,
+    "ndjson": None,
+    "compact": None
+}
+
+
+def get_centres(client, args):
+    # The catalogue may be out of date, so the list of centres is always fetched from the API
+    centres = client.find_centres(args.county, args.locality, args.centre_id, use_catalogue=False)
+    process_output(args, CENTRES_FORMATS, centres)
 
 
 def get_counties(client, _args):
@@ -66,38 +195,239 @@ def get_counties(client, _args):
 
 
 def get_available_slots(client, args):
-    formats = {
-        "csv": {
-            "centre.countyName": "Județ",
-            "centre.localityName": "Localitate",
-            "centre.name": "Centru",
-            "centre.address": "Adresă centru",
-            "slot.startTime": "Dată și oră",
-        },
-        "csv_by_centre": {
-            "centre.countyName": "Județ",
-            "centre.localityName": "Localitate",
-            "centre.name": "Centru",
-            "centre.address": "Adresă centru",
-            "slot.startTime.date[]": "Date disponibile"
-        },
-        "csv_by_date": {
-            "centre.countyName": "Județ",
-            "centre.localityName": "Localitate",
-            "centre.name": "Centru",
-            "centre.address": "Adresă centru",
-            "slot.startTime.date": "Dată"
-        },
-        "json": None
-    }
-
-    if args.format not in formats:
-        raise Exception(f"Invalid output format: {args.format}")
-
-    process_output(
-        args,
-        formats[args.format],
-        ({"centre": centre, "slot": slot} for centre, slot in client.get_available_slots_for_all_centres(args.months)))
+    sharded = args.processes > 1 or args.shard_count > 1 or args.run_file
+    if args.request_budget:
+        if sharded:
+            raise Exception("--request-budget cannot be combined with sharded crawls")
+        scheduler = get_scheduler(os.path.join(args.cache_path, SCHEDULE_FILE), args.request_budget,
+                                  args.max_centre_staleness, args.interval)
+        pairs = scheduler.crawl(client, client.find_centres(args.county, args.locality, args.centre_id), args.months)
+    elif not sharded:
+        pairs = client.get_available_slots_for_all_centres(args.months, counties=args.county, localities=args.locality,
+                                                           centre_ids=args.centre_id)
+    else:
+        pairs, positions = crawl_shard(client, args)
+        if args.run_file:
+            write_run_file(pairs, positions, args.run_file)
+            return
+
+    if args.history:
+        scope = {"months": args.months, "county": args.county, "locality": args.locality, "centre_id": args.centre_id}
+        if args.shard_count > 1:
+            scope["shard"] = f"{args.shard_index}/{args.shard_count}"
+        pairs = get_history(os.path.join(args.cache_path, HISTORY_FILE)).record(
+            pairs, scope={name: value for name, value in scope.items() if value})
+    process_output(args, AVAILABLE_SLOTS_FORMATS, ({"centre": centre, "slot": slot} for centre, slot in pairs))
+
+
+def crawl_shard(client, args):
+    """
+    Crawls the centres of the --shard-index shard, split across --processes worker processes
+    :return: the (centre, slot) pairs, in the order of the centres, and the position of every crawled centre in the
+             list of all the centres, by centre ID
+    """
+    from .sharding import select_shard, sharded_crawl
+
+    if not 0 <= args.shard_index < args.shard_count:
+        raise Exception("--shard-index needs to be between 0 and --shard-count - 1")
+    indexed_centres = select_shard(list(client.find_centres(args.county, args.locality, args.centre_id)),
+                                   args.shard_index, args.shard_count)
+    positions = {centre["id"]: position for position, centre in indexed_centres}
+    centres = [centre for _position, centre in indexed_centres]
+    if args.processes <= 1:
+        return client.crawl_centres(centres, args.months), positions
+
+    # Every worker process has its own rate limiter, so the delay is spread across them to keep the same overall rate
+    worker_args = argparse.Namespace(**{name: value for name, value in vars(args).items() if name != "func"})
+    worker_args.delay_between_requests = (args.delay_between_requests or 0) * args.processes
+    worker_args.record_traffic = None
+    # When run with `python -m`, this module is `__main__`, which worker processes cannot import functions from, so the
+    # function creating their client is taken from the module imported under its package name
+    from .__main__ import create_client as create_worker_client
+
+    return sharded_crawl(functools.partial(create_worker_client, worker_args), centres, args.months, args.processes,
+                         directory=args.cache_path, metrics=client.metrics), positions
+
+
+def write_run_file(pairs, positions, path):
+    from .sharding import write_run
+
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write_run(pairs, positions, f)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def merge_run_files(_client, args):
+    from .sharding import merge_runs
+
+    process_output(args, AVAILABLE_SLOTS_FORMATS,
+                   ({"centre": centre, "slot": slot} for centre, slot in merge_runs(args.runs)))
+
+
+def history(_client, args):
+    store = get_history(os.path.join(args.cache_path, HISTORY_FILE))
+    since = time.time() - args.since
+    if args.query == "crawls":
+        result = store.crawls(args.limit)
+    elif args.query == "appeared":
+        result = store.appeared_since(since)
+    elif args.query == "counties":
+        result = store.availability_by_county(since)
+    elif args.query == "diff":
+        result = store.diff(args.crawl_id)
+    else:
+        if args.centre_id is None:
+            raise Exception("The centre query needs --centre-id")
+        day = datetime.strptime(args.day, "%Y-%m-%d").date() if args.day else None
+        result = store.centre_availability(args.centre_id, day)
+    print(json.dumps(result, indent=4, default=str))
+
+
+def watch(client, args):
+    """
+    Runs get-available-slots every --interval seconds, plus a random jitter, reusing the same client, connections,
+    caches and Google Drive service for all the sweeps
+    """
+    iteration = 0
+    while True:
+        started_at = time.monotonic()
+        try:
+            get_available_slots(client, args)
+        except Exception:
+            logging.exception("Sweep failed")
+        iteration += 1
+        logging.info(f"Sweep {iteration} done in {time.monotonic() - started_at:.1f}s")
+
+        if args.iterations and iteration >= args.iterations:
+            break
+        time.sleep(max(0.0, args.interval - (time.monotonic() - started_at)) + random.uniform(0, args.jitter))
+
+
+def serve_api(client, args):
+    """
+    Serves the latest sweep over HTTP while sweeps run in the background every --interval seconds
+    """
+    from .server import AvailabilityServer
+
+    server = AvailabilityServer((args.host, args.port), AVAILABLE_SLOTS_FORMATS, create_formatter)
+
+    def refresh():
+        while True:
+            started_at = time.monotonic()
+            try:
+                crawled_at = time.time()
+                server.update([{"centre": centre, "slot": slot} for centre, slot in
+                               client.get_available_slots_for_all_centres(
+                                   args.months, counties=args.county, localities=args.locality,
+                                   centre_ids=args.centre_id)], crawled_at)
+            except Exception:
+                logging.exception("Sweep failed, still serving the previous one")
+            time.sleep(max(0.0, args.interval - (time.monotonic() - started_at)) + random.uniform(0, args.jitter))
+
+    threading.Thread(target=refresh, name="refresh", daemon=True).start()
+    logging.info(f"Serving the available slots on {server.url}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def add_centre_filter_arguments(parser):
+    parser.add_argument("--county", action="append", help="Only include the centres from this county (ID or name)")
+    parser.add_argument("--locality", action="append",
+                        help="Only include the centres from this locality (ID or name)")
+    parser.add_argument("--centre-id", action="append", help="Only include the centre with this ID")
+
+
+def add_available_slots_arguments(parser):
+    add_centre_filter_arguments(parser)
+    parser.add_argument("--format", action="append", choices=list(AVAILABLE_SLOTS_FORMATS.keys()),
+                        help="Output format. Repeat it, together with --file, to write several outputs")
+    parser.add_argument("--months", default=2, type=int, help="Number of months to be checked")
+    parser.add_argument("--grouped", action="store_true", default=False,
+                        help="Group the CSV rows regardless of the order in which the slots are retrieved")
+    parser.add_argument("--max-groups", type=int,
+                        help="Max number of CSV rows kept in memory by --grouped before spilling them to disk")
+    parser.add_argument("--file", action="append",
+                        help="Path to the output file, compressed if it ends with .gz or .zst")
+    parser.add_argument("--upload-to-gdrive", help="Upload to Google Drive", action="store_true", default=False)
+    parser.add_argument("--gdrive-document-title", action="append",
+                        help="Google Drive document title, one for each output file")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="Number of processes crawling the centres, split by county, each with --workers threads")
+    parser.add_argument("--shard-index", type=int, default=0,
+                        help="Only crawl this shard of the centres, split by county (from 0 to --shard-count - 1)")
+    parser.add_argument("--shard-count", type=int, default=1, help="Number of shards, e.g. one per host")
+    parser.add_argument("--run-file",
+                        help="Write the slots to this run file, to be merged with the ones of the other shards by "
+                             "merge-runs, instead of writing the outputs")
+    parser.add_argument("--history", action="store_true", default=False,
+                        help="Append the slots found by every sweep to the history kept in --cache-path")
+    parser.add_argument("--request-budget", type=int,
+                        help="Only spend about this many requests per sweep, on the centres most likely to have "
+                             "changed, and reuse the last slots of the other centres")
+    parser.add_argument("--max-centre-staleness", type=int, default=3600,
+                        help="With --request-budget, max age in seconds of the slots of any centre")
+    parser.set_defaults(default_format="csv",
+                        default_gdrive_document_title="Programare vaccinare Covid - Locuri libere")
+
+
+def create_client(args):
+    cache = create_cache(args.cache_backend, args.cache_path,
+                         max_age=max_cache_age(args.cache_lifetime, args.fallback_cache_lifetime),
+                         max_size=args.cache_max_size * 1024 * 1024 if args.cache_max_size else None,
+                         compression=args.cache_compression)
+
+    snapshot = None
+    if args.incremental:
+        snapshot = AvailabilitySnapshot(os.path.join(args.cache_path, SNAPSHOT_FILE), max_staleness=args.max_staleness)
+
+    catalogue = None
+    if args.catalogue_lifetime:
+        catalogue = CentreCatalogue(os.path.join(args.cache_path, CATALOGUE_FILE), lifetime=args.catalogue_lifetime)
+
+    rate_limiter = RateLimiter(args.delay_between_requests, adaptive=args.adaptive_rate_limit,
+                               max_rate=args.max_requests_per_second)
+    circuit_breaker_failures = args.circuit_breaker_failures
+    if circuit_breaker_failures is None:
+        circuit_breaker_failures = 5 if args.fallback_cache_lifetime is not None else 0
+    circuit_breaker = CircuitBreaker(circuit_breaker_failures, args.circuit_breaker_timeout)
+
+    transport = None
+    session_token = None
+    if args.replay_traffic:
+        from .replay import ReplayTransport, load_bundle
+
+        transport = ReplayTransport(load_bundle(args.replay_traffic))
+        session_token = "replay"
+    elif args.record_traffic:
+        from .replay import RecordingTransport
+
+        transport = RecordingTransport()
+
+    client = VaccinareCovidApi(session_token=session_token,
+                               session_token_file=os.path.join(args.cache_path, "vaccinare_token"),
+                               cache_lifetime=args.cache_lifetime,
+                               fallback_cache_lifetime=args.fallback_cache_lifetime,
+                               cache_path=args.cache_path,
+                               delay_between_requests=args.delay_between_requests,
+                               max_retries=args.max_retries,
+                               delay_between_retries=args.delay_between_retries,
+                               workers=args.workers,
+                               cache=cache,
+                               snapshot=snapshot,
+                               catalogue=catalogue,
+                               rate_limiter=rate_limiter,
+                               circuit_breaker=circuit_breaker,
+                               memo_lifetime=args.memo_lifetime,
+                               transport=transport,
+                               compact_slots=args.compact_slots)
+    return client
 
 
 def main():
@@ -109,44 +439,119 @@ def main():
     parser.add_argument("--cache-lifetime", type=int, help="Cache lifetime in seconds")
     parser.add_argument("--fallback-cache-lifetime", type=int, help="Cache lifetime in seconds")
     parser.add_argument("--cache-path", default="var/cache", help="Cache path")
+    parser.add_argument("--cache-backend", default="sqlite", choices=list(CACHE_BACKENDS.keys()),
+                        help="Cache storage: a single indexed SQLite database or one file per response")
+    parser.add_argument("--cache-max-size", type=int, help="Cache size limit in megabytes")
+    parser.add_argument("--cache-compression", choices=COMPRESSIONS,
+                        help="Compress the cached responses (zstd needs the zstandard package)")
+    parser.add_argument("--incremental", action="store_true", default=False,
+                        help="Reuse the day slots of the previous runs for the days whose availability did not change")
+    parser.add_argument("--max-staleness", type=int, default=3600,
+                        help="Max age in seconds of the day slots reused in incremental mode")
+    parser.add_argument("--catalogue-lifetime", type=int, default=0,
+                        help="Select the centres to crawl from a stored list of centres, refreshed after this many "
+                             "seconds (0 = fetch the centres at every run)")
+    parser.add_argument("--memo-lifetime", type=int, default=60,
+                        help="Seconds during which identical requests are answered from memory, at most "
+                             "--cache-lifetime (0 = only merge the identical requests in flight, always the case "
+                             "without a cache)")
     parser.add_argument("--delay-between-requests", type=float, default=0.1, help="Delay between requests in seconds")
     parser.add_argument("--max-retries", type=int, default=0, help="Max number of retries in case of failures")
-    parser.add_argument("--delay-between-retries", type=float, default=1, help="Delay between retries in seconds")
+    parser.add_argument("--delay-between-retries", type=float, default=1,
+                        help="Delay before the first retry in seconds, doubled (with jitter) for every next retry")
+    parser.add_argument("--adaptive-rate-limit", action="store_true", default=False,
+                        help="Speed up while the API answers quickly and slow down when it throttles or fails, "
+                             "starting from --delay-between-requests")
+    parser.add_argument("--max-requests-per-second", type=float, default=20,
+                        help="Upper bound of the adaptive rate limit")
+    parser.add_argument("--circuit-breaker-failures", type=int,
+                        help="Pause the requests, using the fallback cache, after this many requests failed in a row "
+                             "despite their retries (0 = never; default: 5 with --fallback-cache-lifetime, else 0)")
+    parser.add_argument("--circuit-breaker-timeout", type=float, default=30,
+                        help="Seconds to wait before trying the API again once requests are paused")
+    parser.add_argument("--record-traffic", metavar="PATH",
+                        help="Save the API responses to a bundle that can be replayed with --replay-traffic")
+    parser.add_argument("--replay-traffic", metavar="PATH",
+                        help="Serve the API responses from a bundle saved by --record-traffic, without network access")
+    parser.add_argument("--compact-slots", action="store_true", default=False,
+                        help="Keep only the centre ID, start and end times and available places of every slot, which "
+                             "uses less memory; the JSON outputs then only contain these fields")
+    parser.add_argument("--metrics-file", help="Write the request, cache and latency metrics of the run to a JSON file")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of centres crawled concurrently, sharing --delay-between-requests")
     subparsers = parser.add_subparsers()
 
     gc_parser = subparsers.add_parser("get-counties")
     gc_parser.set_defaults(func=get_counties)
 
     get_centres_parser = subparsers.add_parser("get-centres")
-    get_centres_parser.add_argument("--format", default="csv", choices=["csv", "json"], help="Output format")
-    get_centres_parser.add_argument("--file", help="Path to the output file")
+    add_centre_filter_arguments(get_centres_parser)
+    get_centres_parser.add_argument("--format", action="append", choices=list(CENTRES_FORMATS.keys()),
+                                    help="Output format. Repeat it, together with --file, to write several outputs")
+    get_centres_parser.add_argument("--file", action="append",
+                                    help="Path to the output file, compressed if it ends with .gz or .zst")
     get_centres_parser.add_argument("--upload-to-gdrive", help="Upload to Google Drive", action="store_true", default=False)
-    get_centres_parser.add_argument("--gdrive-document-title", default="Programare vaccinare Covid - Centre")
-    get_centres_parser.set_defaults(func=get_centres)
+    get_centres_parser.add_argument("--gdrive-document-title", action="append",
+                                    help="Google Drive document title, one for each output file")
+    get_centres_parser.set_defaults(func=get_centres, default_format="csv", grouped=False, max_groups=None,
+                                    default_gdrive_document_title="Programare vaccinare Covid - Centre")
 
     gas_parser = subparsers.add_parser("get-available-slots")
-    gas_parser.add_argument("--format", default="csv", choices=["csv", "csv_by_centre", "csv_by_date", "json"],
-                            help="Output format")
-    gas_parser.add_argument("--months", default=2, type=int, help="Number of months to be checked")
-    gas_parser.add_argument("--file", help="Path to the output file")
-    gas_parser.add_argument("--upload-to-gdrive", help="Upload to Google Drive", action="store_true", default=False)
-    gas_parser.add_argument("--gdrive-document-title", default="Programare vaccinare Covid - Locuri libere")
-    gas_parser.set_defaults(func=get_available_slots)
+    add_available_slots_arguments(gas_parser)
+    gas_parser.set_defaults(func=get_available_slots, interval=0)
+
+    watch_parser = subparsers.add_parser("watch", help="Run get-available-slots periodically")
+    add_available_slots_arguments(watch_parser)
+    watch_parser.add_argument("--interval", type=float, default=1800, help="Seconds between the start of two sweeps")
+    watch_parser.add_argument("--jitter", type=float, default=60,
+                              help="Max random delay in seconds added to --interval")
+    watch_parser.add_argument("--iterations", type=int, default=0, help="Stop after this many sweeps (0 = never)")
+    watch_parser.set_defaults(func=watch)
+
+    merge_parser = subparsers.add_parser("merge-runs", help="Merge the run files of several shards into the outputs")
+    merge_parser.add_argument("runs", nargs="+", help="Run files written by get-available-slots --run-file")
+    add_available_slots_arguments(merge_parser)
+    merge_parser.set_defaults(func=merge_run_files, interval=0)
+
+    serve_parser = subparsers.add_parser("serve-api",
+                                         help="Serve the available slots over HTTP, refreshed periodically")
+    add_centre_filter_arguments(serve_parser)
+    serve_parser.add_argument("--months", default=2, type=int, help="Number of months to be checked")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    serve_parser.add_argument("--port", type=int, default=8080, help="Port to listen on")
+    serve_parser.add_argument("--interval", type=float, default=1800, help="Seconds between the start of two sweeps")
+    serve_parser.add_argument("--jitter", type=float, default=60,
+                              help="Max random delay in seconds added to --interval")
+    serve_parser.set_defaults(func=serve_api)
+
+    history_parser = subparsers.add_parser("history", help="Query the slots recorded by --history")
+    history_parser.add_argument("query", choices=["crawls", "appeared", "counties", "diff", "centre"],
+                                help="crawls: the recorded sweeps; appeared: the slots that appeared since --since; "
+                                     "counties: the availability per county since --since; diff: the slots that "
+                                     "appeared or are gone in a sweep; centre: the availability of a centre")
+    history_parser.add_argument("--since", type=int, default=3600, help="Number of seconds to look back")
+    history_parser.add_argument("--limit", type=int, help="Max number of sweeps listed by the crawls query")
+    history_parser.add_argument("--crawl-id", type=int, help="Sweep compared by the diff query (default: the last one)")
+    history_parser.add_argument("--centre-id", type=int, help="Centre of the centre query")
+    history_parser.add_argument("--day", help="Only count the slots of this day (YYYY-MM-DD) in the centre query")
+    history_parser.set_defaults(func=history)
 
     args = parser.parse_args()
 
-    client = VaccinareCovidApi(session_token_file=os.path.join(args.cache_path, "vaccinare_token"),
-                               cache_lifetime=args.cache_lifetime,
-                               fallback_cache_lifetime=args.fallback_cache_lifetime,
-                               cache_path=args.cache_path,
-                               delay_between_requests=args.delay_between_requests,
-                               max_retries=args.max_retries,
-                               delay_between_retries=args.delay_between_retries)
+    client = create_client(args)
 
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
 
-    args.func(client, args)
+    try:
+        args.func(client, args)
+    finally:
+        if args.record_traffic and not args.replay_traffic:
+            client.http.transport.save(args.record_traffic)
+        if client.metrics.requests or client.metrics.cache:
+            logging.info(f"Crawl metrics:\n{client.metrics.format_summary()}")
+        if args.metrics_file:
+            client.metrics.write(args.metrics_file)
 
 
 if __name__ == "__main__":
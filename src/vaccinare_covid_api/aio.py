@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+import asyncio
+import json
+import logging
+import time
+
+import aiohttp
+
+from collections import deque
+
+from .catalogue import centre_matches
+from .client import (API_URL, CIRCUIT_OPEN_ERROR, COUNTIES_ENDPOINT, DAY_SLOTS_ENDPOINT, MONTHLY_AVAILABILITY_ENDPOINT,
+                     HttpSession, _centres_request, _day_slots_request, _month_available_places_requests, _parse_slot,
+                     _with_freshness)
+from .ratelimit import is_failure
+
+
+class AsyncHttpSession(HttpSession):
+    """
+    asyncio counterpart of `HttpSession`. All the requests go through a single aiohttp connection pool, so connections
+    are kept alive and reused instead of being opened for every request.
+    """
+
+    def __init__(self, session_token=None, session_token_file=None, cache_lifetime=None, fallback_cache_lifetime=None,
+                 cache_path=None, delay_between_requests=None, max_retries=0, delay_between_retries=None,
+                 api_url=API_URL, cache=None, metrics=None, connections_per_host=10, rate_limiter=None,
+                 circuit_breaker=None, memo_lifetime=60):
+        super().__init__(session_token=session_token,
+                         session_token_file=session_token_file,
+                         cache_lifetime=cache_lifetime,
+                         fallback_cache_lifetime=fallback_cache_lifetime,
+                         cache_path=cache_path,
+                         delay_between_requests=delay_between_requests,
+                         max_retries=max_retries,
+                         delay_between_retries=delay_between_retries,
+                         api_url=api_url,
+                         cache=cache,
+                         metrics=metrics,
+                         rate_limiter=rate_limiter,
+                         circuit_breaker=circuit_breaker,
+                         memo_lifetime=memo_lifetime)
+        self.connections_per_host = connections_per_host
+        self._client_session = None
+
+    def _get_client_session(self):
+        if self._client_session is None or self._client_session.closed:
+            connector = aiohttp.TCPConnector(limit_per_host=self.connections_per_host)
+            self._client_session = aiohttp.ClientSession(connector=connector, headers=self.headers)
+        return self._client_session
+
+    async def close(self):
+        if self._client_session is not None:
+            await self._client_session.close()
+            self._client_session = None
+
+    async def request(self, method, path, data=None):
+        return (await self.fetch(method, path, data))[0]
+
+    async def fetch(self, method, path, data=None):
+        """
+        :return: the response and False if it came from the fallback cache because the request failed
+        """
+        logging.debug(f"{method} {path} {data}")
+
+        async def load():
+            return _with_freshness(await self._request(method, path, data))
+
+        (response_data, fresh), loaded = await self.memo.get_or_load_async(self._get_cache_key(method, path, data),
+                                                                           load)
+        if not loaded:
+            self.metrics.record_cache(path, "memo")
+        return response_data, fresh
+
+    async def _request(self, method, path, data):
+        response_data = self._get_cached_response(method, path, data)
+        if response_data is not None:
+            return response_data, True
+
+        # The breaker is only checked before the first attempt, so that it never cuts the retries of a request short
+        if not self.circuit_breaker.allow():
+            return self._get_fallback(method, path, data, 0, CIRCUIT_OPEN_ERROR), False
+
+        retry_attempt = 0
+        while retry_attempt <= self.max_retries:
+            retry_attempt += 1
+            self.metrics.record_sleep("rate_limit", await self.rate_limiter.wait_async())
+            started_at = time.monotonic()
+            try:
+                async with self._get_client_session().request(
+                        method,
+                        self.api_url + path,
+                        data=json.dumps(data) if data else None,
+                        cookies={"SESSION": self._get_session_token()},
+                        allow_redirects=False) as response:
+                    content = await response.read()
+                    response_body = content.decode(response.get_encoding())
+            except Exception:
+                self.circuit_breaker.record_failure()
+                raise
+            self._record_response(path, time.monotonic() - started_at, response.status, len(content))
+
+            self._check_login_redirect(response.headers.get("location"))
+
+            try:
+                return self._parse_response(method, path, data, response.status, response_body,
+                                            response.headers), True
+            except Exception as e:
+                if retry_attempt <= self.max_retries:
+                    self.metrics.record_retry(path)
+                    retry_delay = self._get_retry_delay(retry_attempt, response.headers)
+                    if retry_delay:
+                        await asyncio.sleep(retry_delay)
+                        self.metrics.record_sleep("retry", retry_delay)
+                else:
+                    if is_failure(response.status):
+                        self.circuit_breaker.record_failure()
+                    return self._get_fallback(method, path, data, retry_attempt, e), False
+
+    async def get(self, path):
+        return await self.request("GET", path)
+
+    async def post(self, path, data=None):
+        return await self.request("POST", path, data)
+
+
+class AsyncVaccinareCovidApi:
+    def __init__(self, session_token=None, session_token_file=None, cache_lifetime=None, fallback_cache_lifetime=None,
+                 cache_path=None, delay_between_requests=None, max_retries=0, delay_between_retries=None, workers=10,
+                 api_url=API_URL, cache=None, snapshot=None, metrics=None, connections_per_host=10, rate_limiter=None,
+                 circuit_breaker=None, memo_lifetime=60, compact_slots=False):
+        self.workers = workers
+        self.snapshot = snapshot
+        self.compact_slots = compact_slots
+        self.http = AsyncHttpSession(session_token=session_token,
+                                     session_token_file=session_token_file,
+                                     cache_lifetime=cache_lifetime,
+                                     fallback_cache_lifetime=fallback_cache_lifetime,
+                                     cache_path=cache_path,
+                                     delay_between_requests=delay_between_requests,
+                                     max_retries=max_retries,
+                                     delay_between_retries=delay_between_retries,
+                                     api_url=api_url,
+                                     cache=cache,
+                                     metrics=metrics,
+                                     connections_per_host=connections_per_host,
+                                     rate_limiter=rate_limiter,
+                                     circuit_breaker=circuit_breaker,
+                                     memo_lifetime=memo_lifetime)
+
+    @property
+    def metrics(self):
+        return self.http.metrics
+
+    def add_metrics_hook(self, hook):
+        self.metrics.add_hook(hook)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        await self.http.close()
+
+    async def get_counties(self):
+        return await self.http.get(COUNTIES_ENDPOINT)
+
+    async def get_centres(self, county_id=None, page=0, page_size=1000, recursive=True):
+        while True:
+            centres = await self.http.post(*_centres_request(county_id, page, page_size))
+
+            for centre in centres["content"]:
+                yield centre
+
+            if not recursive or centres["last"]:
+                break
+
+            page += 1
+
+    async def get_day_slots(self, centre_id, current_date):
+        return await self.http.post(DAY_SLOTS_ENDPOINT, _day_slots_request(centre_id, current_date))
+
+    async def _fetch_day_slots(self, centre_id, current_date):
+        return await self.http.fetch("POST", DAY_SLOTS_ENDPOINT, _day_slots_request(centre_id, current_date))
+
+    async def _get_available_day_slots(self, centre_id, day):
+        if self.snapshot is None:
+            return await self.get_day_slots(centre_id, day["startTime"])
+
+        slots = self.snapshot.get_day_slots(centre_id, day["startTime"], day["availablePlaces"])
+        if slots is None:
+            slots, fresh = await self._fetch_day_slots(centre_id, day["startTime"])
+            # Slots served by the fallback cache are older than they would be recorded as
+            if fresh:
+                self.snapshot.put_day_slots(centre_id, day["startTime"], day["availablePlaces"], slots)
+        return slots
+
+    async def get_available_slots(self, centre_id, months_to_check):
+        for month_request in _month_available_places_requests(centre_id, months_to_check):
+            days_available = await self.http.post(MONTHLY_AVAILABILITY_ENDPOINT, data=month_request)
+            for day in days_available:
+                if day["availablePlaces"] > 0:
+                    for slot in await self._get_available_day_slots(centre_id, day):
+                        if slot["availablePlaces"] > 0:
+                            yield _parse_slot(slot, centre_id, self.compact_slots)
+
+    async def find_centres(self, counties=None, localities=None, centre_ids=None):
+        county_id = None
+        if counties and len(counties) == 1 and str(counties[0]).isdigit():
+            county_id = int(counties[0])
+        async for centre in self.get_centres(county_id=county_id):
+            if centre_matches(centre, counties, localities, centre_ids):
+                yield centre
+
+    async def get_available_slots_for_all_centres(self, months_to_check, counties=None, localities=None,
+                                                  centre_ids=None):
+        # Same ordering guarantees as `VaccinareCovidApi.get_available_slots_for_all_centres`: up to `workers` centres
+        # are crawled at once, but the results are yielded in the order `get_centres` returns them
+        pending = deque()
+        try:
+            async for centre in self.find_centres(counties, localities, centre_ids):
+                pending.append((centre, asyncio.ensure_future(self._list_available_slots(centre["id"],
+                                                                                         months_to_check))))
+                if len(pending) > self.workers:
+                    centre, task = pending.popleft()
+                    for slot in await task:
+                        yield centre, slot
+
+            while pending:
+                centre, task = pending.popleft()
+                for slot in await task:
+                    yield centre, slot
+        finally:
+            for _centre, task in pending:
+                task.cancel()
+
+    async def _list_available_slots(self, centre_id, months_to_check):
+        return [slot async for slot in self.get_available_slots(centre_id, months_to_check)]
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Response cache backends used by `HttpSession`.
+
+A backend stores raw response bodies by cache key and implements:
+- get(key, lifetime): the body stored under `key` if it is at most `lifetime` seconds old, otherwise None
+- put(key, body): stores `body` under `key`, replacing the previous value
+- evict(): removes the entries older than `max_age` seconds and, if needed, the oldest entries until the cache
+  takes at most `max_size` bytes
+
+With a `compression`, bodies are stored compressed and `max_size` counts the compressed size. Compressed entries are
+recognized when read, so a cache can be switched to or from compression without being cleared.
+"""
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+
+from contextlib import contextmanager
+
+from .compression import compress, decompress
+
+SQLITE_CACHE_FILE = "responses.sqlite"
+
+
+def _encode_body(body, compression):
+    return compress(body.encode(), compression) if compression else body
+
+
+def _decode_body(stored):
+    if isinstance(stored, str):
+        return stored
+    return decompress(stored).decode()
+
+
+class SqliteStore:
+    """
+    Base class for the stores kept in a single SQLite database. Every thread gets its own connection; the database runs
+    in WAL mode, so several processes can read it while another one writes.
+    """
+    schema = ()
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            for statement in self.schema:
+                connection.execute(statement)
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        """
+        Runs the statements of the block in a single transaction, rolled back if the block raises
+        :param immediate: take the write lock at the start, rather than on the first write
+        :return: the connection of the current thread
+        """
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        try:
+            yield connection
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+class SqliteCache(SqliteStore):
+    """
+    Keeps all the responses in a single SQLite database, indexed by cache key and by the time they were stored. Every
+    write is a single transaction, so readers never see partially written entries.
+    """
+    evict_every = 100
+    schema = (
+        "CREATE TABLE IF NOT EXISTS responses ("
+        "key TEXT PRIMARY KEY, stored_at REAL NOT NULL, size INTEGER NOT NULL, body TEXT NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS responses_stored_at ON responses (stored_at)",
+    )
+
+    def __init__(self, path, max_age=None, max_size=None, compression=None):
+        super().__init__(path)
+        self.max_age = max_age
+        self.max_size = max_size
+        self.compression = compression
+        self._lock = threading.Lock()
+        self._puts = 0
+
+    def get(self, key, lifetime):
+        row = self._connection().execute("SELECT body FROM responses WHERE key = ? AND stored_at >= ?",
+                                         (key, time.time() - lifetime)).fetchone()
+        return _decode_body(row[0]) if row else None
+
+    def put(self, key, body):
+        # Compressed bodies are stored as BLOBs in the TEXT column, which SQLite keeps as they are
+        body = _encode_body(body, self.compression)
+        self._connection().execute("INSERT OR REPLACE INTO responses (key, stored_at, size, body) VALUES (?, ?, ?, ?)",
+                                   (key, time.time(), len(body), body))
+        with self._lock:
+            self._puts += 1
+            evict = self._puts % self.evict_every == 1
+        if evict:
+            self.evict()
+
+    def evict(self):
+        if self.max_age is None and self.max_size is None:
+            return
+        with self.transaction(immediate=True) as connection:
+            if self.max_age is not None:
+                connection.execute("DELETE FROM responses WHERE stored_at < ?", (time.time() - self.max_age,))
+            if self.max_size is not None:
+                size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                evicted = []
+                for key, entry_size in connection.execute("SELECT key, size FROM responses ORDER BY stored_at"):
+                    if size <= self.max_size:
+                        break
+                    size -= entry_size
+                    evicted.append((key,))
+                connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+
+class FileCache:
+    """
+    Stores every response in a separate file named after its cache key. Files are written to a temporary file first
+    and then renamed, so readers never see partially written entries.
+    """
+    evict_every = 100
+    _cache_file_pattern = re.compile("^[0-9a-f]{32}$")
+
+    def __init__(self, path, max_age=None, max_size=None, compression=None):
+        self.path = path
+        self.max_age = max_age
+        self.max_size = max_size
+        self.compression = compression
+        self._lock = threading.Lock()
+        self._puts = 0
+
+    def get(self, key, lifetime):
+        cache_file = os.path.join(self.path, key)
+        try:
+            if time.time() - os.path.getmtime(cache_file) <= lifetime:
+                with open(cache_file, "rb") as f:
+                    return _decode_body(f.read())
+        except FileNotFoundError:
+            pass
+
+    def put(self, key, body):
+        os.makedirs(self.path, exist_ok=True)
+        fd, temp_file = tempfile.mkstemp(dir=self.path, prefix=".tmp-")
+        body = _encode_body(body, self.compression)
+        with os.fdopen(fd, "wb") as f:
+            f.write(body.encode() if isinstance(body, str) else body)
+        os.replace(temp_file, os.path.join(self.path, key))
+        with self._lock:
+            self._puts += 1
+            evict = self._puts % self.evict_every == 1
+        if evict:
+            self.evict()
+
+    def evict(self):
+        if self.max_age is None and self.max_size is None:
+            return
+        entries = []
+        for entry in os.scandir(self.path):
+            if self._cache_file_pattern.match(entry.name):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        entries.sort()
+        size = sum(entry_size for _mtime, entry_size, _path in entries)
+        for mtime, entry_size, path in entries:
+            expired = self.max_age is not None and time.time() - mtime > self.max_age
+            if not expired and (self.max_size is None or size <= self.max_size):
+                break
+            size -= entry_size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        pass
+
+
+CACHE_BACKENDS = {
+    "sqlite": lambda cache_path, **kwargs: SqliteCache(os.path.join(cache_path, SQLITE_CACHE_FILE), **kwargs),
+    "files": FileCache,
+}
+
+
+def max_cache_age(*lifetimes):
+    """
+    Entries are useless once they are older than the longest lifetime they are read with
+    """
+    return max((lifetime for lifetime in lifetimes if lifetime is not None), default=None)
+
+
+def create_cache(backend, cache_path, max_age=None, max_size=None, compression=None):
+    if backend not in CACHE_BACKENDS:
+        raise Exception(f"Invalid cache backend: {backend}")
+    return CACHE_BACKENDS[backend](cache_path, max_age=max_age, max_size=max_size, compression=compression)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+import json
+import os
+import tempfile
+import time
+
+from collections import defaultdict
+
+CATALOGUE_FILE = "centres.json"
+
+
+def _normalize(value):
+    return str(value).strip().lower()
+
+
+def centre_matches(centre, counties=None, localities=None, centre_ids=None):
+    """
+    Checks a centre against the filters. Counties and localities can be given either by ID or by name (case
+    insensitive); an empty filter matches every centre.
+    """
+    if counties and not ({_normalize(centre.get("countyID")), _normalize(centre.get("countyName"))} &
+                         {_normalize(county) for county in counties}):
+        return False
+    if localities and not ({_normalize(centre.get("localityID")), _normalize(centre.get("localityName"))} &
+                           {_normalize(locality) for locality in localities}):
+        return False
+    if centre_ids and _normalize(centre.get("id")) not in {_normalize(centre_id) for centre_id in centre_ids}:
+        return False
+    return True
+
+
+class CentreCatalogue:
+    """
+    Snapshot of the list of centres, stored in `path` and refreshed from the API once it is older than `lifetime`
+    seconds. Centres are kept in the order returned by the API and indexed by ID, county and locality.
+    """
+
+    def __init__(self, path, lifetime=86400):
+        self.path = path
+        self.lifetime = lifetime
+        self.centres = None
+        self.fetched_at = None
+        self.by_id = {}
+        self.by_county = {}
+        self.by_locality = {}
+
+    def is_fresh(self):
+        return self.fetched_at is not None and time.time() - self.fetched_at <= self.lifetime
+
+    def load(self, fetch_centres):
+        """
+        Loads the snapshot from disk, or from `fetch_centres()` if it is missing or expired
+        """
+        if self.is_fresh():
+            return self
+
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                snapshot = json.load(f)
+            if time.time() - snapshot["fetched_at"] <= self.lifetime:
+                self._set_centres(snapshot["centres"], snapshot["fetched_at"])
+                return self
+
+        self._set_centres(list(fetch_centres()), time.time())
+        self._save()
+        return self
+
+    def _save(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", prefix=".tmp-")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"fetched_at": self.fetched_at, "centres": self.centres}, f)
+        os.replace(temp_path, self.path)
+
+    def _set_centres(self, centres, fetched_at):
+        self.centres = centres
+        self.fetched_at = fetched_at
+        by_county = defaultdict(list)
+        by_locality = defaultdict(list)
+        self.by_id = {}
+        for position, centre in enumerate(centres):
+            self.by_id[_normalize(centre["id"])] = position
+            for key in {_normalize(centre.get("countyID")), _normalize(centre.get("countyName"))}:
+                by_county[key].append(position)
+            for key in {_normalize(centre.get("localityID")), _normalize(centre.get("localityName"))}:
+                by_locality[key].append(position)
+        self.by_county = dict(by_county)
+        self.by_locality = dict(by_locality)
+
+    def find(self, counties=None, localities=None, centre_ids=None):
+        """
+        :return: the centres matching the filters (see `centre_matches`), in catalogue order
+        """
+        candidates = None
+        for values, index in ((centre_ids, self.by_id), (counties, self.by_county), (localities, self.by_locality)):
+            if not values:
+                continue
+            positions = set()
+            for value in values:
+                found = index.get(_normalize(value))
+                if isinstance(found, int):
+                    positions.add(found)
+                elif found:
+                    positions.update(found)
+            candidates = positions if candidates is None else candidates & positions
+
+        if candidates is None:
+            return list(self.centres)
+        return [self.centres[position] for position in sorted(candidates)]
@@ -2,12 +2,17 @@
 import hashlib
 import json
 import os
-import requests
 import time
 import logging
 
+from collections import deque
 from datetime import datetime
-from dateutil.relativedelta import relativedelta
+
+from .cache import create_cache, max_cache_age
+from .catalogue import centre_matches
+from .memo import RequestMemo
+from .metrics import CrawlMetrics
+from .ratelimit import CircuitBreaker, RateLimiter, backoff_delay, is_failure, retry_after
 
 API_URL = "https://programare.vaccinare-covid.gov.ro"
 WEB_LOGIN_URL = "https://programare.vaccinare-covid.gov.ro/login"
@@ -16,24 +21,63 @@ MONTHLY_AVAILABILITY_ENDPOINT = "/scheduling/api/time_slots/month_available_plac
 DAY_SLOTS_ENDPOINT = "/scheduling/api/time_slots/day_slots"
 COUNTIES_ENDPOINT = "/nomenclatures/api/county"
 DATE_FORMAT = "%d-%m-%Y %H:%M:%S.%f"
+CIRCUIT_OPEN_ERROR = Exception("Requests are paused because the API keeps failing")
 
 
 class HttpSession:
     def __init__(self, session_token=None, session_token_file=None, cache_lifetime=None, fallback_cache_lifetime=None,
-                 cache_path=None, delay_between_requests=None, max_retries=0, delay_between_retries=None):
+                 cache_path=None, delay_between_requests=None, max_retries=0, delay_between_retries=None,
+                 api_url=API_URL, cache=None, metrics=None, pool_size=10, max_delay_between_retries=60,
+                 rate_limiter=None, circuit_breaker=None, memo_lifetime=60, memo_size=1024, transport=None):
         self.session_token = session_token
         self.session_token_file = session_token_file
         self.cache_lifetime = cache_lifetime
         self.fallback_cache_lifetime = fallback_cache_lifetime
         self.cache_path = cache_path
+        if cache is None and cache_path:
+            cache = create_cache("sqlite", cache_path, max_age=max_cache_age(cache_lifetime, fallback_cache_lifetime))
+        self.cache = cache
         self.delay_between_requests = delay_between_requests
         self.max_retries = max_retries
         self.delay_between_retries = delay_between_retries
-        self.last_request_at = None
+        self.max_delay_between_retries = max_delay_between_retries
+        # The limiter and the circuit breaker can be shared by several sessions, including async ones
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter(delay_between_requests)
+        if circuit_breaker is None:
+            # Pausing the requests is only useful when there is a fallback cache to answer from in the meantime
+            circuit_breaker = CircuitBreaker(5 if fallback_cache_lifetime is not None else 0)
+        self.circuit_breaker = circuit_breaker
+        if cache_lifetime is None:
+            # Without a cache every sweep must see fresh responses, so only the identical requests in flight are merged
+            memo_lifetime = 0
+        elif memo_lifetime is not None:
+            # Responses are not kept in memory for longer than in the cache
+            memo_lifetime = min(memo_lifetime, cache_lifetime)
+        self.memo = RequestMemo(max_entries=memo_size, lifetime=memo_lifetime)
+        self.api_url = api_url
+        self.metrics = metrics if metrics is not None else CrawlMetrics()
+        self.pool_size = pool_size
+        # Anything with the `request` method of `requests.Session`, e.g. a `replay.ReplayTransport`
+        self.transport = transport
+        self._session = transport
         self.headers = {"accept": "application/json",
                         "content-type": "application/json",
                         "user-agent": "https://github.com/nmrazvan/vaccinare-covid-api"}
 
+    def _get_session(self):
+        """
+        Gets the requests session, which keeps the connections to the API alive between requests
+        """
+        if self._session is None:
+            # requests is imported on first use, so that commands served from the cache start faster
+            import requests
+
+            session = requests.Session()
+            session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=self.pool_size))
+            session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=self.pool_size))
+            self._session = session
+        return self._session
+
     def _get_session_token(self):
         """
         Gets the session token. This needs to be provided via env vars or file, since it cannot be retrieved based on
@@ -59,75 +103,124 @@ class HttpSession:
                         "4. Run: export VACCINARE_TOKEN=VALUE_OF_THE_SESSION_COOKIE\n"
                         "5. Execute this script again")
 
-    def _get_cache_file(self, method, path, data):
-        cache_key = hashlib.md5(json.dumps([method, path, data]).encode()).hexdigest()
-        return os.path.join(self.cache_path, cache_key)
+    @staticmethod
+    def _get_cache_key(method, path, data):
+        return hashlib.md5(json.dumps([method, path, data]).encode()).hexdigest()
 
     def _get_cache(self, method, path, data, lifetime):
-        if not self.cache_path or lifetime is None:
+        if not self.cache or lifetime is None:
             return
-        cache_file = self._get_cache_file(method, path, data)
-        if os.path.exists(cache_file):
-            file_age = datetime.now().timestamp() - os.path.getmtime(cache_file)
-            if file_age <= lifetime:
-                with open(cache_file) as f:
-                    return f.read()
+        return self.cache.get(self._get_cache_key(method, path, data), lifetime)
 
     def _put_cache(self, method, path, data, response_body):
-        if not self.cache_path or not (self.cache_lifetime or self.fallback_cache_lifetime):
+        if not self.cache or not (self.cache_lifetime or self.fallback_cache_lifetime):
             return
-        cache_file = self._get_cache_file(method, path, data)
-        if not os.path.exists(os.path.dirname(cache_file)):
-            os.mkdir(os.path.dirname(cache_file))
-        with open(cache_file, "w") as f:
-            f.write(response_body)
-
-    def request(self, method, path, data=None):
-        logging.debug(f"{method} {path} {data}")
+        self.cache.put(self._get_cache_key(method, path, data), response_body)
 
+    def _get_cached_response(self, method, path, data):
+        if not self.cache or self.cache_lifetime is None:
+            return
         response_body = self._get_cache(method, path, data, self.cache_lifetime)
+        self.metrics.record_cache(path, "hit" if response_body else "miss")
         if response_body:
             logging.debug(f"Request is cached")
             return json.loads(response_body)
 
-        if self.delay_between_requests and self.last_request_at:
-            time_since_last_request = datetime.now() - self.last_request_at
-            wait_time = self.delay_between_requests - time_since_last_request.total_seconds()
-            if wait_time > 0:
-                time.sleep(wait_time)
+    def request(self, method, path, data=None):
+        return self.fetch(method, path, data)[0]
+
+    def fetch(self, method, path, data=None):
+        """
+        :return: the response and False if it came from the fallback cache because the request failed
+        """
+        logging.debug(f"{method} {path} {data}")
+
+        (response_data, fresh), loaded = self.memo.get_or_load(
+            self._get_cache_key(method, path, data), lambda: _with_freshness(self._request(method, path, data)))
+        if not loaded:
+            self.metrics.record_cache(path, "memo")
+        return response_data, fresh
+
+    def _request(self, method, path, data):
+        """
+        :return: the response and False if it is the fallback, which is not memoized
+        """
+        response_data = self._get_cached_response(method, path, data)
+        if response_data is not None:
+            return response_data, True
+
+        # The breaker is only checked before the first attempt, so that it never cuts the retries of a request short
+        if not self.circuit_breaker.allow():
+            return self._get_fallback(method, path, data, 0, CIRCUIT_OPEN_ERROR), False
 
         retry_attempt = 0
         while retry_attempt <= self.max_retries:
             retry_attempt += 1
-            response = requests.request(
-                method,
-                API_URL + path,
-                data=json.dumps(data) if data else None,
-                headers=self.headers,
-                cookies={"SESSION": self._get_session_token()},
-                allow_redirects=False)
-            self.last_request_at = datetime.now()
-
-            if response.headers.get("location") == WEB_LOGIN_URL:
-                raise Exception("You need to retrieve the session token again")
-
+            self.metrics.record_sleep("rate_limit", self.rate_limiter.wait())
+            started_at = time.monotonic()
             try:
-                if response.status_code != 200:
-                    raise Exception("Invalid response status code", response.status_code, response.text,
-                                    response.headers)
+                response = self._get_session().request(
+                    method,
+                    self.api_url + path,
+                    data=json.dumps(data) if data else None,
+                    headers=self.headers,
+                    cookies={"SESSION": self._get_session_token()},
+                    allow_redirects=False)
+            except Exception:
+                self.circuit_breaker.record_failure()
+                raise
+            self._record_response(path, time.monotonic() - started_at, response.status_code, len(response.content))
 
-                response_data = json.loads(response.text)
-                self._put_cache(method, path, data, response.text)
-                return response_data
+            self._check_login_redirect(response.headers.get("location"))
+
+            try:
+                return self._parse_response(method, path, data, response.status_code, response.text,
+                                            response.headers), True
             except Exception as e:
                 if retry_attempt <= self.max_retries:
-                    if self.delay_between_retries:
-                        time.sleep(self.delay_between_retries)
+                    self.metrics.record_retry(path)
+                    retry_delay = self._get_retry_delay(retry_attempt, response.headers)
+                    if retry_delay:
+                        time.sleep(retry_delay)
+                        self.metrics.record_sleep("retry", retry_delay)
                 else:
-                    response_body = self._get_cache(method, path, data, self.fallback_cache_lifetime)
-                    if response_body is None:
-                        raise Exception(f"{method} {path} {data} failed after {retry_attempt} retries", e)
-                    return json.loads(response_body)
+                    if is_failure(response.status_code):
+                        self.circuit_breaker.record_failure()
+                    return self._get_fallback(method, path, data, retry_attempt, e), False
+
+    def _record_response(self, path, latency, status_code, size):
+        self.metrics.record_request(path, latency, status_code, size)
+        self.rate_limiter.record_response(latency, status_code)
+        # Failures are only counted once a request gave up retrying, see `_request`
+        if not is_failure(status_code):
+            self.circuit_breaker.record_success()
+
+    def _get_retry_delay(self, retry_attempt, response_headers):
+        """
+        :return: the exponential backoff delay, or longer if the API asked for it with a Retry-After header
+        """
+        return max(backoff_delay(retry_attempt, self.delay_between_retries, self.max_delay_between_retries),
+                   retry_after(response_headers, self.max_delay_between_retries))
+
+    @staticmethod
+    def _check_login_redirect(location):
+        if location == WEB_LOGIN_URL:
+            raise Exception("You need to retrieve the session token again")
+
+    def _parse_response(self, method, path, data, status_code, response_body, response_headers):
+        if status_code != 200:
+            raise Exception("Invalid response status code", status_code, response_body, response_headers)
+
+        response_data = json.loads(response_body)
+        self._put_cache(method, path, data, response_body)
+        return response_data
+
+    def _get_fallback(self, method, path, data, retry_attempt, error):
+        response_body = self._get_cache(method, path, data, self.fallback_cache_lifetime)
+        if response_body is None:
+            raise Exception(f"{method} {path} {data} failed after {retry_attempt} retries", error)
+        self.metrics.record_cache(path, "fallback")
+        return json.loads(response_body)
 
     def get(self, path):
         return self.request("GET", path)
@@ -136,9 +229,116 @@ class HttpSession:
         return self.request("POST", path, data)
 
 
+def _with_freshness(result):
+    """
+    Keeps whether a response is fresh along with it, so that the requests waiting for it in flight know it too
+    """
+    response_data, fresh = result
+    return (response_data, fresh), fresh
+
+
+def _centres_request(county_id, page, page_size):
+    return (f"{CENTRES_ENDPOINT}?page={page}&size={page_size}&sort=countyName,localityName,name",
+            {"countyID": county_id, "localityID": None, "name": None})
+
+
+def _month_available_places_requests(centre_id, months_to_check):
+    from dateutil.relativedelta import relativedelta
+
+    # Use a constant value for the time so that the request can be cached
+    now = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    for month in range(0, months_to_check):
+        current_date = now + relativedelta(months=month)
+        yield {"centerID": centre_id,
+               "currentDate": current_date.strftime(DATE_FORMAT),
+               "forBooster": False}
+
+
+def _day_slots_request(centre_id, current_date):
+    return {"centerID": centre_id,
+            "currentDate": current_date,
+            "forBooster": False}
+
+
+_parsed_dates = {}
+
+
+def _parse_date_fields(value):
+    # Fixed positions of DATE_FORMAT: DD-MM-YYYY HH:MM:SS.ffffff, with 1 to 6 digits of fraction
+    if (len(value) < 21 or len(value) > 26 or value[2] != "-" or value[5] != "-" or value[10] != " "
+            or value[13] != ":" or value[16] != ":" or value[19] != "." or not value[20:].isdigit()):
+        return datetime.strptime(value, DATE_FORMAT)
+    try:
+        return datetime(int(value[6:10]), int(value[3:5]), int(value[0:2]), int(value[11:13]), int(value[14:16]),
+                        int(value[17:19]), int(value[20:].ljust(6, "0")))
+    except ValueError:
+        return datetime.strptime(value, DATE_FORMAT)
+
+
+def parse_date(value):
+    """
+    Parses a date in DATE_FORMAT, like `datetime.strptime(value, DATE_FORMAT)` but several times faster. Slots share a
+    small number of distinct dates and times, so the parsed values are cached
+    """
+    parsed = _parsed_dates.get(value)
+    if parsed is None:
+        if len(_parsed_dates) >= 100000:
+            _parsed_dates.clear()
+        parsed = _parsed_dates[value] = _parse_date_fields(value)
+    return parsed
+
+
+class Slot:
+    """
+    Compact available slot, holding only the fields written to the outputs. The fields can also be read as
+    `slot["startTime"]`, like the fields of the slots returned by the API.
+    """
+    __slots__ = ("centreID", "startTime", "endTime", "availablePlaces")
+
+    def __init__(self, centreID, startTime, endTime, availablePlaces):
+        self.centreID = centreID
+        self.startTime = startTime
+        self.endTime = endTime
+        self.availablePlaces = availablePlaces
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def _asdict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __eq__(self, other):
+        if not isinstance(other, Slot):
+            return NotImplemented
+        return self._asdict() == other._asdict()
+
+    def __repr__(self):
+        return f"Slot({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)})"
+
+
+def _parse_slot(slot, centre_id=None, compact=False):
+    if compact:
+        return Slot(centre_id, parse_date(slot["startTime"]), parse_date(slot["endTime"]), slot["availablePlaces"])
+    # Responses are shared through the memo, so the slot is copied instead of being parsed in place
+    return dict(slot, startTime=parse_date(slot["startTime"]), endTime=parse_date(slot["endTime"]))
+
+
 class VaccinareCovidApi:
     def __init__(self, session_token=None, session_token_file=None, cache_lifetime=None, fallback_cache_lifetime=None,
-                 cache_path=None, delay_between_requests=None, max_retries=0, delay_between_retries=None):
+                 cache_path=None, delay_between_requests=None, max_retries=0, delay_between_retries=None, workers=1,
+                 api_url=API_URL, cache=None, snapshot=None, metrics=None, catalogue=None, rate_limiter=None,
+                 circuit_breaker=None, memo_lifetime=60, transport=None, compact_slots=False):
+        self.workers = workers
+        self.snapshot = snapshot
+        self.catalogue = catalogue
+        self.compact_slots = compact_slots
         self.http = HttpSession(session_token=session_token,
                                 session_token_file=session_token_file,
                                 cache_lifetime=cache_lifetime,
@@ -146,16 +346,32 @@ class VaccinareCovidApi:
                                 cache_path=cache_path,
                                 delay_between_requests=delay_between_requests,
                                 max_retries=max_retries,
-                                delay_between_retries=delay_between_retries)
+                                delay_between_retries=delay_between_retries,
+                                api_url=api_url,
+                                cache=cache,
+                                metrics=metrics,
+                                pool_size=max(10, workers),
+                                rate_limiter=rate_limiter,
+                                circuit_breaker=circuit_breaker,
+                                memo_lifetime=memo_lifetime,
+                                transport=transport)
+
+    @property
+    def metrics(self):
+        return self.http.metrics
+
+    def add_metrics_hook(self, hook):
+        """
+        Calls `hook(event, details)` for every request, cache lookup, retry and sleep; see `CrawlMetrics`
+        """
+        self.metrics.add_hook(hook)
 
     def get_counties(self):
         return self.http.get(COUNTIES_ENDPOINT)
 
     def get_centres(self, county_id=None, page=0, page_size=1000, recursive=True):
         while True:
-            centres = self.http.post(
-                f"{CENTRES_ENDPOINT}?page={page}&size={page_size}&sort=countyName,localityName,name",
-                {"countyID": county_id, "localityID": None, "name": None})
+            centres = self.http.post(*_centres_request(county_id, page, page_size))
 
             for centre in centres["content"]:
                 yield centre
@@ -165,31 +381,84 @@ class VaccinareCovidApi:
 
             page += 1
 
+    def find_centres(self, counties=None, localities=None, centre_ids=None, use_catalogue=True):
+        """
+        Gets the centres matching the filters (see `catalogue.centre_matches`), from the catalogue if there is one and
+        `use_catalogue` is set. Otherwise a single county given by ID is filtered by the API.
+        """
+        if use_catalogue and self.catalogue is not None:
+            return self.catalogue.load(self.get_centres).find(counties, localities, centre_ids)
+
+        county_id = None
+        if counties and len(counties) == 1 and str(counties[0]).isdigit():
+            county_id = int(counties[0])
+        return (centre for centre in self.get_centres(county_id=county_id)
+                if centre_matches(centre, counties, localities, centre_ids))
+
     def get_day_slots(self, centre_id, current_date):
-        return self.http.post(DAY_SLOTS_ENDPOINT, {
-            "centerID": centre_id,
-            "currentDate": current_date,
-            "forBooster": False})
+        return self.http.post(DAY_SLOTS_ENDPOINT, _day_slots_request(centre_id, current_date))
+
+    def _fetch_day_slots(self, centre_id, current_date):
+        return self.http.fetch("POST", DAY_SLOTS_ENDPOINT, _day_slots_request(centre_id, current_date))
+
+    def _get_available_day_slots(self, centre_id, day):
+        """
+        Gets the slots of a day with available places. In incremental mode the slots fetched by a previous run are
+        reused if the number of available places did not change in the meantime
+        """
+        if self.snapshot is None:
+            return self.get_day_slots(centre_id, day["startTime"])
+
+        slots = self.snapshot.get_day_slots(centre_id, day["startTime"], day["availablePlaces"])
+        if slots is None:
+            slots, fresh = self._fetch_day_slots(centre_id, day["startTime"])
+            # Slots served by the fallback cache are older than they would be recorded as
+            if fresh:
+                self.snapshot.put_day_slots(centre_id, day["startTime"], day["availablePlaces"], slots)
+        return slots
 
     def get_available_slots(self, centre_id, months_to_check):
-        # Use a constant value for the time so that the request can be cached
-        now = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-
-        for month in range(0, months_to_check):
-            current_date = now + relativedelta(months=month)
-            days_available = self.http.post(MONTHLY_AVAILABILITY_ENDPOINT,
-                                            data={"centerID": centre_id,
-                                                  "currentDate": current_date.strftime(DATE_FORMAT),
-                                                  "forBooster": False})
+        for month_request in _month_available_places_requests(centre_id, months_to_check):
+            days_available = self.http.post(MONTHLY_AVAILABILITY_ENDPOINT, data=month_request)
             for day in days_available:
                 if day["availablePlaces"] > 0:
-                    for slot in self.get_day_slots(centre_id, day["startTime"]):
+                    for slot in self._get_available_day_slots(centre_id, day):
                         if slot["availablePlaces"] > 0:
-                            slot["startTime"] = datetime.strptime(slot["startTime"], DATE_FORMAT)
-                            slot["endTime"] = datetime.strptime(slot["endTime"], DATE_FORMAT)
-                            yield slot
-
-    def get_available_slots_for_all_centres(self, months_to_check):
-        for centre in self.get_centres():
-            for slot in self.get_available_slots(centre["id"], months_to_check):
-                yield centre, slot
+                            yield _parse_slot(slot, centre_id, self.compact_slots)
+
+    def get_available_slots_for_all_centres(self, months_to_check, counties=None, localities=None, centre_ids=None):
+        return self.crawl_centres(self.find_centres(counties, localities, centre_ids), months_to_check)
+
+    def crawl_centres(self, centres, months_to_check):
+        """
+        :return: (centre, slot) pairs for the available slots of the given centres, in the order of the centres
+        """
+        if self.workers <= 1:
+            for centre in centres:
+                for slot in self.get_available_slots(centre["id"], months_to_check):
+                    yield centre, slot
+            return
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        # Centres are crawled concurrently, but the results are yielded in the same order as `get_centres` returns
+        # them. Only a limited number of centres is queued ahead of the one being yielded, so memory stays bounded.
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        pending = deque()
+        try:
+            for centre in centres:
+                pending.append((centre, executor.submit(self._list_available_slots, centre["id"], months_to_check)))
+                if len(pending) > self.workers * 2:
+                    centre, future = pending.popleft()
+                    for slot in future.result():
+                        yield centre, slot
+
+            while pending:
+                centre, future = pending.popleft()
+                for slot in future.result():
+                    yield centre, slot
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    def _list_available_slots(self, centre_id, months_to_check):
+        return list(self.get_available_slots(centre_id, months_to_check))
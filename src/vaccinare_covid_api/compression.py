@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+gzip and zstd compression of the cache entries and of the output files. zstd needs the optional `zstandard` package.
+
+Compressed data is recognized by its magic number, so readers do not need to know whether, or how, it was compressed.
+Output files are compressed according to their extension (".gz" or ".zst") and written as a stream, so the formatters
+never hold the whole output in memory.
+"""
+import gzip
+import io
+import os
+import shutil
+
+COMPRESSIONS = ["gzip", "zstd"]
+COMPRESSION_EXTENSIONS = {".gz": "gzip", ".zst": "zstd"}
+COMPRESSION_MIMETYPES = {"gzip": "application/gzip", "zstd": "application/zstd"}
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception("zstd compression needs the zstandard package: pip3 install zstandard")
+    return zstandard
+
+
+def compression_for_path(path):
+    """
+    :return: the compression implied by the extension of `path`, or None
+    """
+    return COMPRESSION_EXTENSIONS.get(os.path.splitext(path or "")[1])
+
+
+def uncompressed_path(path):
+    return path[:-len(os.path.splitext(path)[1])] if compression_for_path(path) else path
+
+
+def compress(data, compression):
+    """
+    :param data: bytes
+    :return: `data` compressed with `compression`, or unchanged if it is None
+    """
+    if compression is None:
+        return data
+    if compression == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    if compression == "zstd":
+        return _zstandard().ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    raise Exception(f"Invalid compression: {compression}")
+
+
+def decompress(data):
+    """
+    :return: `data` decompressed according to its magic number, or unchanged if it is not compressed
+    """
+    if data[:2] == GZIP_MAGIC:
+        return gzip.decompress(data)
+    if data[:4] == ZSTD_MAGIC:
+        # Streaming, since frames written by a streaming compressor do not record their decompressed size
+        return _zstandard().ZstdDecompressor().stream_reader(io.BytesIO(data)).read()
+    return data
+
+
+class _GzipWriter(gzip.GzipFile):
+    """
+    Writes a gzip stream without file name nor modification time, so that the same content always gives the same
+    file, and closes the underlying file once done
+    """
+
+    def __init__(self, file):
+        super().__init__(filename="", mode="wb", compresslevel=GZIP_LEVEL, fileobj=file, mtime=0)
+        self._file = file
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._file.close()
+
+
+def open_file(path, mode="rb", compression=None):
+    """
+    Opens a file, compressing what is written to it or decompressing what is read from it with `compression`.
+    Text modes read and write UTF-8.
+    :param mode: "rb", "wb", "r" or "w"
+    """
+    if compression is None:
+        return open(path, mode)
+
+    if compression not in COMPRESSIONS:
+        raise Exception(f"Invalid compression: {compression}")
+    if "w" not in mode:
+        if compression == "gzip":
+            stream = gzip.open(path, "rb")
+        else:
+            stream = _zstandard().ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+    else:
+        zstandard = _zstandard() if compression == "zstd" else None
+        file = open(path, "wb")
+        if compression == "gzip":
+            stream = _GzipWriter(file)
+        else:
+            stream = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(file, closefd=True)
+    return stream if "b" in mode else io.TextIOWrapper(stream, encoding="utf-8")
+
+
+def decompress_file(path, destination):
+    """
+    Writes the decompressed content of the file at `path` to `destination`, chunk by chunk
+    """
+    with open_file(path, "rb", compression_for_path(path)) as source, open(destination, "wb") as target:
+        shutil.copyfileobj(source, target, 1024 * 1024)
@@ -1,81 +1,281 @@
 import csv
+import heapq
 import json
+import pickle
+import tempfile
 from datetime import datetime, date
+from functools import reduce
+from operator import attrgetter, methodcaller
+
+
+def _render_value(value, cache):
+    """
+    Renders dates the way they are written to CSV files. Slots share a small number of distinct dates and times, so the
+    rendered strings are cached
+    """
+    if not isinstance(value, date):
+        return value
+    rendered = cache.get(value)
+    if rendered is None:
+        if len(cache) >= 100000:
+            cache.clear()
+        if isinstance(value, datetime):
+            rendered = value.strftime("%Y-%m-%d %H:%M:%S")
+        else:
+            rendered = value.strftime("%Y-%m-%d")
+        cache[value] = rendered
+    return rendered
+
+
+def _sort_key(values):
+    # None cannot be compared with the other values, so it is sorted before all of them
+    return tuple((value is not None, value) if value is not None else (False, 0) for value in values)
+
+
+def _write_run(items, directory=None):
+    run = tempfile.TemporaryFile(dir=directory)
+    for item in items:
+        pickle.dump(item, run, pickle.HIGHEST_PROTOCOL)
+    run.seek(0)
+    return run
+
+
+def _read_run(run):
+    while True:
+        try:
+            yield pickle.load(run)
+        except EOFError:
+            return
+
+
+def _json_default(value):
+    # Compact slots are written like the slots returned by the API
+    if hasattr(value, "_asdict"):
+        return value._asdict()
+    return str(value)
+
+
+def _get_property(record, key):
+    if type(record) is dict:
+        return record.get(key)
+    value = getattr(record, key)
+    return value() if callable(value) else value
+
+
+def _compile_step(key, sample):
+    """
+    Compiles one step of a property path for the type of value found in the first record: a dict lookup, an attribute
+    (e.g. of a compact slot) or a method call (e.g. "date")
+    """
+    if type(sample) is dict:
+        return lambda record: record.get(key)
+    if sample is not None and not callable(getattr(sample, key, None)):
+        return attrgetter(key)
+    return methodcaller(key)
+
+
+def _compile_accessor(property_path, sample, render_cache):
+    """
+    Compiles a property path (e.g. "slot.startTime.date") into a function extracting the rendered value from a record.
+    The steps are specialized for the types found in `sample`; records with a different structure fall back to
+    resolving the path generically.
+    """
+    keys = tuple(property_path.split("."))
+    steps = []
+    for key in keys:
+        step = _compile_step(key, sample)
+        sample = step(sample) if sample is not None else None
+        steps.append(step)
+
+    if len(steps) == 1:
+        get = steps[0]
+    elif len(steps) == 2:
+        first, second = steps
+        get = lambda record: second(first(record))
+    elif len(steps) == 3:
+        first, second, third = steps
+        get = lambda record: third(second(first(record)))
+    else:
+        get = lambda record: reduce(lambda value, step: step(value), steps, record)
+
+    def accessor(record):
+        try:
+            value = get(record)
+        except (AttributeError, TypeError):
+            value = reduce(_get_property, keys, record)
+        return _render_value(value, render_cache)
+
+    return accessor
 
 
 class CsvFormatter:
-    def __init__(self, file, header):
+    """
+    Writes records as CSV rows. `header` maps property paths (e.g. "centre.name" or "slot.startTime.date") to column
+    titles. Consecutive records with the same values are written once; the values of the columns whose path ends with
+    "[]" are aggregated into a ";" separated list instead.
+
+    Rows are written in batches and the file is flushed every `flush_every` rows, or only at the end if it is 0.
+
+    By default records are expected to be sorted, so that the records of a row are consecutive. With `grouped`, records
+    can come in any order: rows are grouped by their non-aggregated values in memory and written, in the order in which
+    they first appeared, at the end. If `max_groups` is set, the groups are spilled to sorted temporary files in
+    `spill_path` whenever there are more than `max_groups` of them in memory, and merged at the end.
+    """
+
+    def __init__(self, file, header, flush_every=1000, grouped=False, max_groups=None, spill_path=None):
         self.file = file
         self.writer = csv.writer(file)
         self.header = header
+        self.flush_every = flush_every
+        self.grouped = grouped
+        self.max_groups = max_groups
+        self.spill_path = spill_path
+        self._groups = {}
+        self._group_count = 0
+        self._spilled_runs = []
         self._current_row_identifier = None
         self._current_row = None
+        self._rows = []
+        self._accessors = None
+        self._render_cache = {}
 
         self.aggregation_keys = {}
         for idx, key in enumerate(self.header.keys()):
             if key[-2:] == "[]":
                 self.aggregation_keys[key] = idx
+        self._aggregation_indexes = tuple(self.aggregation_keys.values())
+        self._identifier_indexes = tuple(idx for idx in range(len(self.header)) if idx not in self._aggregation_indexes)
+        identifier_indexes = self._identifier_indexes
+        self._get_row_identifier = lambda row: tuple(row[idx] for idx in identifier_indexes)
 
     def start(self):
         self.writer.writerow(self.header.values())
         self.file.flush()
 
-    def _get_value(self, record, property_path):
-        to_set = False
-        if property_path[-2:] == "[]":
-            to_set = True
-            property_path = property_path[0:-2]
+    def _compile(self, record):
+        self._accessors = tuple(
+            _compile_accessor(key[0:-2] if key[-2:] == "[]" else key, record, self._render_cache)
+            for key in self.header.keys())
 
-        for key in property_path.split("."):
-            if type(record) is dict:
-                record = record.get(key)
-            else:
-                record = getattr(record, key)()
-
-        if isinstance(record, datetime):
-            record = record.strftime("%Y-%m-%d %H:%M:%S")
-        elif isinstance(record, date):
-            record = record.strftime("%Y-%m-%d")
+    def write(self, record, slot=None):
+        if slot is not None:
+            record = {"centre": record, "slot": slot}
+        if self._accessors is None:
+            self._compile(record)
 
-        if to_set:
-            record = {record}
+        row = [accessor(record) for accessor in self._accessors]
+        row_identifier = self._get_row_identifier(row)
 
-        return record
+        if self.grouped:
+            self._add_to_group(row, row_identifier)
+            return
 
-    def write(self, record):
-        row = []
-        row_identifier = []
-        for key in self.header.keys():
-            val = self._get_value(record, key)
-            row.append(val)
-            if key not in self.aggregation_keys:
-                row_identifier.append(val)
-
-        if self._current_row_identifier:
-            if self._current_row_identifier != row_identifier:
-                self._flush_current_record()
-            else:
-                for idx in self.aggregation_keys.values():
-                    self._current_row[idx].update(row[idx])
+        if self._current_row_identifier is not None:
+            if self._current_row_identifier == row_identifier:
+                for idx in self._aggregation_indexes:
+                    self._current_row[idx].add(row[idx])
+                return
+            self._flush_current_record()
 
-        if not self._current_row_identifier:
-            self._current_row = row
-            self._current_row_identifier = row_identifier
+        for idx in self._aggregation_indexes:
+            row[idx] = {row[idx]}
+        self._current_row = row
+        self._current_row_identifier = row_identifier
 
     def end(self):
-        self._flush_current_record()
+        if self.grouped:
+            self._flush_groups()
+        elif self._current_row_identifier is not None:
+            self._flush_current_record()
+        self._write_rows()
 
     def _flush_current_record(self):
-        csv_row = []
-        for value in self._current_row:
-            if type(value) is set:
-                value = ";".join(sorted(value))
-            csv_row.append(value)
-        self.writer.writerow(csv_row)
-        self.file.flush()
+        self._emit_row(self._current_row)
         self._current_row = None
         self._current_row_identifier = None
 
+    def _emit_row(self, row):
+        for idx in self._aggregation_indexes:
+            row[idx] = ";".join(sorted(row[idx]))
+        self._rows.append(row)
+        if self.flush_every and len(self._rows) >= self.flush_every:
+            self._write_rows()
+
+    def _write_rows(self):
+        self.writer.writerows(self._rows)
+        self.file.flush()
+        self._rows = []
+
+    def _add_to_group(self, row, row_identifier):
+        # A group only keeps the position at which it first appeared and the sets of aggregated values; the other
+        # values are already part of the key
+        group = self._groups.get(row_identifier)
+        if group is None:
+            self._groups[row_identifier] = [self._group_count] + [{row[idx]} for idx in self._aggregation_indexes]
+            self._group_count += 1
+            if self.max_groups and len(self._groups) >= self.max_groups:
+                self._spill_groups()
+        else:
+            for position, idx in enumerate(self._aggregation_indexes, 1):
+                group[position].add(row[idx])
+
+    def _spill_groups(self):
+        groups = sorted(self._groups.items(), key=lambda item: _sort_key(item[0]))
+        self._spilled_runs.append(_write_run(groups, self.spill_path))
+        self._groups = {}
+
+    def _flush_groups(self):
+        if not self._spilled_runs:
+            groups = self._groups.items()
+        else:
+            self._spill_groups()
+            groups = self._merge_spilled_groups()
+
+        for row_identifier, group in groups:
+            row = [None] * len(self.header)
+            for idx, value in zip(self._identifier_indexes, row_identifier):
+                row[idx] = value
+            for position, idx in enumerate(self._aggregation_indexes, 1):
+                row[idx] = group[position]
+            self._emit_row(row)
+        self._groups = {}
+
+    def _merge_spilled_groups(self):
+        """
+        Merges the sorted runs by key, which brings together the parts of a group spilled at different times, and then
+        sorts the merged groups back into the order in which they first appeared
+        """
+        runs = [_read_run(run) for run in self._spilled_runs]
+        merged = []
+        current_key = None
+        current_group = None
+        for key, group in heapq.merge(*runs, key=lambda item: _sort_key(item[0])):
+            if current_group is not None and key == current_key:
+                current_group[0] = min(current_group[0], group[0])
+                for position in range(1, len(group)):
+                    current_group[position].update(group[position])
+                continue
+            if current_group is not None:
+                merged.append((current_key, current_group))
+            current_key, current_group = key, group
+            if len(merged) >= self.max_groups:
+                merged.sort(key=lambda item: item[1][0])
+                self._spilled_runs.append(_write_run(merged, self.spill_path))
+                merged = []
+        if current_group is not None:
+            merged.append((current_key, current_group))
+        merged.sort(key=lambda item: item[1][0])
+
+        for run in self._spilled_runs[:len(runs)]:
+            run.close()
+        del self._spilled_runs[:len(runs)]
+
+        runs = [_read_run(run) for run in self._spilled_runs] + [iter(merged)]
+        yield from heapq.merge(*runs, key=lambda item: item[1][0])
+        for run in self._spilled_runs:
+            run.close()
+        self._spilled_runs = []
+
 
 class JsonFormatter:
     def __init__(self, file):
@@ -90,7 +290,182 @@ class JsonFormatter:
             self.file.write(",")
         else:
             self.had_first_record = True
-        self.file.write(json.dumps(record, default=str))
+        self.file.write(json.dumps(record, default=_json_default))
 
     def end(self):
         self.file.write("]")
+
+
+class NdjsonFormatter:
+    """
+    Writes one JSON document per line, so the output can be processed record by record
+    """
+
+    def __init__(self, file):
+        self.file = file
+
+    def start(self):
+        pass
+
+    def write(self, record):
+        self.file.write(json.dumps(record, default=_json_default))
+        self.file.write("\n")
+
+    def end(self):
+        self.file.flush()
+
+
+def read_ndjson(file):
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+COMPACT_MAGIC = b"VCA1"
+COMPACT_CENTRE = b"C"
+COMPACT_SCHEMA = b"S"
+COMPACT_RECORD = b"R"
+
+
+def _write_varint(file, value):
+    while value > 0x7f:
+        file.write(bytes(((value & 0x7f) | 0x80,)))
+        value >>= 7
+    file.write(bytes((value,)))
+
+
+def _read_varint(file):
+    value = 0
+    shift = 0
+    while True:
+        byte = file.read(1)
+        if not byte:
+            raise EOFError("Truncated compact file")
+        value |= (byte[0] & 0x7f) << shift
+        if byte[0] < 0x80:
+            return value
+        shift += 7
+
+
+class CompactFormatter:
+    """
+    Writes records to a binary, dictionary-encoded stream of frames. Every frame is a type byte, a varint length and a
+    JSON payload:
+    - C: a centre, written only the first time a record references it; centres are numbered in order from 0
+    - S: a schema, i.e. the list of the (flattened) keys of a record, numbered in order from 0
+    - R: a record, as [centre number or null, schema number, values...]
+
+    The records of a crawl share a handful of schemas and every centre is written once, so slots only carry their
+    own values. Use `read_compact` to read the records back. The file needs to be opened in binary mode, see
+    `BINARY_FORMATS`.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self._centres = {}
+        self._schemas = {}
+        self._last_centre = None
+        self._last_centre_ref = None
+
+    def start(self):
+        self.file.write(COMPACT_MAGIC)
+
+    def _write_frame(self, frame_type, payload):
+        payload = json.dumps(payload, default=_json_default, separators=(",", ":")).encode()
+        self.file.write(frame_type)
+        _write_varint(self.file, len(payload))
+        self.file.write(payload)
+
+    def _get_centre_ref(self, centre):
+        if centre is self._last_centre:
+            return self._last_centre_ref
+        key = json.dumps(centre, default=str, sort_keys=True)
+        centre_ref = self._centres.get(key)
+        if centre_ref is None:
+            centre_ref = self._centres[key] = len(self._centres)
+            self._write_frame(COMPACT_CENTRE, centre)
+        self._last_centre = centre
+        self._last_centre_ref = centre_ref
+        return centre_ref
+
+    def write(self, record):
+        centre_ref = None
+        keys = []
+        values = []
+        for key, value in record.items():
+            if hasattr(value, "_asdict"):
+                value = value._asdict()
+            if key == "centre" and type(value) is dict:
+                centre_ref = self._get_centre_ref(value)
+            elif type(value) is dict:
+                for sub_key, sub_value in value.items():
+                    keys.append(f"{key}.{sub_key}")
+                    values.append(sub_value)
+            else:
+                keys.append(key)
+                values.append(value)
+
+        keys = tuple(keys)
+        schema_ref = self._schemas.get(keys)
+        if schema_ref is None:
+            schema_ref = self._schemas[keys] = len(self._schemas)
+            self._write_frame(COMPACT_SCHEMA, keys)
+
+        self._write_frame(COMPACT_RECORD, [centre_ref, schema_ref] + values)
+
+    def end(self):
+        self.file.flush()
+
+
+def read_compact(file):
+    """
+    Reads the records written by `CompactFormatter`. Records referencing the same centre share the same dict.
+    """
+    if file.read(len(COMPACT_MAGIC)) != COMPACT_MAGIC:
+        raise Exception("Not a compact file")
+
+    centres = []
+    schemas = []
+    while True:
+        frame_type = file.read(1)
+        if not frame_type:
+            return
+        payload = json.loads(file.read(_read_varint(file)))
+
+        if frame_type == COMPACT_CENTRE:
+            centres.append(payload)
+        elif frame_type == COMPACT_SCHEMA:
+            schemas.append([key.split(".", 1) for key in payload])
+        elif frame_type == COMPACT_RECORD:
+            record = {}
+            if payload[0] is not None:
+                record["centre"] = centres[payload[0]]
+            for path, value in zip(schemas[payload[1]], payload[2:]):
+                if len(path) == 1:
+                    record[path[0]] = value
+                else:
+                    record.setdefault(path[0], {})[path[1]] = value
+            yield record
+        else:
+            raise Exception(f"Invalid compact frame type: {frame_type}")
+
+
+class MultiFormatter:
+    """
+    Writes the same stream of records to several formatters, so that a single crawl produces all the outputs
+    """
+
+    def __init__(self, formatters):
+        self.formatters = formatters
+
+    def start(self):
+        for formatter in self.formatters:
+            formatter.start()
+
+    def write(self, record):
+        for formatter in self.formatters:
+            formatter.write(record)
+
+    def end(self):
+        for formatter in self.formatters:
+            formatter.end()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+import json
+import time
+
+from datetime import datetime, timedelta
+
+from .cache import SqliteStore
+
+HISTORY_FILE = "history.sqlite"
+EPOCH = datetime(1970, 1, 1)
+APPEARED = 1
+GONE = -1
+
+
+def _to_seconds(value):
+    return int((value - EPOCH).total_seconds())
+
+
+def _to_datetime(seconds):
+    return EPOCH + timedelta(seconds=seconds)
+
+
+class AvailabilityHistory(SqliteStore):
+    """
+    Append-only history of the sweeps. Every sweep is a crawl, and every available slot it found is stored as a row
+    (crawl, centre, start time, end time, available places), with the times as integers and the centre details kept
+    once in a separate table, so that millions of rows stay small.
+
+    When a crawl ends, it is compared to the previous crawl with the same filters (`scope`), and the slots that appeared
+    or are gone (booked or past) are stored as changes, so that the recent changes can be queried without comparing
+    whole crawls again. The first crawl of a scope has no changes.
+    """
+    batch_size = 10000
+    schema = (
+        "CREATE TABLE IF NOT EXISTS crawls ("
+        "id INTEGER PRIMARY KEY, scope TEXT, started_at REAL NOT NULL, finished_at REAL, slots INTEGER)",
+        "CREATE INDEX IF NOT EXISTS crawls_finished_at ON crawls (finished_at)",
+        "CREATE TABLE IF NOT EXISTS centres ("
+        "id INTEGER PRIMARY KEY, name TEXT, county TEXT, locality TEXT)",
+        "CREATE TABLE IF NOT EXISTS slots ("
+        "crawl_id INTEGER NOT NULL, centre_id INTEGER NOT NULL, start_time INTEGER NOT NULL, "
+        "end_time INTEGER NOT NULL, available_places INTEGER NOT NULL, "
+        "PRIMARY KEY (crawl_id, centre_id, start_time, end_time)) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS slots_centre_start_time ON slots (centre_id, start_time)",
+        "CREATE TABLE IF NOT EXISTS changes ("
+        "crawl_id INTEGER NOT NULL, change INTEGER NOT NULL, centre_id INTEGER NOT NULL, "
+        "start_time INTEGER NOT NULL, end_time INTEGER NOT NULL, "
+        "PRIMARY KEY (crawl_id, change, centre_id, start_time, end_time)) WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS county_availability ("
+        "crawl_id INTEGER NOT NULL, county TEXT, slots INTEGER NOT NULL, available_places INTEGER NOT NULL, "
+        "PRIMARY KEY (crawl_id, county))",
+    )
+
+    def record(self, pairs, scope=None):
+        """
+        Stores the (centre, slot) pairs of a sweep as a new crawl while passing them through, e.g.
+        `for centre, slot in history.record(client.get_available_slots_for_all_centres(1))`. Rows are written in
+        batches, and the crawl is only visible to the queries once the sweep is complete.
+        :param scope: the filters of the sweep, if any; crawls are only compared to crawls with the same scope
+        """
+        connection = self._connection()
+        scope = json.dumps(scope, sort_keys=True) if scope else None
+        crawl_id = connection.execute("INSERT INTO crawls (scope, started_at) VALUES (?, ?)",
+                                      (scope, time.time())).lastrowid
+        centres = {}
+        rows = []
+        count = 0
+        try:
+            for centre, slot in pairs:
+                if centre["id"] not in centres:
+                    centres[centre["id"]] = (centre["id"], centre.get("name"), centre.get("countyName"),
+                                             centre.get("localityName"))
+                rows.append((crawl_id, centre["id"], _to_seconds(slot["startTime"]), _to_seconds(slot["endTime"]),
+                             slot["availablePlaces"]))
+                if len(rows) >= self.batch_size:
+                    count += self._write_rows(rows)
+                    rows = []
+                yield centre, slot
+            count += self._write_rows(rows)
+            self._finish_crawl(crawl_id, scope, count, centres.values())
+        except BaseException:
+            with self.transaction(immediate=True) as connection:
+                connection.execute("DELETE FROM slots WHERE crawl_id = ?", (crawl_id,))
+                connection.execute("DELETE FROM crawls WHERE id = ?", (crawl_id,))
+            raise
+
+    def _write_rows(self, rows):
+        # A single transaction per batch, much faster than committing every row
+        with self.transaction() as connection:
+            connection.executemany("INSERT OR IGNORE INTO slots (crawl_id, centre_id, start_time, end_time, "
+                                   "available_places) VALUES (?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def _finish_crawl(self, crawl_id, scope, count, centres):
+        with self.transaction(immediate=True) as connection:
+            connection.executemany("INSERT OR REPLACE INTO centres (id, name, county, locality) VALUES (?, ?, ?, ?)",
+                                   centres)
+            previous = connection.execute(
+                "SELECT id FROM crawls WHERE scope IS ? AND finished_at IS NOT NULL AND id < ? ORDER BY id DESC "
+                "LIMIT 1", (scope, crawl_id)).fetchone()
+            if previous:
+                for change, current_id, previous_id in ((APPEARED, crawl_id, previous[0]),
+                                                        (GONE, previous[0], crawl_id)):
+                    connection.execute(
+                        "INSERT INTO changes (crawl_id, change, centre_id, start_time, end_time) "
+                        "SELECT ?, ?, centre_id, start_time, end_time FROM ("
+                        "SELECT centre_id, start_time, end_time FROM slots WHERE crawl_id = ? EXCEPT "
+                        "SELECT centre_id, start_time, end_time FROM slots WHERE crawl_id = ?)",
+                        (crawl_id, change, current_id, previous_id))
+            # Per county totals are computed once per crawl, so the time series does not need to scan every slot
+            connection.execute(
+                "INSERT INTO county_availability (crawl_id, county, slots, available_places) "
+                "SELECT ?, centres.county, COUNT(*), SUM(slots.available_places) FROM slots "
+                "JOIN centres ON centres.id = slots.centre_id WHERE slots.crawl_id = ? GROUP BY centres.county",
+                (crawl_id, crawl_id))
+            connection.execute("UPDATE crawls SET finished_at = ?, slots = ? WHERE id = ?",
+                               (time.time(), count, crawl_id))
+
+    def crawls(self, limit=None):
+        rows = self._connection().execute(
+            "SELECT id, scope, started_at, finished_at, slots FROM crawls WHERE finished_at IS NOT NULL "
+            "ORDER BY id DESC LIMIT ?", (limit or -1,))
+        return [{"id": crawl_id, "scope": json.loads(scope) if scope else None,
+                 "started_at": datetime.fromtimestamp(started_at), "finished_at": datetime.fromtimestamp(finished_at),
+                 "slots": slots}
+                for crawl_id, scope, started_at, finished_at, slots in rows]
+
+    def _changes(self, where, params):
+        rows = self._connection().execute(
+            "SELECT crawls.finished_at, changes.change, changes.centre_id, centres.name, centres.county, "
+            "centres.locality, changes.start_time, changes.end_time "
+            "FROM changes JOIN crawls ON crawls.id = changes.crawl_id "
+            "LEFT JOIN centres ON centres.id = changes.centre_id "
+            f"WHERE {where} ORDER BY changes.crawl_id, changes.centre_id, changes.start_time", params)
+        return [{"crawled_at": datetime.fromtimestamp(crawled_at),
+                 "change": "appeared" if change == APPEARED else "gone", "centre_id": centre_id, "centre": name,
+                 "county": county, "locality": locality,
+                 "start_time": _to_datetime(start_time), "end_time": _to_datetime(end_time)}
+                for crawled_at, change, centre_id, name, county, locality, start_time, end_time in rows]
+
+    def appeared_since(self, since):
+        """
+        :param since: timestamp
+        :return: the slots that appeared in the crawls finished since then
+        """
+        return self._changes("crawls.finished_at >= ? AND changes.change = ?", (since, APPEARED))
+
+    def diff(self, crawl_id=None):
+        """
+        :return: the slots that appeared and are gone in a crawl, by default the last one, compared to the previous one
+        """
+        if crawl_id is None:
+            row = self._connection().execute("SELECT MAX(id) FROM crawls WHERE finished_at IS NOT NULL").fetchone()
+            crawl_id = row[0]
+        changes = self._changes("changes.crawl_id = ?", (crawl_id,))
+        return {"crawl_id": crawl_id,
+                "appeared": [change for change in changes if change["change"] == "appeared"],
+                "gone": [change for change in changes if change["change"] == "gone"]}
+
+    def availability_by_county(self, since=None):
+        """
+        :return: the number of available slots and places per county for every crawl finished since `since`
+        """
+        rows = self._connection().execute(
+            "SELECT crawls.id, crawls.finished_at, county_availability.county, county_availability.slots, "
+            "county_availability.available_places FROM crawls "
+            "JOIN county_availability ON county_availability.crawl_id = crawls.id "
+            "WHERE crawls.finished_at >= ? ORDER BY crawls.id, county_availability.county",
+            (since or 0,))
+        return [{"crawl_id": crawl_id, "crawled_at": datetime.fromtimestamp(crawled_at), "county": county,
+                 "slots": slots, "available_places": places}
+                for crawl_id, crawled_at, county, slots, places in rows]
+
+    def centre_availability(self, centre_id, day=None):
+        """
+        :param day: date, to only count the slots of that day
+        :return: the number of available slots and places of a centre in every crawl
+        """
+        start, end = 0, 2 ** 62
+        if day is not None:
+            start = _to_seconds(datetime.combine(day, datetime.min.time()))
+            end = start + 86400
+        rows = self._connection().execute(
+            "SELECT crawls.id, crawls.finished_at, COUNT(*), SUM(slots.available_places) "
+            "FROM slots JOIN crawls ON crawls.id = slots.crawl_id "
+            "WHERE slots.centre_id = ? AND slots.start_time >= ? AND slots.start_time < ? "
+            "AND crawls.finished_at IS NOT NULL GROUP BY crawls.id ORDER BY crawls.id", (centre_id, start, end))
+        return [{"crawl_id": crawl_id, "crawled_at": datetime.fromtimestamp(crawled_at), "slots": slots,
+                 "available_places": places}
+                for crawl_id, crawled_at, slots, places in rows]
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+import json
+import time
+
+from .cache import SqliteStore
+
+SNAPSHOT_FILE = "availability.sqlite"
+
+
+class AvailabilitySnapshot(SqliteStore):
+    """
+    Remembers, for every centre and day, the number of available places reported by `month_available_places` and the
+    `day_slots` response fetched for it. A day's slots are reused as long as its number of available places did not
+    change and they are at most `max_staleness` seconds old.
+    """
+    schema = (
+        "CREATE TABLE IF NOT EXISTS day_slots ("
+        "centre_id INTEGER NOT NULL, day TEXT NOT NULL, available_places INTEGER NOT NULL, fetched_at REAL NOT NULL, "
+        "slots TEXT NOT NULL, PRIMARY KEY (centre_id, day))",
+        "CREATE INDEX IF NOT EXISTS day_slots_fetched_at ON day_slots (fetched_at)",
+    )
+
+    def __init__(self, path, max_staleness=3600):
+        super().__init__(path)
+        self.max_staleness = max_staleness
+        # Entries older than max_staleness are never reused, so there is no point in keeping them
+        self._connection().execute("DELETE FROM day_slots WHERE fetched_at < ?", (time.time() - max_staleness,))
+
+    def get_day_slots(self, centre_id, day, available_places):
+        row = self._connection().execute(
+            "SELECT slots FROM day_slots WHERE centre_id = ? AND day = ? AND available_places = ? AND fetched_at >= ?",
+            (centre_id, day, available_places, time.time() - self.max_staleness)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_day_slots(self, centre_id, day, available_places, slots):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO day_slots (centre_id, day, available_places, fetched_at, slots) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (centre_id, day, available_places, time.time(), json.dumps(slots)))
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+import threading
+import time
+
+from collections import OrderedDict
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class RequestMemo:
+    """
+    In-memory LRU of parsed API responses, kept for `lifetime` seconds, in front of the cache and the network.
+
+    Identical requests made while the first one is still in flight wait for its result instead of being sent again
+    (single-flight), from threads with `get_or_load` or from asyncio tasks with `get_or_load_async`. The same objects
+    are returned to every caller, so they must not be modified.
+    """
+
+    def __init__(self, max_entries=1024, lifetime=60):
+        self.max_entries = max_entries
+        self.lifetime = lifetime
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._async_in_flight = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and time.monotonic() > expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key, value):
+        if not self.max_entries or self.lifetime == 0:
+            return
+        with self._lock:
+            expires_at = time.monotonic() + self.lifetime if self.lifetime is not None else None
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_or_load(self, key, load):
+        """
+        :param load: called without arguments when the response is neither memoized nor in flight; returns the
+                     response and whether it can be memoized
+        :return: the response and True if it was loaded by this call, False if it was memoized or loaded by another
+                 thread
+        """
+        with self._lock:
+            entry = self._get(key)
+            if entry is not None:
+                return entry[1], False
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, False
+
+        try:
+            call.value, keep = load()
+            if keep:
+                self._put(key, call.value)
+            return call.value, True
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.done.set()
+
+    async def get_or_load_async(self, key, load):
+        """
+        asyncio counterpart of `get_or_load`; `load` is a coroutine function
+        """
+        import asyncio
+
+        with self._lock:
+            entry = self._get(key)
+        if entry is not None:
+            return entry[1], False
+
+        future = self._async_in_flight.get(key)
+        if future is not None:
+            return await asyncio.shield(future), False
+
+        future = self._async_in_flight[key] = asyncio.get_running_loop().create_future()
+        try:
+            value, keep = await load()
+            if keep:
+                self._put(key, value)
+            future.set_result(value)
+            return value, True
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Retrieve the exception, so that it is not reported as never retrieved when no other task waits for it
+            future.exception()
+            raise
+        finally:
+            del self._async_in_flight[key]
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+import json
+import threading
+
+from collections import defaultdict
+from urllib.parse import urlparse
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf"))
+
+
+def endpoint_name(path):
+    """
+    :return: the last segment of the request path, e.g. "day_slots" for "/scheduling/api/time_slots/day_slots"
+    """
+    return urlparse(path).path.rstrip("/").rsplit("/", 1)[-1]
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def add(self, latency):
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+        for idx, upper_bound in enumerate(LATENCY_BUCKETS):
+            if latency <= upper_bound:
+                self.buckets[idx] += 1
+                break
+
+    def percentile(self, percentile):
+        """
+        :return: the upper bound of the bucket the given percentile falls in
+        """
+        if not self.count:
+            return None
+        rank = self.count * percentile / 100
+        seen = 0
+        for idx, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= rank:
+                return min(LATENCY_BUCKETS[idx], self.max)
+
+    def merge(self, data):
+        """
+        Adds the latencies of a histogram exported with `to_dict`
+        """
+        self.count += data["count"]
+        self.total += (data["mean"] or 0) * data["count"]
+        self.max = max(self.max, data["max"])
+        for idx, bucket in enumerate(data["buckets"].values()):
+            self.buckets[idx] += bucket
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "max": self.max,
+            "buckets": {str(upper_bound): bucket for upper_bound, bucket in zip(LATENCY_BUCKETS, self.buckets)},
+        }
+
+
+class CrawlMetrics:
+    """
+    Collects the request, cache, retry and sleep statistics of a crawl. Every event is also passed to the hooks added
+    with `add_hook`, as `hook(event, details)`, where event is one of "request", "cache", "retry" or "sleep".
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hooks = []
+        self.requests = defaultdict(int)
+        self.status_codes = defaultdict(int)
+        self.cache = defaultdict(lambda: defaultdict(int))
+        self.retries = defaultdict(int)
+        self.latencies = defaultdict(LatencyHistogram)
+        self.bytes_received = 0
+        self.sleep_time = defaultdict(float)
+
+    def add_hook(self, hook):
+        self._hooks.append(hook)
+
+    def _notify(self, event, details):
+        for hook in self._hooks:
+            hook(event, details)
+
+    def record_request(self, path, latency, status_code, size):
+        endpoint = endpoint_name(path)
+        with self._lock:
+            self.requests[endpoint] += 1
+            self.status_codes[str(status_code)] += 1
+            self.latencies[endpoint].add(latency)
+            self.bytes_received += size
+        self._notify("request", {"endpoint": endpoint, "latency": latency, "status_code": status_code,
+                                 "size": size})
+
+    def record_cache(self, path, outcome):
+        """
+        :param outcome: "hit", "miss", "fallback" or "memo" (answered from memory or by an identical request in flight)
+        """
+        endpoint = endpoint_name(path)
+        with self._lock:
+            self.cache[endpoint][outcome] += 1
+        self._notify("cache", {"endpoint": endpoint, "outcome": outcome})
+
+    def record_retry(self, path):
+        endpoint = endpoint_name(path)
+        with self._lock:
+            self.retries[endpoint] += 1
+        self._notify("retry", {"endpoint": endpoint})
+
+    def record_sleep(self, reason, seconds):
+        """
+        :param reason: "rate_limit" for the delay between requests, "retry" for the delay between retries
+        """
+        if seconds <= 0:
+            return
+        with self._lock:
+            self.sleep_time[reason] += seconds
+        self._notify("sleep", {"reason": reason, "seconds": seconds})
+
+    def summary(self):
+        with self._lock:
+            return {
+                "requests": dict(self.requests),
+                "status_codes": dict(self.status_codes),
+                "cache": {endpoint: dict(outcomes) for endpoint, outcomes in self.cache.items()},
+                "retries": dict(self.retries),
+                "latency": {endpoint: histogram.to_dict() for endpoint, histogram in self.latencies.items()},
+                "bytes_received": self.bytes_received,
+                "sleep_time": dict(self.sleep_time),
+            }
+
+    def merge(self, summary):
+        """
+        Adds the statistics of another crawl, e.g. the `summary` of the client of a worker process
+        """
+        with self._lock:
+            for endpoint, count in summary["requests"].items():
+                self.requests[endpoint] += count
+            for status_code, count in summary["status_codes"].items():
+                self.status_codes[status_code] += count
+            for endpoint, outcomes in summary["cache"].items():
+                for outcome, count in outcomes.items():
+                    self.cache[endpoint][outcome] += count
+            for endpoint, count in summary["retries"].items():
+                self.retries[endpoint] += count
+            for endpoint, latency in summary["latency"].items():
+                self.latencies[endpoint].merge(latency)
+            self.bytes_received += summary["bytes_received"]
+            for reason, seconds in summary["sleep_time"].items():
+                self.sleep_time[reason] += seconds
+
+    def format_summary(self):
+        summary = self.summary()
+        lines = [f"{sum(summary['requests'].values())} requests, {summary['bytes_received'] / 1024:.1f} KB received, "
+                 f"{sum(summary['sleep_time'].values()):.1f}s sleeping"]
+        for endpoint in sorted(set(summary["requests"]) | set(summary["cache"])):
+            latency = summary["latency"].get(endpoint)
+            cache = summary["cache"].get(endpoint, {})
+            line = (f"{endpoint}: {summary['requests'].get(endpoint, 0)} requests, "
+                    f"{summary['retries'].get(endpoint, 0)} retries, cache {cache.get('hit', 0)} hits / "
+                    f"{cache.get('miss', 0)} misses / {cache.get('fallback', 0)} fallbacks")
+            if latency:
+                line += f", latency mean {latency['mean']:.3f}s p95 {latency['p95']:.3f}s max {latency['max']:.3f}s"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def write(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=4)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+import logging
+import random
+import threading
+import time
+
+THROTTLING_STATUS_CODES = {429}
+
+
+def is_failure(status_code):
+    """
+    :return: True for the responses telling that the API is overloaded or failing (429 and 5xx)
+    """
+    return status_code in THROTTLING_STATUS_CODES or status_code >= 500
+
+
+def backoff_delay(attempt, base, cap=60):
+    """
+    Exponential backoff with jitter: the delay doubles with every attempt, up to `cap`, and a random half of it is
+    dropped so that the clients retrying at the same time do not all come back together.
+    :param attempt: 1 for the first retry
+    """
+    if not base:
+        return 0
+    delay = min(cap, base * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def retry_after(headers, cap=60):
+    """
+    :return: the number of seconds from the Retry-After header, if the API sent one in seconds
+    """
+    value = (headers or {}).get("retry-after")
+    if value is None or not str(value).strip().isdigit():
+        return 0
+    return min(cap, int(value))
+
+
+class RateLimiter:
+    """
+    Token bucket spacing out requests: tokens are added at `1 / interval` per second, up to `burst`, and every request
+    takes one. The limiter is shared by all the threads and tasks using it, so the rate is global regardless of the
+    number of workers.
+
+    When `adaptive` is set, the rate follows the API (AIMD): it grows by `increase` requests per second after every
+    request answered within `target_latency`, and is multiplied by `decrease` after a slow, throttled (429) or failed
+    (5xx) response, at most once every `cooldown` seconds so that the requests already in flight do not cut it again.
+    """
+
+    def __init__(self, interval=None, burst=1, adaptive=False, min_rate=0.5, max_rate=20, increase=0.1, decrease=0.5,
+                 target_latency=2, cooldown=1):
+        self.adaptive = adaptive
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.target_latency = target_latency
+        self.cooldown = cooldown
+        if interval:
+            self.rate = 1 / interval
+        else:
+            self.rate = max_rate if adaptive else None
+        self._lock = threading.Lock()
+        self._tokens = burst
+        self._updated_at = time.monotonic()
+        self._decreased_at = None
+
+    @property
+    def interval(self):
+        return 1 / self.rate if self.rate else None
+
+    def _reserve(self):
+        """
+        Takes a token, going into debt if there is none left
+        :return: the number of seconds the caller needs to wait before sending its request
+        """
+        if not self.rate:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0
+
+    def wait(self):
+        """
+        :return: the number of seconds spent waiting
+        """
+        wait_time = self._reserve()
+        if wait_time > 0:
+            time.sleep(wait_time)
+        return wait_time
+
+    async def wait_async(self):
+        import asyncio
+
+        wait_time = self._reserve()
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
+        return wait_time
+
+    def record_response(self, latency, status_code):
+        if not self.adaptive:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if is_failure(status_code) or latency > self.target_latency:
+                if self._decreased_at is None or now - self._decreased_at >= self.cooldown:
+                    self._decreased_at = now
+                    self.rate = max(self.min_rate, self.rate * self.decrease)
+                    logging.debug(f"Slowing down to {self.rate:.2f} requests per second")
+            else:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests for `reset_timeout` seconds after `failure_threshold` consecutive failed requests, so that
+    the callers fall back to the cache right away instead of waiting for the API to fail again. A request only fails
+    once it gave up retrying, and a request already being retried is never stopped. After that, a single request is
+    let through: the circuit is closed again if it succeeds and stays open for another `reset_timeout` otherwise.
+    A `failure_threshold` of 0 disables the breaker.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def allow(self):
+        """
+        :return: False if the request should not be sent
+        """
+        if not self.failure_threshold:
+            return True
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if not self._probing and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        if not self.failure_threshold:
+            return
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                if not self._probing:
+                    logging.warning(f"The API failed {self._failures} times in a row, pausing requests for "
+                                    f"{self.reset_timeout} seconds")
+                self._opened_at = time.monotonic()
+                self._probing = False
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Record/replay transports for `HttpSession`, and a generator of synthetic national-scale datasets.
+
+A transport is anything with the `request(method, url, data, headers, cookies, allow_redirects)` method of
+`requests.Session`, returning an object with `status_code`, `content`, `text` and `headers`. Responses are stored in a
+bundle: a JSON document with the date it was recorded on and the list of responses with their request. Requests for
+monthly availability depend on the current date, so they are matched by month offset from the recording date, and a
+bundle recorded on one day replays the same on any later day.
+"""
+import json
+import random
+import threading
+import time
+
+from calendar import monthrange
+from datetime import date, datetime, timedelta
+from urllib.parse import urlparse
+
+from .client import (COUNTIES_ENDPOINT, DATE_FORMAT, DAY_SLOTS_ENDPOINT, MONTHLY_AVAILABILITY_ENDPOINT,
+                     _centres_request, _day_slots_request, parse_date)
+
+
+def _request_key(method, url, data, today):
+    url = urlparse(url)
+    path = url.path + (f"?{url.query}" if url.query else "")
+    if isinstance(data, str):
+        data = json.loads(data)
+    if url.path == MONTHLY_AVAILABILITY_ENDPOINT and data:
+        current_date = parse_date(data["currentDate"])
+        data = dict(data, currentDate=(current_date.year - today.year) * 12 + current_date.month - today.month)
+    return json.dumps([method, path, data], sort_keys=True)
+
+
+def load_bundle(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_bundle(bundle, path):
+    with open(path, "w") as f:
+        json.dump(bundle, f)
+
+
+class TransportResponse:
+    def __init__(self, status_code, content, headers=None):
+        self.status_code = status_code
+        self.content = content
+        # Lower case names, as looked up by `HttpSession`
+        self.headers = {name.lower(): value for name, value in (headers or {}).items()}
+
+    @property
+    def text(self):
+        return self.content.decode()
+
+
+class RecordingTransport:
+    """
+    Sends the requests through `transport` (by default a new `requests.Session`) and records every response, the last
+    one winning for identical requests. Call `save` once done.
+    """
+
+    def __init__(self, transport=None):
+        if transport is None:
+            import requests
+
+            transport = requests.Session()
+        self.transport = transport
+        self.recorded_at = date.today()
+        self.responses = {}
+        self._lock = threading.Lock()
+
+    def request(self, method, url, data=None, headers=None, cookies=None, allow_redirects=False):
+        response = self.transport.request(method, url, data=data, headers=headers, cookies=cookies,
+                                          allow_redirects=allow_redirects)
+        key = _request_key(method, url, data, self.recorded_at)
+        with self._lock:
+            self.responses[key] = {"status": response.status_code, "body": response.text,
+                                   "headers": {name: response.headers[name] for name in ("location", "retry-after")
+                                               if name in response.headers}}
+        return response
+
+    def bundle(self):
+        with self._lock:
+            return {"recorded_at": self.recorded_at.isoformat(),
+                    "responses": [dict(zip(("method", "path", "data"), json.loads(key)), **response)
+                                  for key, response in self.responses.items()]}
+
+    def save(self, path):
+        save_bundle(self.bundle(), path)
+
+
+class ReplayTransport:
+    """
+    Serves the responses of a bundle, without any network access. Requests missing from the bundle get a 404.
+    :param latency: mean synthetic latency in seconds; every response takes between half of it and one and a half
+    :param error_rate: share of the requests answered with `error_status` instead of the recorded response
+    :param seed: seed of the latency and error draws
+    """
+
+    def __init__(self, bundle, latency=0, error_rate=0, error_status=503, seed=0):
+        self.responses = {}
+        for response in bundle["responses"]:
+            key = json.dumps([response["method"], response["path"], response["data"]], sort_keys=True)
+            self.responses[key] = (response["status"], response["body"].encode(), response.get("headers"))
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def request(self, method, url, data=None, headers=None, cookies=None, allow_redirects=False):
+        with self._lock:
+            self.requests += 1
+            latency = self.latency * (0.5 + self._random.random()) if self.latency else 0
+            failed = self.error_rate and self._random.random() < self.error_rate
+        if latency:
+            time.sleep(latency)
+        if failed:
+            return TransportResponse(self.error_status, b"{}")
+
+        key = _request_key(method, url, data, date.today())
+        status, body, response_headers = self.responses.get(key, (404, b"{}", None))
+        return TransportResponse(status, body, response_headers)
+
+
+def generate_dataset(centres=1200, counties=42, months=2, days_per_month=20, slots_per_day=12, seed=0, today=None):
+    """
+    Generates a bundle for a synthetic national-scale sweep: `centres` centres spread over `counties` counties, each
+    with `days_per_month` days with available places per month and `slots_per_day` slots per day, about half of which
+    are available.
+    :return: the bundle, to be served by `ReplayTransport`
+    """
+    rng = random.Random(seed)
+    today = today or date.today()
+    responses = []
+
+    def add(method, path, data, body):
+        key = json.loads(_request_key(method, path, data, today))
+        responses.append({"method": key[0], "path": key[1], "data": key[2], "status": 200, "body": json.dumps(body)})
+
+    add("GET", COUNTIES_ENDPOINT, None, [{"countyID": idx, "name": f"Județ {idx}"} for idx in range(counties)])
+
+    all_centres = [{"id": idx, "name": f"Centru {idx}", "countyID": idx % counties,
+                    "countyName": f"Județ {idx % counties}", "localityID": idx // 4,
+                    "localityName": f"Localitate {idx // 4}", "address": f"Strada {idx}, nr. 1",
+                    "availableSlots": 0}
+                   for idx in range(centres)]
+    page_size = 1000
+    for page in range(max(1, -(-centres // page_size))):
+        path, data = _centres_request(None, page, page_size)
+        add("POST", path, data, {"content": all_centres[page * page_size:(page + 1) * page_size],
+                                 "last": (page + 1) * page_size >= centres})
+
+    for centre in all_centres:
+        for month in range(months):
+            year, month_number = today.year + (today.month - 1 + month) // 12, (today.month - 1 + month) % 12 + 1
+            month_start = datetime(year, month_number, 1)
+            month_days = monthrange(year, month_number)[1]
+            days = sorted(rng.sample(range(month_days), min(days_per_month, month_days)))
+            days_available = []
+            for day in days:
+                day_start = (month_start + timedelta(days=day)).strftime(DATE_FORMAT)
+                slots = []
+                for idx in range(slots_per_day):
+                    slot_start = month_start + timedelta(days=day, hours=8, minutes=30 * idx)
+                    slots.append({"startTime": slot_start.strftime(DATE_FORMAT),
+                                  "endTime": (slot_start + timedelta(minutes=30)).strftime(DATE_FORMAT),
+                                  "availablePlaces": rng.choice((0, 1, 2))})
+                days_available.append({"startTime": day_start,
+                                       "availablePlaces": sum(slot["availablePlaces"] for slot in slots)})
+                add("POST", DAY_SLOTS_ENDPOINT, _day_slots_request(centre["id"], day_start), slots)
+            add("POST", MONTHLY_AVAILABILITY_ENDPOINT,
+                {"centerID": centre["id"], "currentDate": datetime(year, month_number, 1).strftime(DATE_FORMAT),
+                 "forBooster": False}, days_available)
+
+    return {"recorded_at": today.isoformat(), "responses": responses}
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import logging
+import math
+import pickle
+import time
+
+from .cache import SqliteStore
+
+SCHEDULE_FILE = "schedule.sqlite"
+
+
+class CentreStats:
+    """
+    What the scheduler knows about a centre: when it was last crawled, when its slots last changed and were last
+    non-empty, the number of crawls that found a change and the time they covered (both decaying over time), the
+    estimated number of requests of a crawl and the slots found by the last crawl
+    """
+    __slots__ = ("centre_id", "crawled_at", "changed_at", "available_at", "changes", "observed", "cost", "digest",
+                 "slots")
+
+    def __init__(self, centre_id, crawled_at=None, changed_at=None, available_at=None, changes=0, observed=0,
+                 cost=None, digest=None, slots=None):
+        self.centre_id = centre_id
+        self.crawled_at = crawled_at
+        self.changed_at = changed_at
+        self.available_at = available_at
+        self.changes = changes
+        self.observed = observed
+        self.cost = cost
+        self.digest = digest
+        self.slots = slots
+
+    @property
+    def volatility(self):
+        """
+        :return: the estimated number of changes per second
+        """
+        return self.changes / self.observed if self.observed else 0
+
+
+def _digest(slots):
+    return hashlib.sha1(json.dumps(slots, default=repr, sort_keys=True).encode()).hexdigest()
+
+
+class CrawlScheduler(SqliteStore):
+    """
+    Spends a fixed budget of requests per sweep on the centres whose slots most likely changed since they were last
+    crawled, and serves the other centres from the slots found by their last crawl.
+
+    The slots of a centre are assumed to change at a constant rate, its volatility: the number of crawls that found a
+    change divided by the time they covered, recent crawls weighing more. The probability that they changed since the
+    last crawl grows with its age, and centres are picked by that probability per request until the budget is spent.
+    Centres that were never crawled, or that would be older than `max_staleness` seconds by the next sweep (`interval`
+    seconds later), are always crawled, even past the budget. The statistics are kept in a SQLite database, so they
+    survive between runs.
+    """
+    # The weight of a crawl halves every day
+    half_life = 86400
+    # Before being observed, centres are assumed to change every hour; most of the centres without slots never get any,
+    # so they are assumed to change every day instead
+    initial_time_between_changes = 3600
+    initial_empty_time_between_changes = 86400
+    schema = (
+        "CREATE TABLE IF NOT EXISTS centres ("
+        "centre_id INTEGER PRIMARY KEY, crawled_at REAL NOT NULL, changed_at REAL, available_at REAL, "
+        "changes REAL NOT NULL, observed REAL NOT NULL, cost REAL NOT NULL, digest TEXT NOT NULL, slots BLOB NOT NULL)",
+    )
+
+    def __init__(self, path, budget, max_staleness=3600, interval=0):
+        super().__init__(path)
+        self.budget = budget
+        self.max_staleness = max_staleness
+        self.interval = interval
+        self._stats = None
+
+    @property
+    def stats(self):
+        """
+        :return: the `CentreStats` of every centre crawled so far, by centre ID
+        """
+        if self._stats is None:
+            self._stats = {row[0]: CentreStats(*row[:-1], slots=pickle.loads(row[-1]))
+                           for row in self._connection().execute(
+                               "SELECT centre_id, crawled_at, changed_at, available_at, changes, observed, cost, "
+                               "digest, slots FROM centres")}
+        return self._stats
+
+    @staticmethod
+    def change_probability(stats, now):
+        return 1 - math.exp(-stats.volatility * max(0.0, now - stats.crawled_at))
+
+    def plan(self, centres, months_to_check, now=None):
+        """
+        :return: the IDs of the centres to crawl in this sweep
+        """
+        now = now if now is not None else time.time()
+        selected = set()
+        spent = 0
+        candidates = []
+        for centre in centres:
+            stats = self.stats.get(centre["id"])
+            if stats is None or now + self.interval - stats.crawled_at >= self.max_staleness:
+                selected.add(centre["id"])
+                spent += stats.cost if stats else months_to_check
+            else:
+                candidates.append((self.change_probability(stats, now) / stats.cost, stats.available_at or 0, stats))
+        forced = len(selected)
+
+        candidates.sort(key=lambda candidate: (-candidate[0], -candidate[1]))
+        for score, _available_at, stats in candidates:
+            if score <= 0:
+                break
+            if spent + stats.cost <= self.budget:
+                selected.add(stats.centre_id)
+                spent += stats.cost
+        logging.info(f"Crawling {len(selected)} of {len(centres)} centres ({forced} new or stale), about {spent:.0f} "
+                     f"requests")
+        return selected
+
+    def record(self, centre_id, slots, months_to_check, now=None):
+        """
+        Updates the statistics of a centre with the slots found by crawling it
+        :return: True if the slots changed since the last crawl
+        """
+        now = now if now is not None else time.time()
+        digest = _digest(slots)
+        # Every crawl requests the availability of every month, and the slots of every day with available places
+        cost = months_to_check + len({slot["startTime"].date() for slot in slots})
+        stats = self.stats.get(centre_id)
+        if stats is None:
+            stats = self.stats[centre_id] = CentreStats(
+                centre_id, changes=1,
+                observed=self.initial_time_between_changes if slots else self.initial_empty_time_between_changes)
+            changed = True
+        else:
+            changed = digest != stats.digest
+            elapsed = max(0.0, now - stats.crawled_at)
+            decay = 0.5 ** (elapsed / self.half_life)
+            stats.changes = stats.changes * decay + changed
+            stats.observed = stats.observed * decay + elapsed
+        stats.crawled_at = now
+        stats.cost = cost
+        stats.slots = slots
+        stats.digest = digest
+        if changed:
+            stats.changed_at = now
+        if slots:
+            stats.available_at = now
+        return changed
+
+    def save(self, centre_ids):
+        rows = [(stats.centre_id, stats.crawled_at, stats.changed_at, stats.available_at, stats.changes,
+                 stats.observed, stats.cost, stats.digest, pickle.dumps(stats.slots, pickle.HIGHEST_PROTOCOL))
+                for stats in (self.stats[centre_id] for centre_id in centre_ids)]
+        with self.transaction() as connection:
+            connection.executemany("INSERT OR REPLACE INTO centres VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def crawl(self, client, centres, months_to_check, now=None):
+        """
+        Crawls the centres picked by `plan` with `client.crawl_centres`, and serves the other ones from their last crawl
+        :return: (centre, slot) pairs for all the centres, in the order of `centres`
+        """
+        centres = list(centres)
+        now = now if now is not None else time.time()
+        selected = self.plan(centres, months_to_check, now)
+        crawled = []
+        pairs = iter(client.crawl_centres([centre for centre in centres if centre["id"] in selected], months_to_check))
+        pending = None
+        try:
+            for centre in centres:
+                if centre["id"] not in selected:
+                    for slot in self.stats[centre["id"]].slots:
+                        yield centre, slot
+                    continue
+
+                # `crawl_centres` keeps the order of the centres and skips the ones without slots, so the slots of a
+                # centre end with the first pair of another centre
+                slots = []
+                while True:
+                    if pending is None:
+                        pending = next(pairs, None)
+                    if pending is None or pending[0]["id"] != centre["id"]:
+                        break
+                    slots.append(pending[1])
+                    pending = None
+                self.record(centre["id"], slots, months_to_check, now)
+                crawled.append(centre["id"])
+                for slot in slots:
+                    yield centre, slot
+        finally:
+            if crawled:
+                self.save(crawled)
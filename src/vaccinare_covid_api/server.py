@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+import csv
+import gzip
+import hashlib
+import io
+import json
+import logging
+import threading
+import time
+
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from .catalogue import _normalize
+
+CONTENT_TYPES = {"csv": "text/csv; charset=utf-8", "json": "application/json; charset=utf-8",
+                 "ndjson": "application/x-ndjson; charset=utf-8"}
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+MIN_GZIP_SIZE = 1024
+
+
+def accepts_encoding(accept_encoding, coding):
+    """
+    :param accept_encoding: the value of an Accept-Encoding header, e.g. "gzip;q=0.8, br"
+    :return: True if `coding`, or "*", is listed with a non-zero q-value
+    """
+    qualities = {}
+    for item in accept_encoding.split(","):
+        name, *params = [part.strip() for part in item.split(";")]
+        if not name:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.lower()] = quality
+    return qualities.get(coding, qualities.get("*", 0)) > 0
+
+
+class AvailabilityIndex:
+    """
+    Immutable in-memory copy of the records of a sweep, indexed by county, locality and date. Counties and localities
+    can be looked up either by ID or by name (case insensitive), dates as YYYY-MM-DD. Rendered responses are kept
+    in a small LRU, since most readers poll the same queries.
+    """
+    max_rendered = 256
+
+    def __init__(self, records, crawled_at=None):
+        self.records = records
+        self.crawled_at = crawled_at if crawled_at is not None else time.time()
+        self.version = hashlib.sha1(json.dumps(records, default=str).encode()).hexdigest()[:16]
+        by_county = defaultdict(list)
+        by_locality = defaultdict(list)
+        by_date = defaultdict(list)
+        for position, record in enumerate(records):
+            centre = record["centre"]
+            for key in {_normalize(centre.get("countyID")), _normalize(centre.get("countyName"))}:
+                by_county[key].append(position)
+            for key in {_normalize(centre.get("localityID")), _normalize(centre.get("localityName"))}:
+                by_locality[key].append(position)
+            by_date[record["slot"]["startTime"].date().isoformat()].append(position)
+        self.indexes = {"county": dict(by_county), "locality": dict(by_locality), "date": dict(by_date)}
+        self._rendered_lock = threading.Lock()
+        self._rendered = OrderedDict()
+
+    def find(self, filters):
+        """
+        :param filters: lists of values by index name; the values of a filter are alternatives
+        :return: the matching records, in the order of the sweep
+        """
+        candidates = None
+        for name, values in filters.items():
+            index = self.indexes[name]
+            positions = set()
+            for value in values:
+                positions.update(index.get(_normalize(value), ()))
+            candidates = positions if candidates is None else candidates & positions
+        if candidates is None:
+            return self.records
+        return [self.records[position] for position in sorted(candidates)]
+
+    def get_rendered(self, key, render):
+        with self._rendered_lock:
+            if key in self._rendered:
+                self._rendered.move_to_end(key)
+                return self._rendered[key]
+        rendered = render()
+        with self._rendered_lock:
+            self._rendered[key] = rendered
+            while len(self._rendered) > self.max_rendered:
+                self._rendered.popitem(last=False)
+        return rendered
+
+
+class AvailabilityRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} - {format % args}")
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/health":
+            index = self.server.index
+            self._send(200, CONTENT_TYPES["json"], json.dumps({
+                "ready": index is not None,
+                "crawled_at": datetime.fromtimestamp(index.crawled_at).isoformat() if index else None,
+                "records": len(index.records) if index else 0}).encode())
+        elif url.path == "/slots":
+            self._get_slots(parse_qs(url.query))
+        else:
+            self._send(404, CONTENT_TYPES["json"], b'{"error": "Not found"}')
+
+    def _get_slots(self, query):
+        index = self.server.index
+        if index is None:
+            self._send(503, CONTENT_TYPES["json"], b'{"error": "The first sweep is not done yet"}',
+                       {"Retry-After": "10"})
+            return
+
+        try:
+            output_format = query.get("format", ["json"])[0]
+            if output_format not in self.server.formats:
+                raise ValueError(f"Invalid format: {output_format}")
+            page = int(query.get("page", ["0"])[0])
+            size = min(int(query.get("size", [str(DEFAULT_PAGE_SIZE)])[0]), MAX_PAGE_SIZE)
+            if page < 0 or size <= 0:
+                raise ValueError("Invalid page")
+        except ValueError as e:
+            self._send(400, CONTENT_TYPES["json"], json.dumps({"error": str(e)}).encode())
+            return
+        filters = {name: sorted(query[name]) for name in ("county", "locality", "date") if name in query}
+
+        # The ETag only depends on the content of the sweep and on the query, so it does not change between sweeps
+        # that found the same slots
+        gzipped = accepts_encoding(self.headers.get("accept-encoding", ""), "gzip")
+        query_key = json.dumps([output_format, filters, page, size, gzipped])
+        etag = f'"{index.version}-{hashlib.md5(query_key.encode()).hexdigest()[:16]}"'
+        if_none_match = {tag.strip() for tag in self.headers.get("if-none-match", "").split(",")}
+        if etag in if_none_match or f"W/{etag}" in if_none_match:
+            self._send(304, None, b"", {"ETag": etag})
+            return
+
+        body, total, content_encoding = index.get_rendered(query_key, lambda: self._render(
+            index, output_format, filters, page, size, gzipped))
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding", "X-Total-Count": str(total)}
+        if (page + 1) * size < total:
+            headers["Link"] = f'<{self._page_url(output_format, filters, page + 1, size)}>; rel="next"'
+        if content_encoding:
+            headers["Content-Encoding"] = content_encoding
+        self._send(200, CONTENT_TYPES[output_format.split("_")[0]], body, headers)
+
+    def _render(self, index, output_format, filters, page, size, gzipped):
+        if output_format[0:3] == "csv":
+            # The CSV formats merge the records of a row (e.g. all the slots of a centre with csv_by_centre), so the
+            # pages are cut from the output rows rather than from the records. The rows are rendered once for all the
+            # pages of a query
+            rows = index.get_rendered(json.dumps(["rows", output_format, filters]), lambda: list(
+                csv.reader(io.StringIO(self._format(output_format, index.find(filters))))))
+            total = len(rows) - 1
+            file = io.StringIO()
+            csv.writer(file).writerows(rows[:1] + rows[1 + page * size:1 + (page + 1) * size])
+            body = file.getvalue().encode()
+        else:
+            records = index.find(filters)
+            total = len(records)
+            body = self._format(output_format, records[page * size:(page + 1) * size]).encode()
+        # Small bodies are not worth compressing
+        if gzipped and len(body) >= MIN_GZIP_SIZE:
+            return gzip.compress(body, compresslevel=6), total, "gzip"
+        return body, total, None
+
+    def _format(self, output_format, records):
+        file = io.StringIO()
+        writer = self.server.create_formatter(output_format, file, self.server.formats[output_format])
+        writer.start()
+        for record in records:
+            writer.write(record)
+        writer.end()
+        return file.getvalue()
+
+    @staticmethod
+    def _page_url(output_format, filters, page, size):
+        params = [("format", output_format), ("page", page), ("size", size)]
+        params += [(name, value) for name, values in filters.items() for value in values]
+        return "/slots?" + urlencode(params)
+
+    def _send(self, status, content_type, body, headers=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class AvailabilityServer(ThreadingHTTPServer):
+    """
+    Serves the latest sweep from memory as JSON, NDJSON or CSV:
+    - GET /slots?county=...&locality=...&date=YYYY-MM-DD&format=json&page=0&size=1000; every filter can be repeated,
+      and the pages of the CSV formats count their rows rather than the slots
+    - GET /health
+    Readers never trigger calls to the API: `update` replaces the index once a new sweep is complete, while the
+    requests in progress keep using the previous one.
+    :param formats: output headers by format name, see `AVAILABLE_SLOTS_FORMATS`
+    :param create_formatter: `create_formatter(output_format, file, header)`, returning a formatter
+    """
+    daemon_threads = True
+
+    def __init__(self, address, formats, create_formatter):
+        super().__init__(address, AvailabilityRequestHandler)
+        self.formats = {name: header for name, header in formats.items() if name.split("_")[0] in CONTENT_TYPES}
+        self.create_formatter = create_formatter
+        self.index = None
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def update(self, records, crawled_at=None):
+        self.index = AvailabilityIndex(records, crawled_at)
+        logging.info(f"Serving {len(records)} slots")
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Sharded crawls: the centres are split by county across several processes, or across several hosts with a shard index
+and count. Every shard writes the slots of its centres to a run file, and the run files are merged back into the
+order of the centres, so that the output is the same as the one of a single process crawl.
+
+A run file is a sequence of pickled (position of the centre, centre, slots of the centre) items, sorted by position.
+"""
+import heapq
+import logging
+import os
+import pickle
+import tempfile
+
+from collections import Counter
+
+
+def _county_key(centre):
+    county = centre.get("countyID")
+    return str(county if county is not None else centre.get("countyName"))
+
+
+def assign_counties(centres, shard_count):
+    """
+    Assigns every county to a shard, the counties with most centres first, each one to the shard with the fewest
+    centres so far. The assignment only depends on the list of centres, so every host computes the same one.
+    :return: the shard of every county, by county key
+    """
+    counts = Counter(_county_key(centre) for centre in centres)
+    loads = [0] * shard_count
+    shards = {}
+    for county, count in sorted(counts.items(), key=lambda item: (-item[1], item[0])):
+        shard = loads.index(min(loads))
+        shards[county] = shard
+        loads[shard] += count
+    return shards
+
+
+def split_centres(indexed_centres, shard_count):
+    """
+    :param indexed_centres: (position, centre) pairs
+    :return: the (position, centre) pairs of every shard, in the original order
+    """
+    indexed_centres = list(indexed_centres)
+    shards = assign_counties([centre for _position, centre in indexed_centres], shard_count)
+    split = [[] for _ in range(shard_count)]
+    for position, centre in indexed_centres:
+        split[shards[_county_key(centre)]].append((position, centre))
+    return split
+
+
+def select_shard(centres, shard_index, shard_count):
+    """
+    :return: the (position, centre) pairs of the centres of a shard, positions being the ones in `centres`
+    """
+    return split_centres(enumerate(centres), shard_count)[shard_index]
+
+
+def write_run(pairs, positions, file):
+    """
+    Writes the (centre, slot) pairs of a crawl to a run file, one item per centre
+    :param positions: the position of every centre, by centre ID
+    """
+    centre, slots = None, []
+    for pair_centre, slot in pairs:
+        if centre is not None and pair_centre["id"] != centre["id"]:
+            pickle.dump((positions[centre["id"]], centre, slots), file, pickle.HIGHEST_PROTOCOL)
+            slots = []
+        centre = pair_centre
+        slots.append(slot)
+    if centre is not None:
+        pickle.dump((positions[centre["id"]], centre, slots), file, pickle.HIGHEST_PROTOCOL)
+
+
+def read_run(path):
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def merge_runs(paths):
+    """
+    k-way merge of run files
+    :return: (centre, slot) pairs, in the order of the centres
+    """
+    for _position, centre, slots in heapq.merge(*[read_run(path) for path in paths], key=lambda item: item[0]):
+        for slot in slots:
+            yield centre, slot
+
+
+def crawl_shard(create_client, indexed_centres, months_to_check, run_path):
+    """
+    Crawls the centres of a shard into a run file. Runs in a worker process, with its own client.
+    :param create_client: function without arguments returning a `VaccinareCovidApi`; it needs to be picklable
+    :return: the `summary` of the metrics of the client
+    """
+    client = create_client()
+    positions = {centre["id"]: position for position, centre in indexed_centres}
+    with open(run_path, "wb") as run:
+        write_run(client.crawl_centres([centre for _position, centre in indexed_centres], months_to_check),
+                  positions, run)
+    return client.metrics.summary()
+
+
+def sharded_crawl(create_client, centres, months_to_check, processes, directory=None, metrics=None):
+    """
+    Crawls the centres in `processes` worker processes, each one crawling whole counties
+    :param metrics: `CrawlMetrics` the statistics of the workers are added to
+    :return: (centre, slot) pairs, in the order of `centres`
+    """
+    import multiprocessing
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    shards = [shard for shard in split_centres(enumerate(centres), processes) if shard]
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=directory, prefix=".runs-") as run_directory:
+        run_paths = [os.path.join(run_directory, f"{idx}.run") for idx in range(len(shards))]
+        # Workers are spawned rather than forked, so they do not inherit the connections and locks of this process
+        with ProcessPoolExecutor(max_workers=len(shards) or 1,
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = [executor.submit(crawl_shard, create_client, shard, months_to_check, run_path)
+                       for shard, run_path in zip(shards, run_paths)]
+            for idx, (shard, future) in enumerate(zip(shards, futures)):
+                summary = future.result()
+                logging.info(f"Shard {idx}: {len(shard)} centres crawled with {sum(summary['requests'].values())} "
+                             f"requests")
+                if metrics is not None:
+                    metrics.merge(summary)
+        yield from merge_runs(run_paths)
@@ -1,20 +1,61 @@
 #!/usr/bin/env python3
+import hashlib
+import json
 import logging
 import pickle
 import os.path
+import tempfile
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
 from googleapiclient.discovery import build
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.http import MediaFileUpload
 
+from .compression import COMPRESSION_MIMETYPES, compression_for_path, decompress_file, uncompressed_path
+
 # https://github.com/googleapis/google-api-python-client/issues/299
 logging.getLogger('googleapiclient.discovery_cache').setLevel(logging.ERROR)
 
 SCOPES = ["https://www.googleapis.com/auth/drive.file"]
+GOOGLE_APPS_MIMETYPE_PREFIX = "application/vnd.google-apps."
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 
 class GoogleDriveUploader:
-    def __init__(self, token_path="var/token.pickle", credentials_path="var/credentials.json"):
+    """
+    Uploads files to Google Drive, replacing the file with the same name if there is one.
+
+    The id, mime type and content hash of every uploaded file are kept in a local index (`index_path`), so a file is
+    only looked up in Drive the first time it is uploaded and is not uploaded again while its content is unchanged.
+    A `service` can be passed instead of the credentials, e.g. a local fake for tests.
+
+    Compressed files (see `compression`) are uploaded as they are, unless they need to be converted to a Google Docs
+    format, which Drive only does for uncompressed files; they are then decompressed to a temporary file first.
+    """
+
+    def __init__(self, token_path="var/token.pickle", credentials_path="var/credentials.json",
+                 index_path="var/gdrive_index.json", service=None, upload_workers=4):
+        self.index_path = index_path
+        self._executor = ThreadPoolExecutor(max_workers=upload_workers)
+        self._index_lock = threading.Lock()
+        self._index = self._load_index()
+        self._service = service
+        self._local = threading.local()
+        self._credentials = None
+        if service is None:
+            self._credentials = self._get_credentials(token_path, credentials_path)
+
+    @staticmethod
+    def _get_credentials(token_path, credentials_path):
         creds = None
         # The file token.pickle stores the user's access and refresh tokens, and is
         # created automatically when the authorization flow completes for the first
@@ -33,34 +74,107 @@ class GoogleDriveUploader:
             # Save the credentials for the next run
             with open(token_path, "wb") as token:
                 pickle.dump(creds, token)
-        self.service = build("drive", "v3", credentials=creds)
+        return creds
+
+    @property
+    def service(self):
+        if self._service is not None:
+            return self._service
+        # Drive services are not thread safe, so every thread uploading files builds its own
+        service = getattr(self._local, "service", None)
+        if service is None:
+            service = self._local.service = build("drive", "v3", credentials=self._credentials)
+        return service
+
+    def _load_index(self):
+        if self.index_path and os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                return json.load(f)
+        return {}
+
+    def _update_index(self, remote_file_name, entry):
+        with self._index_lock:
+            if entry is None:
+                self._index.pop(remote_file_name, None)
+            else:
+                self._index[remote_file_name] = entry
+            if not self.index_path:
+                return
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.index_path) or ".", prefix=".tmp-")
+            with os.fdopen(fd, "w") as f:
+                json.dump(self._index, f, indent=4)
+            os.replace(temp_path, self.index_path)
+
+    def _find_file(self, remote_file_name):
+        escaped_name = remote_file_name.replace("\\", "\\\\").replace("'", "\\'")
+        page_token = None
+        while True:
+            results = self.service.files().list(q=f"name = '{escaped_name}' and trashed = false",
+                                                fields="nextPageToken, files(id, name, mimeType)",
+                                                pageToken=page_token).execute()
+            for item in results.get("files", []):
+                if item["name"] == remote_file_name:
+                    return item
+            page_token = results.get("nextPageToken")
+            if not page_token:
+                return None
 
     def upload(self, local_file_path, remote_file_name, src_mimetype=None, dest_mimetype=None):
-        results = self.service.files().list(pageSize=10, fields="nextPageToken, files(id, name)").execute()
-        items = results.get("files", [])
-
-        file_id = None
-        for item in items:
-            if item["name"] == remote_file_name:
-                file_id = item["id"]
-                break
-
-        if not file_id:
-            file_metadata = {
-                "name": remote_file_name,
-                "mimeType": dest_mimetype
-            }
-
-            media = MediaFileUpload(local_file_path,
-                                    mimetype=src_mimetype,
-                                    resumable=True)
-
-            self.service.files().create(body=file_metadata,
-                                        media_body=media,
-                                        fields="id").execute()
-        else:
-            file = self.service.files().get(fileId=file_id).execute()
-            media_body = MediaFileUpload(local_file_path, mimetype=file["mimeType"], resumable=True)
-            self.service.files().update(
-                fileId=file_id,
-                media_body=media_body).execute()
+        """
+        :return: False if the upload was skipped because the content did not change since the last upload
+        """
+        compression = compression_for_path(local_file_path)
+        if compression and (dest_mimetype or "").startswith(GOOGLE_APPS_MIMETYPE_PREFIX):
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, os.path.basename(uncompressed_path(local_file_path)))
+                decompress_file(local_file_path, path)
+                return self.upload(path, remote_file_name, src_mimetype, dest_mimetype)
+        if compression:
+            src_mimetype = COMPRESSION_MIMETYPES[compression]
+
+        content_hash = _file_hash(local_file_path)
+        entry = self._index.get(remote_file_name)
+        if entry and entry.get("hash") == content_hash:
+            logging.info(f"{remote_file_name} did not change, skipping the upload")
+            return False
+
+        if not entry:
+            entry = self._find_file(remote_file_name)
+
+        if entry:
+            try:
+                media_body = MediaFileUpload(local_file_path, mimetype=entry["mimeType"], resumable=True)
+                self.service.files().update(fileId=entry["id"], media_body=media_body).execute()
+                self._update_index(remote_file_name, {"id": entry["id"], "mimeType": entry["mimeType"],
+                                                      "hash": content_hash})
+                return True
+            except Exception as e:
+                if getattr(getattr(e, "resp", None), "status", None) != 404:
+                    raise
+                # The file was deleted from Drive since it was indexed
+                self._update_index(remote_file_name, None)
+
+        file_metadata = {
+            "name": remote_file_name,
+            "mimeType": dest_mimetype
+        }
+
+        media = MediaFileUpload(local_file_path,
+                                mimetype=src_mimetype,
+                                resumable=True)
+
+        file = self.service.files().create(body=file_metadata,
+                                           media_body=media,
+                                           fields="id, mimeType").execute()
+        self._update_index(remote_file_name, {"id": file["id"], "mimeType": file.get("mimeType", dest_mimetype),
+                                              "hash": content_hash})
+        return True
+
+    def upload_many(self, uploads):
+        """
+        Uploads several files concurrently. The upload threads, and their Drive services, are kept for the next calls.
+        :param uploads: list of (local_file_path, remote_file_name, src_mimetype, dest_mimetype) tuples
+        :return: the result of `upload` for every file
+        """
+        futures = [self._executor.submit(self.upload, *upload) for upload in uploads]
+        return [future.result() for future in futures]
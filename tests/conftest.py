@@ -0,0 +1,117 @@
+import json
+import threading
+import time
+
+from argparse import Namespace
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from vaccinare_covid_api.client import (CENTRES_ENDPOINT, COUNTIES_ENDPOINT, DATE_FORMAT, DAY_SLOTS_ENDPOINT,
+                                        MONTHLY_AVAILABILITY_ENDPOINT)
+
+
+class StandInApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+        super().handle()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._respond(None)
+
+    def do_POST(self):
+        length = int(self.headers.get("content-length") or 0)
+        self._respond(json.loads(self.rfile.read(length)) if length else None)
+
+    def _respond(self, data):
+        server = self.server
+        url = urlparse(self.path)
+        with server.lock:
+            server.requests.append((self.command, url.path, data))
+            status = server.statuses.pop(0) if server.statuses else 200
+        if server.latency:
+            time.sleep(server.latency)
+
+        if url.path == COUNTIES_ENDPOINT:
+            body = [{"countyID": 1, "name": "Alba"}]
+        elif url.path == CENTRES_ENDPOINT:
+            query = parse_qs(url.query)
+            page, size = int(query["page"][0]), int(query["size"][0])
+            body = {"content": server.centres[page * size:(page + 1) * size],
+                    "last": (page + 1) * size >= len(server.centres)}
+        elif url.path == MONTHLY_AVAILABILITY_ENDPOINT:
+            start = datetime.strptime(data["currentDate"], DATE_FORMAT)
+            body = [{"startTime": (start + timedelta(days=day)).strftime(DATE_FORMAT),
+                     "availablePlaces": (data["centerID"] + day) % 2} for day in range(3)]
+        elif url.path == DAY_SLOTS_ENDPOINT:
+            start = datetime.strptime(data["currentDate"], DATE_FORMAT).replace(hour=9)
+            body = [{"startTime": (start + timedelta(hours=hour)).strftime(DATE_FORMAT),
+                     "endTime": (start + timedelta(hours=hour + 1)).strftime(DATE_FORMAT),
+                     "availablePlaces": hour % 2} for hour in range(4)]
+        else:
+            status, body = 404, {}
+
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class StandInApiServer(ThreadingHTTPServer):
+    """
+    Local stand-in for programare.vaccinare-covid.gov.ro. Counts the TCP connections and the requests it receives and
+    can return a given list of status codes before responding normally.
+    """
+    daemon_threads = True
+
+    def __init__(self, centres=None, latency=0):
+        super().__init__(("127.0.0.1", 0), StandInApiHandler)
+        self.lock = threading.Lock()
+        self.centres = centres if centres is not None else [
+            {"id": idx, "name": f"Centru {idx}", "countyName": "Alba", "localityName": "Aiud"} for idx in range(20)]
+        self.latency = latency
+        self.statuses = []
+        self.requests = []
+        self.connections = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+@pytest.fixture
+def stand_in_server():
+    server = StandInApiServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def slots_args():
+    """
+    :return: a function returning the arguments of `get-available-slots`, the defaults of the CLI overridden by its
+             keyword arguments
+    """
+    def create(**kwargs):
+        return Namespace(**{"format": None, "file": None, "months": 1, "grouped": False, "max_groups": None,
+                            "upload_to_gdrive": False, "gdrive_document_title": None, "default_format": "csv",
+                            "default_gdrive_document_title": None, "county": None, "locality": None,
+                            "centre_id": None, "history": False, "processes": 1,
+                            "shard_index": 0, "shard_count": 1, "run_file": None, "request_budget": None,
+                            "max_centre_staleness": 3600, "interval": 0, **kwargs})
+
+    return create
@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+import pytest
+
+from vaccinare_covid_api.aio import AsyncVaccinareCovidApi
+from vaccinare_covid_api.client import VaccinareCovidApi, WEB_LOGIN_URL
+
+
+async def crawl_async(url, **kwargs):
+    async with AsyncVaccinareCovidApi(session_token="token", api_url=url, **kwargs) as client:
+        return [(centre, slot) async for centre, slot in client.get_available_slots_for_all_centres(1)]
+
+
+def test_async_crawl_reuses_connections(stand_in_server):
+    stand_in_server.latency = 0.01
+    started_at = time.monotonic()
+    expected = list(VaccinareCovidApi(session_token="token", api_url=stand_in_server.url)
+                    .get_available_slots_for_all_centres(1))
+    sync_elapsed = time.monotonic() - started_at
+    sync_connections = stand_in_server.connections
+
+    stand_in_server.connections = 0
+    started_at = time.monotonic()
+    results = asyncio.run(crawl_async(stand_in_server.url, workers=10, connections_per_host=4))
+    async_elapsed = time.monotonic() - started_at
+
+    assert results == expected
+    assert sync_connections == 1
+    assert stand_in_server.connections <= 4
+    assert async_elapsed < sync_elapsed / 2
+
+
+def test_async_request_retries_and_detects_login_redirect(stand_in_server):
+    async def get_counties(**kwargs):
+        async with AsyncVaccinareCovidApi(session_token="token", api_url=stand_in_server.url, **kwargs) as client:
+            return await client.get_counties()
+
+    stand_in_server.statuses = [500]
+    assert asyncio.run(get_counties(max_retries=1)) == [{"countyID": 1, "name": "Alba"}]
+
+    stand_in_server.statuses = [500]
+    with pytest.raises(Exception, match="failed after 1 retries"):
+        asyncio.run(get_counties())
+
+    original_send_response = stand_in_server.RequestHandlerClass.send_response
+
+    def redirect_to_login(handler, code, message=None):
+        original_send_response(handler, 302, message)
+        handler.send_header("location", WEB_LOGIN_URL)
+
+    stand_in_server.RequestHandlerClass.send_response = redirect_to_login
+    try:
+        with pytest.raises(Exception, match="session token"):
+            asyncio.run(get_counties())
+    finally:
+        stand_in_server.RequestHandlerClass.send_response = original_send_response
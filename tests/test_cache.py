@@ -0,0 +1,86 @@
+import json
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from vaccinare_covid_api.cache import FileCache, SqliteCache, create_cache
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "files"])
+def test_cache_respects_lifetime(tmp_path, backend):
+    cache = create_cache(backend, str(tmp_path))
+    cache.put("0" * 32, '{"a": 1}')
+
+    assert cache.get("0" * 32, 60) == '{"a": 1}'
+    assert cache.get("1" * 32, 60) is None
+    time.sleep(0.01)
+    assert cache.get("0" * 32, 0) is None
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "files"])
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_compressed_cache_reads_every_entry(tmp_path, backend, compression):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    body = json.dumps([{"id": idx, "name": "Centru", "countyName": "Alba"} for idx in range(100)])
+    create_cache(backend, str(tmp_path)).put("0" * 32, body)
+    cache = create_cache(backend, str(tmp_path), compression=compression)
+    cache.put("1" * 32, body)
+
+    assert cache.get("0" * 32, 60) == body
+    assert cache.get("1" * 32, 60) == body
+    if backend == "files":
+        assert os.path.getsize(tmp_path / ("1" * 32)) < len(body) / 10
+
+
+@pytest.mark.parametrize("backend", [SqliteCache, FileCache])
+def test_cache_evicts_expired_and_oldest_entries(tmp_path, backend):
+    path = str(tmp_path / "cache.sqlite") if backend is SqliteCache else str(tmp_path)
+    cache = backend(path, max_age=60, max_size=25)
+    now = time.time()
+    for idx in range(4):
+        key = f"{idx:032x}"
+        cache.put(key, "x" * 10)
+        stored_at = now - 120 if idx == 0 else now - 10 + idx
+        if backend is SqliteCache:
+            cache._connection().execute("UPDATE responses SET stored_at = ? WHERE key = ?", (stored_at, key))
+        else:
+            os.utime(os.path.join(path, key), (stored_at, stored_at))
+
+    cache.evict()
+
+    assert [cache.get(f"{idx:032x}", 3600) for idx in range(4)] == [None, None, "x" * 10, "x" * 10]
+
+
+def _write_entries(path, worker):
+    cache = SqliteCache(path)
+    for idx in range(50):
+        cache.put(f"{worker}-{idx}", str(idx) * 100)
+
+
+def test_sqlite_cache_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    processes = [multiprocessing.Process(target=_write_entries, args=(path, worker)) for worker in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    cache = SqliteCache(path)
+    assert all(process.exitcode == 0 for process in processes)
+    assert cache.get("3-49", 60) == "49" * 100
+    assert cache._connection().execute("SELECT COUNT(*) FROM responses").fetchone()[0] == 200
+
+
+def test_sqlite_transaction_is_rolled_back_on_error(tmp_path):
+    cache = SqliteCache(str(tmp_path / "cache.sqlite"))
+    with pytest.raises(ValueError):
+        with cache.transaction() as connection:
+            connection.execute("INSERT INTO responses (key, stored_at, size, body) VALUES ('a', 0, 1, 'a')")
+            raise ValueError()
+    with cache.transaction(immediate=True) as connection:
+        connection.execute("INSERT INTO responses (key, stored_at, size, body) VALUES ('b', 0, 1, 'b')")
+
+    assert cache._connection().execute("SELECT key FROM responses").fetchall() == [("b",)]
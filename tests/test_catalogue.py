@@ -0,0 +1,60 @@
+from vaccinare_covid_api.catalogue import CentreCatalogue
+from vaccinare_covid_api.client import VaccinareCovidApi
+
+CENTRES = [
+    {"id": 1, "name": "Centru 1", "countyID": 1, "countyName": "Alba", "localityID": 10, "localityName": "Aiud"},
+    {"id": 2, "name": "Centru 2", "countyID": 2, "countyName": "Arad", "localityID": 20, "localityName": "Arad"},
+    {"id": 3, "name": "Centru 3", "countyID": 1, "countyName": "Alba", "localityID": 11, "localityName": "Blaj"},
+]
+
+
+def test_catalogue_finds_centres_by_county_locality_and_id(tmp_path):
+    catalogue = CentreCatalogue(str(tmp_path / "centres.json")).load(lambda: CENTRES)
+
+    assert [centre["id"] for centre in catalogue.find(counties=["alba"])] == [1, 3]
+    assert [centre["id"] for centre in catalogue.find(counties=["1"], localities=["Blaj"])] == [3]
+    assert [centre["id"] for centre in catalogue.find(localities=["20", "aiud"])] == [1, 2]
+    assert [centre["id"] for centre in catalogue.find(centre_ids=["2"])] == [2]
+    assert [centre["id"] for centre in catalogue.find()] == [1, 2, 3]
+
+
+def test_catalogue_is_reused_until_it_expires(tmp_path):
+    fetches = []
+
+    def fetch_centres():
+        fetches.append(1)
+        return CENTRES
+
+    CentreCatalogue(str(tmp_path / "centres.json")).load(fetch_centres)
+    assert len(CentreCatalogue(str(tmp_path / "centres.json")).load(fetch_centres).centres) == 3
+    assert len(fetches) == 1
+
+    CentreCatalogue(str(tmp_path / "centres.json"), lifetime=-1).load(fetch_centres)
+    assert len(fetches) == 2
+
+
+def test_filtered_sweep_only_requests_matching_centres(stand_in_server, tmp_path):
+    stand_in_server.centres = [dict(centre, id=idx, countyName="Alba" if idx % 2 else "Arad")
+                               for idx, centre in enumerate(stand_in_server.centres)]
+    catalogue = CentreCatalogue(str(tmp_path / "centres.json"))
+    client = VaccinareCovidApi(session_token="token", api_url=stand_in_server.url, catalogue=catalogue,
+                               memo_lifetime=0)
+
+    list(client.get_available_slots_for_all_centres(1, counties=["Arad"]))
+    list(client.get_available_slots_for_all_centres(1, counties=["Arad"], centre_ids=["4"]))
+
+    centre_requests = [path for _method, path, _data in stand_in_server.requests if "/centres" in path]
+    requested_ids = [data["centerID"] for _method, path, data in stand_in_server.requests if "month" in path]
+    assert len(centre_requests) == 1
+    assert requested_ids == [0, 2, 4, 6, 8, 10, 12, 14, 16, 18, 4]
+
+
+def test_listed_centres_are_not_served_from_the_catalogue(stand_in_server, tmp_path):
+    catalogue = CentreCatalogue(str(tmp_path / "centres.json"))
+    client = VaccinareCovidApi(session_token="token", api_url=stand_in_server.url, catalogue=catalogue,
+                               memo_lifetime=0)
+
+    list(client.find_centres())
+    list(client.find_centres(use_catalogue=False))
+
+    assert len([path for _method, path, _data in stand_in_server.requests if "/centres" in path]) == 2
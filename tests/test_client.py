@@ -0,0 +1,150 @@
+import json
+import pickle
+import random
+import time
+
+from datetime import datetime
+
+from vaccinare_covid_api.__main__ import get_available_slots
+from vaccinare_covid_api.client import DATE_FORMAT, DAY_SLOTS_ENDPOINT, Slot, VaccinareCovidApi, parse_date
+from vaccinare_covid_api.incremental import AvailabilitySnapshot
+from vaccinare_covid_api.ratelimit import CircuitBreaker, RateLimiter
+
+
+class FakeApi(VaccinareCovidApi):
+    def __init__(self, centres, workers):
+        super().__init__(workers=workers)
+        self.centres = centres
+
+    def get_centres(self, county_id=None, page=0, page_size=1000, recursive=True):
+        yield from self.centres
+
+    def get_available_slots(self, centre_id, months_to_check):
+        time.sleep(random.random() / 100)
+        for idx in range(centre_id % 3):
+            yield {"id": f"{centre_id}-{idx}"}
+
+
+def test_concurrent_crawl_keeps_centre_order():
+    centres = [{"id": idx} for idx in range(50)]
+    serial = list(FakeApi(centres, workers=1).get_available_slots_for_all_centres(1))
+    concurrent = list(FakeApi(centres, workers=8).get_available_slots_for_all_centres(1))
+
+    assert len(serial) == 49
+    assert concurrent == serial
+
+
+def test_rate_limiter_spaces_requests():
+    limiter = RateLimiter(0.02)
+    started_at = time.monotonic()
+    for _ in range(5):
+        limiter.wait()
+
+    assert time.monotonic() - started_at >= 0.08
+
+
+def test_incremental_crawl_reuses_unchanged_day_slots(stand_in_server, tmp_path):
+    def crawl():
+        snapshot = AvailabilitySnapshot(str(tmp_path / "availability.sqlite"), max_staleness=60)
+        client = VaccinareCovidApi(session_token="token", api_url=stand_in_server.url, snapshot=snapshot)
+        return list(client.get_available_slots_for_all_centres(1))
+
+    def day_slots_requests():
+        return sum(1 for _method, path, _data in stand_in_server.requests if path == DAY_SLOTS_ENDPOINT)
+
+    first = crawl()
+    first_day_slots_requests = day_slots_requests()
+    second = crawl()
+
+    assert first_day_slots_requests > 0
+    assert second == first
+    assert day_slots_requests() == first_day_slots_requests
+
+
+def test_incremental_crawl_does_not_record_fallback_day_slots(stand_in_server, tmp_path):
+    def crawl(snapshot=None):
+        client = VaccinareCovidApi(session_token="token", api_url=stand_in_server.url, snapshot=snapshot,
+                                   cache_path=str(tmp_path / "cache"), cache_lifetime=0, fallback_cache_lifetime=3600)
+        return list(client.get_available_slots_for_all_centres(1))
+
+    first = crawl()
+    stand_in_server.statuses = [500] * 1000
+    snapshot = AvailabilitySnapshot(str(tmp_path / "availability.sqlite"))
+
+    assert crawl(snapshot) == first
+    assert snapshot._connection().execute("SELECT COUNT(*) FROM day_slots").fetchone()[0] == 0
+
+
+def test_adaptive_rate_limiter_backs_off_on_throttling():
+    limiter = RateLimiter(0.1, adaptive=True, max_rate=12, increase=1, cooldown=60)
+    for _ in range(5):
+        limiter.record_response(0.01, 200)
+    assert limiter.rate == 12
+
+    limiter.record_response(0.01, 429)
+    limiter.record_response(0.01, 503)
+    assert limiter.rate == 6
+
+
+def test_circuit_breaker_falls_back_to_the_cache_while_open(stand_in_server, tmp_path):
+    client = VaccinareCovidApi(session_token="token", api_url=stand_in_server.url, cache_path=str(tmp_path),
+                               cache_lifetime=0, fallback_cache_lifetime=3600,
+                               circuit_breaker=CircuitBreaker(failure_threshold=2, reset_timeout=0.2))
+    counties = client.get_counties()
+
+    stand_in_server.statuses = [500, 500, 500]
+    assert client.get_counties() == counties
+    assert client.get_counties() == counties
+    requests_sent = len(stand_in_server.requests)
+    assert client.get_counties() == counties
+    assert len(stand_in_server.requests) == requests_sent
+
+    time.sleep(0.2)
+    assert client.get_counties() == counties
+    assert client.get_counties() == counties
+    assert len(stand_in_server.requests) == requests_sent + 1
+    assert client.http.circuit_breaker.is_open
+
+    time.sleep(0.2)
+    client.get_counties()
+    assert not client.http.circuit_breaker.is_open
+
+
+def test_circuit_breaker_does_not_cut_retries_short(stand_in_server, tmp_path):
+    client = VaccinareCovidApi(session_token="token", api_url=stand_in_server.url, max_retries=10,
+                               delay_between_retries=0, circuit_breaker=CircuitBreaker(failure_threshold=5))
+    stand_in_server.statuses = [500] * 6
+
+    assert client.get_counties()
+    assert len(stand_in_server.requests) == 7
+    assert not client.http.circuit_breaker.is_open
+    assert VaccinareCovidApi().http.circuit_breaker.failure_threshold == 0
+
+
+def test_parse_date_matches_strptime():
+    for value in ("02-02-2021 08:30:00.000", "31-12-2021 23:59:59.5", "01-03-2022 00:00:00.123456"):
+        assert parse_date(value) == datetime.strptime(value, DATE_FORMAT)
+        assert parse_date(value) is parse_date(value)
+    for value in ("2021-02-02 08:30:00.000", "30-02-2021 08:30:00.000"):
+        try:
+            parse_date(value)
+            assert False, value
+        except ValueError:
+            pass
+
+
+def test_compact_slots_write_the_same_outputs(stand_in_server, tmp_path, slots_args):
+    outputs = {}
+    for compact in (False, True):
+        client = VaccinareCovidApi(session_token="token", api_url=stand_in_server.url, compact_slots=compact)
+        files = [str(tmp_path / f"{compact}.{name}") for name in ("csv", "by_centre.csv", "json")]
+        get_available_slots(client, slots_args(format=["csv", "csv_by_centre", "json"], file=files))
+        outputs[compact] = [open(path).read() for path in files]
+
+    assert outputs[True][:2] == outputs[False][:2]
+    assert json.loads(outputs[True][2]) == [dict(record, slot=dict(record["slot"], centreID=record["centre"]["id"]))
+                                            for record in json.loads(outputs[False][2])]
+
+    slot = Slot(1, parse_date("02-02-2021 09:00:00.000"), parse_date("02-02-2021 10:00:00.000"), 1)
+    assert pickle.loads(pickle.dumps(slot)) == slot
+    assert slot["startTime"] == slot.startTime
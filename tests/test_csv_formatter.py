@@ -1,5 +1,9 @@
+import random
+
 from datetime import datetime
 
+import pytest
+
 from vaccinare_covid_api.formatters import CsvFormatter
 from io import StringIO
 
@@ -42,3 +46,43 @@ def test_csv_formatter_with_date_aggregation():
 
     lt = csv.writer.dialect.lineterminator
     assert s.read() == f"ID,Date{lt}76,2021-02-09{lt}76,2021-02-10{lt}77,2021-02-11{lt}"
+
+
+def test_csv_formatter_writes_rows_in_batches():
+    s = StringIO()
+    csv = CsvFormatter(s, {"centre.id": "ID", "slot.startTime": "Date"}, flush_every=2)
+    csv.start()
+    for day in range(9, 13):
+        csv.write({"id": 76}, {"startTime": datetime.strptime(f"2021-02-{day} 19:00:00", "%Y-%m-%d %H:%M:%S")})
+    lt = csv.writer.dialect.lineterminator
+    assert s.getvalue() == f"ID,Date{lt}76,2021-02-09 19:00:00{lt}76,2021-02-10 19:00:00{lt}"
+
+    csv.end()
+    assert s.getvalue().count(lt) == 5
+
+
+@pytest.mark.parametrize("max_groups", [None, 2, 3])
+def test_grouped_csv_formatter_matches_sorted_output(max_groups):
+    header = {"centre.id": "ID", "slot.startTime.date[]": "Date"}
+    records = [({"id": centre_id}, {"startTime": datetime(2021, 2, 9 + (centre_id * idx) % 5, 19)})
+               for centre_id in range(7) for idx in range(4)]
+
+    s = StringIO()
+    csv = CsvFormatter(s, header)
+    csv.start()
+    for centre, slot in records:
+        csv.write(centre, slot)
+    csv.end()
+
+    # Every centre first appears in the sorted order, the rest of its records come later in random order
+    remaining = [record for idx, record in enumerate(records) if idx % 4]
+    random.Random(1).shuffle(remaining)
+    interleaved = records[::4] + remaining
+    grouped = StringIO()
+    csv = CsvFormatter(grouped, header, grouped=True, max_groups=max_groups)
+    csv.start()
+    for centre, slot in interleaved:
+        csv.write(centre, slot)
+    csv.end()
+
+    assert grouped.getvalue() == s.getvalue()
@@ -0,0 +1,51 @@
+import time
+
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from vaccinare_covid_api.history import AvailabilityHistory
+
+CENTRES = [{"id": 1, "name": "Centru 1", "countyName": "Alba", "localityName": "Aiud"},
+           {"id": 2, "name": "Centru 2", "countyName": "Arad", "localityName": "Arad"}]
+
+
+def sweep(hours_by_centre):
+    for centre in CENTRES:
+        for hour in hours_by_centre.get(centre["id"], []):
+            start = datetime(2021, 5, 1, hour)
+            yield centre, {"startTime": start, "endTime": start + timedelta(hours=1), "availablePlaces": 2}
+
+
+def test_history_records_crawls_and_their_changes(tmp_path):
+    history = AvailabilityHistory(str(tmp_path / "history.sqlite"))
+    since = time.time()
+    assert len(list(history.record(sweep({1: [9, 10], 2: [9]})))) == 3
+    assert list(history.record(sweep({1: [10, 11], 2: [9]}))) == list(sweep({1: [10, 11], 2: [9]}))
+
+    diff = history.diff()
+    assert [(change["centre_id"], change["start_time"].hour) for change in diff["appeared"]] == [(1, 11)]
+    assert [(change["centre_id"], change["start_time"].hour) for change in diff["gone"]] == [(1, 9)]
+    assert [change["start_time"].hour for change in history.appeared_since(since)] == [11]
+    assert [crawl["slots"] for crawl in history.crawls()] == [3, 3]
+
+    counties = history.availability_by_county(since)
+    assert [(row["county"], row["slots"], row["available_places"]) for row in counties] == [
+        ("Alba", 2, 4), ("Arad", 1, 2), ("Alba", 2, 4), ("Arad", 1, 2)]
+    assert [row["slots"] for row in history.centre_availability(1, date(2021, 5, 1))] == [2, 2]
+    assert history.centre_availability(1, date(2021, 5, 2)) == []
+
+
+def test_history_drops_interrupted_crawls(tmp_path):
+    history = AvailabilityHistory(str(tmp_path / "history.sqlite"))
+
+    def failing_sweep():
+        yield from sweep({1: [9]})
+        raise Exception("Sweep failed")
+
+    with pytest.raises(Exception, match="Sweep failed"):
+        list(history.record(failing_sweep()))
+    list(history.record(sweep({1: [9]}), scope={"county": ["Alba"]}))
+
+    assert [crawl["scope"] for crawl in history.crawls()] == [{"county": ["Alba"]}]
+    assert history.diff()["appeared"] == []
@@ -0,0 +1,58 @@
+import gzip
+import json
+import os
+
+from datetime import datetime
+
+from vaccinare_covid_api.__main__ import get_available_slots, watch
+
+
+class FakeClient:
+    def __init__(self):
+        self.crawls = 0
+
+    def get_available_slots_for_all_centres(self, months_to_check, counties=None, localities=None, centre_ids=None):
+        self.crawls += 1
+        centre = {"id": 1, "countyName": "Alba", "localityName": "Aiud", "name": "Sala", "address": "Aiud"}
+        for day, hour in ((9, 19), (9, 20), (10, 19)):
+            yield centre, {"startTime": datetime(2021, 2, day, hour), "availablePlaces": 1}
+
+
+def test_single_crawl_writes_every_output(tmp_path, slots_args):
+    files = [str(tmp_path / name) for name in ("slots.csv", "by_centre.csv", "slots.json")]
+    client = FakeClient()
+    get_available_slots(client, slots_args(format=["csv", "csv_by_centre", "json"], file=files))
+
+    with open(files[1]) as f:
+        by_centre = f.read().splitlines()
+    with open(files[2]) as f:
+        records = json.load(f)
+
+    assert client.crawls == 1
+    assert by_centre[1] == "Alba,Aiud,Sala,Aiud,2021-02-09;2021-02-10"
+    assert len(records) == 3
+    assert sum(1 for _line in open(files[0])) == 4
+
+
+def test_watch_reuses_the_client_and_replaces_outputs(tmp_path, slots_args):
+    path = str(tmp_path / "slots.csv")
+    client = FakeClient()
+    watch(client, slots_args(file=[path], interval=0, jitter=0, iterations=2))
+
+    assert client.crawls == 2
+    assert os.listdir(str(tmp_path)) == ["slots.csv"]
+
+
+def test_compressed_outputs_are_streamed(tmp_path, slots_args):
+    files = [str(tmp_path / name) for name in ("slots.csv", "slots.csv.gz", "slots.json.gz", "slots.compact.gz")]
+    get_available_slots(FakeClient(), slots_args(format=["csv", "csv", "json", "compact"], file=files))
+    with open(files[2], "rb") as f:
+        first_json = f.read()
+    get_available_slots(FakeClient(), slots_args(format=["json"], file=[files[2]]))
+
+    with open(files[0], "rb") as f:
+        assert gzip.open(files[1]).read() == f.read()
+    assert len(json.loads(gzip.open(files[2]).read())) == 3
+    assert gzip.open(files[3]).read(4) == b"VCA1"
+    with open(files[2], "rb") as f:
+        assert f.read() == first_json
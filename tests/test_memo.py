@@ -0,0 +1,55 @@
+import asyncio
+import threading
+import time
+
+from vaccinare_covid_api.aio import AsyncVaccinareCovidApi
+from vaccinare_covid_api.client import VaccinareCovidApi
+from vaccinare_covid_api.memo import RequestMemo
+
+
+def test_memo_evicts_least_recently_used_and_expired_entries():
+    memo = RequestMemo(max_entries=2, lifetime=0.05)
+    for key in ["a", "b", "a", "c"]:
+        memo.get_or_load(key, lambda: (key.upper(), True))
+
+    assert memo.get_or_load("a", lambda: ("new", True)) == ("A", False)
+    assert memo.get_or_load("b", lambda: ("new", True)) == ("new", True)
+    assert memo.get_or_load("fallback", lambda: ("stale", False)) == ("stale", True)
+    assert memo.get_or_load("fallback", lambda: ("fresh", True)) == ("fresh", True)
+
+    time.sleep(0.05)
+    assert memo.get_or_load("a", lambda: ("new", True)) == ("new", True)
+
+
+def test_identical_requests_are_sent_once(stand_in_server):
+    stand_in_server.latency = 0.05
+    client = VaccinareCovidApi(session_token="token", api_url=stand_in_server.url)
+
+    threads = [threading.Thread(target=client.get_counties) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(stand_in_server.requests) == 1
+    assert client.metrics.summary()["cache"]["county"] == {"memo": 7}
+
+    # Without a cache, responses are not kept once their request is done
+    client.get_counties()
+    assert len(stand_in_server.requests) == 2
+
+    client = VaccinareCovidApi(session_token="token", api_url=stand_in_server.url, cache_lifetime=60)
+    first = list(client.get_available_slots(1, 1))
+    requests_sent = len(stand_in_server.requests)
+    assert list(client.get_available_slots(1, 1)) == first
+    assert len(stand_in_server.requests) == requests_sent
+
+
+def test_identical_async_requests_are_sent_once(stand_in_server):
+    stand_in_server.latency = 0.05
+
+    async def get_counties():
+        async with AsyncVaccinareCovidApi(session_token="token", api_url=stand_in_server.url) as client:
+            return await asyncio.gather(*[client.get_counties() for _ in range(8)])
+
+    assert len(asyncio.run(get_counties())) == 8
+    assert len(stand_in_server.requests) == 1
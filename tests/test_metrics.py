@@ -0,0 +1,38 @@
+from vaccinare_covid_api.client import VaccinareCovidApi
+from vaccinare_covid_api.metrics import LatencyHistogram, endpoint_name
+
+
+def test_endpoint_name():
+    assert endpoint_name("/scheduling/api/centres?page=0&size=1000") == "centres"
+    assert endpoint_name("/scheduling/api/time_slots/day_slots") == "day_slots"
+
+
+def test_latency_histogram_percentiles():
+    histogram = LatencyHistogram()
+    for latency in [0.005] * 90 + [0.3] * 10:
+        histogram.add(latency)
+
+    assert histogram.percentile(50) == 0.01
+    assert histogram.percentile(95) == 0.3
+    assert histogram.to_dict()["count"] == 100
+
+
+def test_client_reports_requests_cache_and_retries(stand_in_server, tmp_path):
+    events = []
+    client = VaccinareCovidApi(session_token="token", api_url=stand_in_server.url, cache_path=str(tmp_path),
+                               cache_lifetime=60, max_retries=1, delay_between_retries=0.01, memo_lifetime=0)
+    client.add_metrics_hook(lambda event, details: events.append(event))
+
+    stand_in_server.statuses = [500]
+    client.get_counties()
+    client.get_counties()
+    summary = client.metrics.summary()
+
+    assert summary["requests"] == {"county": 2}
+    assert summary["status_codes"] == {"500": 1, "200": 1}
+    assert summary["retries"] == {"county": 1}
+    assert summary["cache"] == {"county": {"miss": 1, "hit": 1}}
+    assert summary["latency"]["county"]["count"] == 2
+    assert summary["bytes_received"] > 0
+    assert 0.005 <= summary["sleep_time"]["retry"] <= 0.01
+    assert events == ["cache", "request", "retry", "sleep", "request", "cache"]
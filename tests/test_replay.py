@@ -0,0 +1,41 @@
+import csv
+import json
+
+import requests
+
+from vaccinare_covid_api.__main__ import get_available_slots
+from vaccinare_covid_api.client import VaccinareCovidApi
+from vaccinare_covid_api.replay import RecordingTransport, ReplayTransport, generate_dataset
+
+
+def test_recorded_traffic_replays_without_the_api(stand_in_server, tmp_path):
+    recorder = RecordingTransport(requests.Session())
+    client = VaccinareCovidApi(session_token="token", api_url=stand_in_server.url, transport=recorder)
+    recorded = list(client.get_available_slots_for_all_centres(1))
+    recorder.save(str(tmp_path / "bundle.json"))
+
+    requests_sent = len(stand_in_server.requests)
+    with open(tmp_path / "bundle.json") as f:
+        replay = ReplayTransport(json.load(f))
+    client = VaccinareCovidApi(session_token="token", api_url=stand_in_server.url, transport=replay)
+
+    assert list(client.get_available_slots_for_all_centres(1)) == recorded
+    assert replay.requests == requests_sent
+    assert len(stand_in_server.requests) == requests_sent
+
+
+def test_synthetic_dataset_crawl_end_to_end(tmp_path, slots_args):
+    bundle = generate_dataset(centres=6, counties=2, months=2, days_per_month=3, slots_per_day=4)
+    expected = sum(slot["availablePlaces"] > 0 for response in bundle["responses"]
+                   if "day_slots" in response["path"] for slot in json.loads(response["body"]))
+    # Half of the requests fail at first, and are retried
+    transport = ReplayTransport(bundle, error_rate=0.5)
+    client = VaccinareCovidApi(session_token="token", transport=transport, max_retries=20, workers=3)
+
+    output = str(tmp_path / "slots.csv")
+    get_available_slots(client, slots_args(months=2, format=["csv"], file=[output]))
+
+    with open(output) as f:
+        rows = list(csv.reader(f))
+    assert len(rows) == expected + 1
+    assert client.metrics.summary()["status_codes"]["503"] > 0
@@ -0,0 +1,42 @@
+from collections import Counter
+from datetime import datetime
+
+from vaccinare_covid_api.scheduler import CrawlScheduler
+
+
+class ChangingApi:
+    """
+    Centres 0 and 1 get a new slot at every crawl, centre 2 always has the same slot and the other ones never have any
+    """
+
+    def __init__(self):
+        self.crawled = Counter()
+
+    def crawl_centres(self, centres, months_to_check):
+        for centre in centres:
+            self.crawled[centre["id"]] += 1
+            if centre["id"] < 2:
+                yield centre, {"startTime": datetime(2021, 5, 1, 9), "availablePlaces": self.crawled[centre["id"]]}
+            elif centre["id"] == 2:
+                yield centre, {"startTime": datetime(2021, 5, 1, 9), "availablePlaces": 1}
+
+
+def test_scheduler_refreshes_volatile_centres_within_the_budget(tmp_path):
+    centres = [{"id": idx} for idx in range(20)]
+    client = ChangingApi()
+    scheduler = CrawlScheduler(str(tmp_path / "schedule.sqlite"), budget=4, max_staleness=3600)
+
+    outputs = []
+    for cycle in range(12):
+        outputs.append(list(scheduler.crawl(client, centres, 1, now=cycle * 600)))
+
+    # Every cycle outputs the slots of all the centres, the volatile ones being crawled at almost every cycle, while
+    # the quiet ones are only crawled when they are about to be older than max_staleness
+    assert all([centre["id"] for centre, _slot in output] == [0, 1, 2] for output in outputs)
+    assert [slot["availablePlaces"] for _centre, slot in outputs[-1]] == [client.crawled[0], client.crawled[1], 1]
+    assert client.crawled[0] >= 10 and client.crawled[1] >= 9 and client.crawled[2] <= 3
+    assert [client.crawled[idx] for idx in range(3, 20)] == [2] * 17
+
+    restarted = CrawlScheduler(str(tmp_path / "schedule.sqlite"), budget=0, max_staleness=3600)
+    assert list(restarted.crawl(client, centres, 1, now=7000)) == outputs[-1]
+    assert [client.crawled[idx] for idx in range(3, 20)] == [2] * 17
@@ -0,0 +1,114 @@
+import gzip
+import http.client
+import json
+import threading
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from vaccinare_covid_api.__main__ import AVAILABLE_SLOTS_FORMATS, create_formatter
+from vaccinare_covid_api.server import AvailabilityServer
+
+
+def records():
+    for centre_id in range(10):
+        centre = {"id": centre_id, "name": f"Centru {centre_id}", "countyID": centre_id % 2,
+                  "countyName": "Alba" if centre_id % 2 else "Arad", "localityName": "Aiud", "address": "Strada 1"}
+        for day in range(3):
+            start = datetime(2021, 5, 1 + day, 9)
+            yield {"centre": centre, "slot": {"startTime": start, "endTime": start + timedelta(hours=1),
+                                              "availablePlaces": 1}}
+
+
+@pytest.fixture
+def server():
+    server = AvailabilityServer(("127.0.0.1", 0), AVAILABLE_SLOTS_FORMATS, create_formatter)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get(server, path, headers=None):
+    connection = http.client.HTTPConnection(*server.server_address)
+    connection.request("GET", path, headers=headers or {})
+    response = connection.getresponse()
+    body = response.read()
+    connection.close()
+    return response, body
+
+
+def test_server_filters_and_paginates_the_latest_sweep(server):
+    response, _body = get(server, "/slots")
+    assert response.status == 503
+
+    server.update(list(records()))
+    response, body = get(server, "/slots?county=alba&date=2021-05-02&size=2")
+    slots = json.loads(body)
+    assert response.status == 200
+    assert response.headers["X-Total-Count"] == "5"
+    assert [slot["centre"]["id"] for slot in slots] == [1, 3]
+    assert {slot["slot"]["startTime"] for slot in slots} == {"2021-05-02 09:00:00"}
+
+    response, _body = get(server, response.headers["Link"][1:response.headers["Link"].index(">")])
+    assert response.headers["X-Total-Count"] == "5"
+    assert "Link" in response.headers
+
+    response, body = get(server, "/slots?format=csv_by_centre&locality=Aiud&county=0")
+    assert response.headers["Content-Type"].startswith("text/csv")
+    assert len(body.decode().splitlines()) == 6
+
+
+def test_server_paginates_csv_formats_by_row(server):
+    server.update(list(records()))
+    response, body = get(server, "/slots?format=csv_by_centre&size=4&page=1")
+    assert response.headers["X-Total-Count"] == "10"
+    assert "page=2" in response.headers["Link"]
+    assert [line.split(",")[2] for line in body.decode().splitlines()[1:]] == [f"Centru {idx}" for idx in range(4, 8)]
+
+    response, body = get(server, "/slots?format=csv_by_centre&size=4&page=2")
+    assert len(body.decode().splitlines()) == 3
+    assert "Link" not in response.headers
+
+    response, body = get(server, "/slots?format=csv_by_date&county=alba&size=4&page=1")
+    assert response.headers["X-Total-Count"] == "15"
+    assert len(body.decode().splitlines()) == 5
+
+
+def test_server_renders_the_csv_rows_once_for_all_the_pages(server):
+    rendered = []
+
+    def counting_create_formatter(output_format, file, header):
+        rendered.append(output_format)
+        return create_formatter(output_format, file, header)
+
+    server.create_formatter = counting_create_formatter
+    server.update(list(records()))
+    bodies = [get(server, f"/slots?format=csv_by_centre&size=3&page={page}")[1] for page in range(4)]
+    assert sum(len(body.decode().splitlines()) - 1 for body in bodies) == 10
+    assert rendered == ["csv_by_centre"]
+
+
+def test_server_supports_etags_and_gzip(server):
+    server.update(list(records()))
+    response, body = get(server, "/slots", {"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert len(json.loads(gzip.decompress(body))) == 30
+
+    response, _body = get(server, "/slots", {"Accept-Encoding": "gzip;q=0, identity"})
+    assert "Content-Encoding" not in response.headers
+    response, body = get(server, "/slots", {"Accept-Encoding": "br;q=1.0, gzip;q=0.5"})
+    assert response.headers["Content-Encoding"] == "gzip"
+
+    etag = response.headers["ETag"]
+    response, body = get(server, "/slots", {"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert response.status == 304
+    assert body == b""
+
+    # A sweep finding the same slots keeps the ETag, a different one changes it
+    server.update(list(records()))
+    assert get(server, "/slots", {"Accept-Encoding": "gzip", "If-None-Match": etag})[0].status == 304
+    server.update(list(records())[1:])
+    assert get(server, "/slots", {"Accept-Encoding": "gzip", "If-None-Match": etag})[0].status == 200
@@ -0,0 +1,61 @@
+import functools
+import os
+
+from vaccinare_covid_api.client import VaccinareCovidApi
+from vaccinare_covid_api.metrics import CrawlMetrics
+from vaccinare_covid_api.replay import ReplayTransport, generate_dataset, load_bundle, save_bundle
+from vaccinare_covid_api.sharding import (assign_counties, merge_runs, read_run, select_shard, sharded_crawl,
+                                          write_run)
+
+
+def replay_client(bundle_path):
+    return VaccinareCovidApi(session_token="token", transport=ReplayTransport(load_bundle(bundle_path)))
+
+
+def test_counties_are_balanced_across_shards():
+    centres = [{"id": idx, "countyID": county} for idx, county in enumerate([1] * 6 + [2] * 3 + [3] * 2 + [4] * 1)]
+
+    assert assign_counties(centres, 2) == {"1": 0, "2": 1, "3": 1, "4": 1}
+    shards = [select_shard(centres, idx, 3) for idx in range(3)]
+    assert sorted(position for shard in shards for position, _centre in shard) == list(range(12))
+    assert [len(shard) for shard in shards] == [6, 3, 3]
+
+
+def test_shards_merge_into_the_order_of_a_single_crawl(tmp_path):
+    bundle_path = str(tmp_path / "bundle.json")
+    save_bundle(generate_dataset(centres=12, counties=5, months=1, days_per_month=2, slots_per_day=3), bundle_path)
+    client = replay_client(bundle_path)
+    centres = list(client.get_centres())
+    expected = list(client.crawl_centres(centres, 1))
+
+    run_paths = []
+    for shard_index in range(3):
+        indexed_centres = select_shard(centres, shard_index, 3)
+        run_paths.append(str(tmp_path / f"{shard_index}.run"))
+        with open(run_paths[-1], "wb") as run:
+            write_run(client.crawl_centres([centre for _position, centre in indexed_centres], 1),
+                      {centre["id"]: position for position, centre in indexed_centres}, run)
+        assert [position for position, _centre, _slots in read_run(run_paths[-1])] == sorted(
+            position for position, _centre, _slots in read_run(run_paths[-1]))
+
+    assert list(merge_runs(run_paths)) == expected
+    metrics = CrawlMetrics()
+    assert list(sharded_crawl(functools.partial(replay_client, bundle_path), centres, 1, processes=2,
+                              directory=str(tmp_path), metrics=metrics)) == expected
+    # The statistics of the workers are added to the ones of the parent process
+    single = replay_client(bundle_path)
+    list(single.crawl_centres(centres, 1))
+    assert metrics.summary()["requests"] == single.metrics.summary()["requests"]
+    assert metrics.summary()["latency"]["day_slots"]["count"] == single.metrics.summary()["requests"]["day_slots"]
+
+
+
+def test_sharded_crawl_creates_the_run_directory(tmp_path):
+    bundle_path = str(tmp_path / "bundle.json")
+    save_bundle(generate_dataset(centres=4, counties=2, months=1, days_per_month=1, slots_per_day=2), bundle_path)
+    centres = list(replay_client(bundle_path).get_centres())
+
+    pairs = list(sharded_crawl(functools.partial(replay_client, bundle_path), centres, 1, processes=2,
+                               directory=str(tmp_path / "var" / "cache")))
+    assert len(pairs) == 8
+    assert os.listdir(tmp_path / "var" / "cache") == []
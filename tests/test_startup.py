@@ -0,0 +1,14 @@
+import os
+import subprocess
+import sys
+
+HEAVY_MODULES = ["googleapiclient", "google_auth_oauthlib", "google.auth", "dateutil", "requests", "aiohttp", "asyncio"]
+
+
+def test_cli_does_not_import_heavy_dependencies():
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    code = "import sys, vaccinare_covid_api.__main__; print(' '.join(sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    imported = set(result.stdout.split())
+
+    assert [module for module in HEAVY_MODULES if module in imported] == []
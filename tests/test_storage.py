@@ -0,0 +1,107 @@
+import gzip
+import threading
+
+from vaccinare_covid_api.storage import GoogleDriveUploader
+
+
+class FakeRequest:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self):
+        return self.result()
+
+
+class FakeFiles:
+    """
+    In-memory stand-in for the Drive v3 `files()` resource, returning one file per page when listing
+    """
+
+    def __init__(self, drive):
+        self.drive = drive
+
+    def list(self, q, fields, pageToken=None):
+        self.drive.calls.append("list")
+        documents = self.drive.documents
+        names = sorted(documents)
+        page = int(pageToken or 0)
+        files = [{"id": documents[name]["id"], "name": name, "mimeType": documents[name]["mimeType"]}
+                 for name in names[page:page + 1]]
+        next_page_token = str(page + 1) if page + 1 < len(names) else None
+        return FakeRequest(lambda: {"files": files, "nextPageToken": next_page_token})
+
+    def create(self, body, media_body, fields):
+        def create():
+            with self.drive.lock:
+                self.drive.calls.append("create")
+                file_id = f"id-{len(self.drive.documents)}"
+                self.drive.documents[body["name"]] = {"id": file_id, "mimeType": body["mimeType"],
+                                                      "content": open(media_body._filename).read()}
+                return {"id": file_id, "mimeType": body["mimeType"]}
+        return FakeRequest(create)
+
+    def update(self, fileId, media_body):
+        def update():
+            with self.drive.lock:
+                self.drive.calls.append("update")
+                file = next(file for file in self.drive.documents.values() if file["id"] == fileId)
+                file["content"] = open(media_body._filename).read()
+        return FakeRequest(update)
+
+
+class FakeDriveService:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.documents = {}
+        self.calls = []
+
+    def files(self):
+        return FakeFiles(self)
+
+
+def test_upload_finds_existing_files_across_pages_and_skips_unchanged_content(tmp_path):
+    drive = FakeDriveService()
+    drive.documents = {f"Document {idx:02}": {"id": f"existing-{idx}", "mimeType": "text/csv", "content": ""}
+                       for idx in range(12)}
+    local_file = tmp_path / "slots.csv"
+    local_file.write_text("a,b\n")
+    index_path = str(tmp_path / "index.json")
+
+    uploader = GoogleDriveUploader(index_path=index_path, service=drive)
+    assert uploader.upload(str(local_file), "Document 11", "text/csv") is True
+    assert drive.documents["Document 11"]["content"] == "a,b\n"
+    assert drive.calls.count("list") == 12
+
+    drive.calls = []
+    uploader = GoogleDriveUploader(index_path=index_path, service=drive)
+    assert uploader.upload(str(local_file), "Document 11", "text/csv") is False
+    local_file.write_text("a,b\n1,2\n")
+    assert uploader.upload(str(local_file), "Document 11", "text/csv") is True
+    assert drive.calls == ["update"]
+
+
+def test_upload_many_uploads_every_file(tmp_path):
+    drive = FakeDriveService()
+    uploads = []
+    for idx in range(5):
+        local_file = tmp_path / f"{idx}.csv"
+        local_file.write_text(str(idx))
+        uploads.append((str(local_file), f"Document {idx}", "text/csv", "application/vnd.google-apps.spreadsheet"))
+
+    uploader = GoogleDriveUploader(index_path=None, service=drive)
+
+    assert uploader.upload_many(uploads) == [True] * 5
+    contents = {name: file["content"] for name, file in drive.documents.items()}
+    assert contents == {f"Document {idx}": str(idx) for idx in range(5)}
+
+
+def test_compressed_files_are_decompressed_for_conversion(tmp_path):
+    drive = FakeDriveService()
+    local_file = tmp_path / "slots.csv.gz"
+    local_file.write_bytes(gzip.compress(b"a,b\n1,2\n"))
+
+    uploader = GoogleDriveUploader(index_path=None, service=drive)
+
+    assert uploader.upload(str(local_file), "Slots", "text/csv", "application/vnd.google-apps.spreadsheet") is True
+    assert drive.documents["Slots"]["content"] == "a,b\n1,2\n"
+    assert list(tmp_path.iterdir()) == [local_file]
@@ -0,0 +1,42 @@
+from datetime import datetime
+from io import BytesIO, StringIO
+
+from vaccinare_covid_api.formatters import CompactFormatter, NdjsonFormatter, read_compact, read_ndjson
+
+CENTRES = [{"id": 76, "name": "Sala", "countyName": "Alba"}, {"id": 77, "name": "Spital", "countyName": "Arad"}]
+
+
+def records():
+    for centre in CENTRES:
+        for hour in (9, 10):
+            yield {"centre": centre, "slot": {"id": hour, "startTime": datetime(2021, 2, 9, hour),
+                                              "availablePlaces": 1}}
+
+
+def expected_records():
+    return [{"centre": record["centre"], "slot": {**record["slot"], "startTime": str(record["slot"]["startTime"])}}
+            for record in records()]
+
+
+def write(formatter, file):
+    formatter = formatter(file)
+    formatter.start()
+    for record in records():
+        formatter.write(record)
+    formatter.end()
+    file.seek(0)
+    return file
+
+
+def test_ndjson_round_trip():
+    file = write(NdjsonFormatter, StringIO())
+
+    assert len(file.getvalue().splitlines()) == 4
+    assert list(read_ndjson(file)) == expected_records()
+
+
+def test_compact_round_trip_writes_every_centre_once():
+    file = write(CompactFormatter, BytesIO())
+
+    assert file.getvalue().count(b'"name":"Sala"') == 1
+    assert list(read_compact(file)) == expected_records()